@@ -0,0 +1,671 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from itertools import accumulate
+
+from history_store import BorrowHistory
+from lib_management import LibrarySystem
+
+
+def synthetic_history(lib, n_records, n_students=1000):
+    """Fill lib with n_records closed loans spread over n_students"""
+    srns = [f"S{i:06d}" for i in range(n_students)]
+    for srn in srns:
+        lib.db['students'][srn] = {'name': f"Student {srn}", 'password': 'pass123'}
+
+    lib.history = BorrowHistory(synthetic_records(list(lib.db['books']), srns, n_records))
+    lib._build_indexes()
+    return srns
+
+
+def synthetic_records(book_ids, srns, n_records):
+    """Yield n_records closed loans as dicts"""
+    rng = random.Random(42)
+    for _ in range(n_records):
+        yield {
+            'srn': rng.choice(srns),
+            'student_name': '',
+            'book_id': rng.choice(book_ids),
+            'book_title': '',
+            'genre': '',
+            'borrow_date': '2025-01-01',
+            'return_date': '2025-01-08',
+            'duration': 7
+        }
+
+
+def synthetic_catalog(lib, n_books, n_students, genres=('Fiction', 'Science', 'History',
+                                                        'Technology', 'Biography')):
+    """Add n_books books and n_students students to lib and save it"""
+    for i in range(n_books):
+        lib.db['books'][f"X{i:06d}"] = {'title': f"Synthetic Title {i}",
+                                        'genre': genres[i % len(genres)],
+                                        'copies': 1, 'available': 1}
+
+    for i in range(n_students):
+        lib.db['students'][f"S{i:06d}"] = {'name': f"Student {i}", 'password': 'pass123'}
+    lib._build_indexes()
+    lib.save_database()
+
+
+def time_call(func, *args, repeat=200):
+    """Median wall time of func(*args) in microseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def bench_loans(sizes):
+    """Return/history latency as borrow_history grows"""
+    print(f"{'history rows':>12} {'borrow+return us':>18} {'student_history us':>20}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Keep snapshot compaction out of the timed window
+            lib = LibrarySystem(os.path.join(tmp, 'library_db.json'),
+                                compact_every=10 ** 9)
+            srns = synthetic_history(lib, size)
+            srn = srns[0]
+
+            def borrow_and_return():
+                lib.borrow_book(srn, 'B001')
+                lib.return_book(srn, 'B001')
+
+            loan_us = time_call(borrow_and_return)
+            history_us = time_call(lib.student_history, srn, repeat=50)
+            print(f"{size:>12,} {loan_us:>18.1f} {history_us:>20.1f}")
+
+
+def bench_memory(n_records):
+    """Bytes per borrow record: dicts as json.load returns them vs BorrowHistory"""
+    import tracemalloc
+
+    book_ids = [f"B{i:05d}" for i in range(10_000)]
+    srns = [f"S{i:06d}" for i in range(1000)]
+    data = json.dumps([{**record, 'student_name': f"Student {record['srn']}",
+                        'book_title': f"Title of {record['book_id']}", 'genre': 'Fiction'}
+                       for record in synthetic_records(book_ids, srns, n_records)])
+    for name, build in (('list of dicts', lambda: json.loads(data)),
+                        ('BorrowHistory', lambda: BorrowHistory(json.loads(data)))):
+        tracemalloc.start()
+        history = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<15} {size / n_records:>8.1f} bytes/record ({len(history):,} records)")
+        del history
+
+
+# Opens a database in a fresh interpreter and reports wall time and peak RSS
+# (VmHWM rather than ru_maxrss: on Linux the latter carries over the
+# parent's peak through fork+exec)
+COLD_START = '''
+import sys, time
+start = time.perf_counter()
+from lib_management import LibrarySystem
+LibrarySystem(sys.argv[1], journal=False)
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    peak_kb = next(line.split()[1] for line in f if line.startswith('VmHWM:'))
+print(elapsed, peak_kb)
+'''
+
+
+def cold_start(db_file):
+    """(seconds, peak RSS in MB) to open db_file in a new process"""
+    proc = subprocess.run([sys.executable, '-c', COLD_START, db_file],
+                          capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed, peak_kb = proc.stdout.split()
+    return float(elapsed), int(peak_kb) / 1024
+
+
+def bench_snapshot(sizes):
+    """Cold start and peak memory: JSON snapshot vs binary snapshot"""
+    from binary_snapshot import convert
+
+    print("binary opens map the history columns in place; the string table, books and "
+          "students are decoded eagerly")
+    print(f"{'history rows':>12} {'format':>7} {'file MB':>8} {'open s':>7} {'peak MB':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            json_file = os.path.join(tmp, 'library_db.json')
+            snap_file = os.path.join(tmp, 'library_db.snap')
+            lib = LibrarySystem(json_file, journal=False)
+            synthetic_history(lib, size)
+            lib.save_database()
+            convert(json_file, snap_file)
+            for fmt, db_file in (('json', json_file), ('binary', snap_file)):
+                elapsed, peak_mb = min(cold_start(db_file) for _ in range(3))
+                print(f"{size:>12,} {fmt:>7} {os.path.getsize(db_file) / 2 ** 20:>8.1f} "
+                      f"{elapsed:>7.2f} {peak_mb:>8.0f}")
+
+
+def _stress_worker(db_file, srn, rounds, seed):
+    """Borrow and return random books; report what this process got"""
+    lib = LibrarySystem(db_file, compact_every=50)
+    book_ids = list(lib.db['books'])
+    rng = random.Random(seed)
+    borrows = returns = 0
+    for _ in range(rounds):
+        book_id = rng.choice(book_ids)
+        if lib.borrow_book(srn, book_id).startswith("Successfully"):
+            borrows += 1
+            if lib.return_book(srn, book_id).startswith("Successfully"):
+                returns += 1
+    return borrows, returns
+
+
+def stress_test(processes, rounds):
+    """Hammer one database from several processes and check no loan is lost"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'library_db.json')
+        srns = list(LibrarySystem(db_file).db['students'])
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(
+                _stress_worker,
+                [(db_file, srns[i % len(srns)], rounds, i) for i in range(processes)])
+        elapsed = time.perf_counter() - start
+
+        borrows = sum(b for b, _ in results)
+        returns = sum(r for _, r in results)
+        lib = LibrarySystem(db_file)
+        history = lib.history
+        open_loans = [r for r in history if r['return_date'] is None]
+        # Copies off the shelf that are not waiting on the hold shelf are on loan
+        lent = Counter({b: book['copies'] - book['available'] - len(lib.holds.ready.get(b, ()))
+                        for b, book in lib.db['books'].items()})
+
+        print(f"{processes} processes x {rounds} rounds in {elapsed:.2f}s: "
+              f"{borrows} borrows, {returns} returns, {len(history)} records")
+        problems = []
+        if len(history) != borrows:
+            problems.append(f"{borrows} successful borrows but {len(history)} records")
+        if len(history) - len(open_loans) != returns:
+            problems.append(f"{returns} successful returns but "
+                            f"{len(history) - len(open_loans)} closed records")
+        if Counter(r['book_id'] for r in open_loans) != +lent:
+            problems.append("open loans do not match the copies out")
+        for problem in problems:
+            print(f"  FAIL: {problem}")
+        return bool(problems)
+
+
+async def _http_request(reader, writer, method, target, body=None, token=None):
+    """One keep-alive request; returns (status, decoded JSON)"""
+    data = json.dumps(body).encode() if body is not None else b''
+    auth = f"Authorization: Bearer {token}\r\n" if token else ""
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: bench\r\n{auth}"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def _http_client(port, srn, n_books, deadline, latencies, seed):
+    """Log in, then browse/borrow/return/history in a loop until deadline"""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    _, login = await _http_request(reader, writer, 'POST', '/login',
+                                   {'srn': srn, 'password': 'pass123'})
+    token = login['token']
+    while time.perf_counter() < deadline:
+        book_id = f"X{rng.randrange(n_books):06d}"
+        for method, target, body in (
+                ('GET', '/books?genre=Fiction&limit=20', None),
+                ('POST', '/borrow', {'book_id': book_id}),
+                ('POST', '/return', {'book_id': book_id}),
+                ('GET', '/history', None)):
+            start = time.perf_counter()
+            await _http_request(reader, writer, method, target, body, token)
+            latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+def bench_http(clients, seconds, n_books):
+    """Latency percentiles and throughput of the HTTP service under load"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'library_db.json')
+        synthetic_catalog(LibrarySystem(db_file), n_books, clients)
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, 'http_service.py', '--db', db_file, '--port', str(port)],
+            stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            server.stdout.readline()  # wait for "listening"
+            latencies = []
+
+            async def run():
+                deadline = time.perf_counter() + seconds
+                await asyncio.gather(*(
+                    _http_client(port, f"S{i:06d}", n_books, deadline, latencies, i)
+                    for i in range(clients)))
+
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{clients} clients, {len(latencies)} requests in {elapsed:.1f}s: "
+          f"{len(latencies) / elapsed:,.0f} req/s, p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+
+def synthetic_titles(n_titles, vocab_size=20_000, genres=('Fiction', 'Science', 'History',
+                                                             'Technology', 'Biography')):
+    """n_titles (book_id, title, genre) with Zipf-distributed words"""
+    rng = random.Random(42)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocab = list({''.join(rng.choices(letters, k=rng.randint(3, 10)))
+                  for _ in range(vocab_size)})
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+    return vocab, [(f"X{i:07d}", ' '.join(rng.choices(vocab, cum_weights=cum_weights,
+                                                      k=rng.randint(2, 5))),
+                    genres[i % len(genres)])
+                   for i in range(n_titles)]
+
+
+def bench_search(n_titles, max_ms):
+    """Build/load cost and query latency of the title index; fails above max_ms"""
+    from search_index import TitleIndex
+
+    vocab, catalog = synthetic_titles(n_titles)
+    start = time.perf_counter()
+    index = TitleIndex.build(catalog, signature=n_titles)
+    index.vocab  # sorted once here rather than on the first prefix query
+    build_s = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp:
+        index_file = os.path.join(tmp, 'library.search')
+        start = time.perf_counter()
+        index.save(index_file)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        index = TitleIndex.load(index_file, n_titles)
+        load_s = time.perf_counter() - start
+    print(f"{n_titles:,} titles: build {build_s:.1f}s, save {save_s:.1f}s, load {load_s:.1f}s")
+
+    common, mid = vocab[0], vocab[len(vocab) // 50]
+    rare = min(index.postings, key=lambda word: len(index.postings[word]))
+    typo = mid[:2] + mid[3:] if len(mid) > 4 else mid + 'x'
+    queries = {
+        'common word': (common,),
+        'rare word': (rare,),
+        'two words': (f"{common} {mid}",),
+        'prefix': (mid[:3],),
+        'word + prefix': (f"{common} {mid[:3]}",),
+        'fuzzy': (typo,),
+        'genre filter': (mid, 'Science'),
+        'no match': ('0000000',),
+    }
+    failed = False
+    print(f"{'query':<16} {'median us':>10} {'hits':>5}")
+    for name, args in queries.items():
+        median_us = time_call(index.search, *args)
+        print(f"{name:<16} {median_us:>10.1f} {len(index.search(*args)):>5}")
+        if median_us > max_ms * 1000:
+            failed = True
+    return failed
+
+
+# Modules the borrow/return path must not pull in at startup
+HEAVY_MODULES = ('pandas', 'numpy', 'matplotlib', 'seaborn')
+
+
+def import_profile(module):
+    """Run `python -X importtime -c 'import module'` in a fresh interpreter.
+
+    Returns (cumulative import time of module in ms, set of top-level
+    packages imported along the way).
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    total_ms = None
+    packages = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # header row
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            total_ms = int(cumulative) / 1000
+    return total_ms, packages
+
+
+def bench_startup(modules, max_ms):
+    """Import cost of the CLI modules; fails if they regress"""
+    failed = False
+    for module in modules:
+        samples = [import_profile(module) for _ in range(5)]
+        total_ms = statistics.median(ms for ms, _ in samples)
+        heavy = sorted(set(HEAVY_MODULES) & samples[0][1])
+        print(f"{module:<20} {total_ms:>8.1f} ms   heavy imports: {', '.join(heavy) or 'none'}")
+        if heavy or total_ms > max_ms:
+            failed = True
+    return failed
+
+
+# ---------------- benchmark suite ---------------- #
+
+GENRES = ('Fiction', 'Science', 'History', 'Technology', 'Biography', 'Mystery',
+          'Fantasy', 'Philosophy', 'Poetry', 'Travel', 'Art', 'Economics')
+# Slowdowns smaller than this are treated as noise, whatever the ratio
+REGRESSION_FLOOR_US = 50.0
+
+
+def zipf_weights(n, skew):
+    """Cumulative weights for picking rank r with probability ~ 1 / (r + 1) ** skew"""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(n)))
+
+
+def generate_library(db_file, n_students, n_books, n_loans, n_genres=8, skew=1.1,
+                     days=730, seed=42):
+    """Write a synthetic library to db_file (.json, .snap or .db).
+
+    Book popularity, student activity and genre sizes all follow Zipf
+    laws with exponent skew, so a few titles and readers account for
+    most loans as in a real library. Loans are spread over the last
+    `days` days with exponential durations; those still running today
+    stay open and their books are out. Returns the number of loans.
+    """
+    from datetime import date
+
+    rng = random.Random(seed)
+    genres = [GENRES[i] if i < len(GENRES) else f"Genre {i}" for i in range(n_genres)]
+    _, titles = synthetic_titles(n_books, vocab_size=max(1000, n_books // 10))
+    books = {book_id: {'title': title, 'genre': genre, 'copies': 1, 'available': 1}
+             for (book_id, title, _), genre
+             in zip(titles, rng.choices(genres, cum_weights=zipf_weights(n_genres, skew),
+                                        k=n_books))}
+    students = {f"S{i:06d}": {'name': f"Student {i}", 'password': 'pass123'}
+                for i in range(n_students)}
+
+    # Popularity ranks are shuffled so they do not follow the id order
+    book_ids, srns = list(books), list(students)
+    rng.shuffle(book_ids)
+    rng.shuffle(srns)
+    today = date.today().toordinal()
+    borrowed = sorted(rng.randrange(today - days, today + 1) for _ in range(n_loans))
+
+    def records():
+        picked_books = rng.choices(book_ids, cum_weights=zipf_weights(n_books, skew), k=n_loans)
+        picked_srns = rng.choices(srns, cum_weights=zipf_weights(n_students, skew), k=n_loans)
+        for borrow_day, book_id, srn in zip(borrowed, picked_books, picked_srns):
+            book = books[book_id]
+            duration = 1 + int(rng.expovariate(1 / 10))
+            if borrow_day + duration > today and book['available']:
+                book['available'] -= 1
+                return_date = duration = None
+            else:
+                duration = min(duration, today - borrow_day)
+                return_date = date.fromordinal(borrow_day + duration).isoformat()
+            yield {'srn': srn, 'student_name': students[srn]['name'],
+                   'book_id': book_id, 'book_title': book['title'], 'genre': book['genre'],
+                   'borrow_date': date.fromordinal(borrow_day).isoformat(),
+                   'return_date': return_date, 'duration': duration}
+
+    history = BorrowHistory(list(records()))
+    if os.path.splitext(db_file)[1] in ('.db', '.sqlite', '.sqlite3'):
+        from sqlite_backend import migrate_json_to_sqlite
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_file = os.path.join(tmp, 'library_db.json')
+            _write_library(json_file, books, students, history)
+            migrate_json_to_sqlite(json_file, db_file)
+    else:
+        _write_library(db_file, books, students, history)
+    return len(history)
+
+
+def _write_library(db_file, books, students, history):
+    lib = LibrarySystem(db_file, journal=False)
+    lib.db['books'], lib.db['students'] = books, students
+    lib.history = history
+    lib._build_indexes()
+    lib._assign_copies()
+    lib.save_database()
+
+
+def measure(calls):
+    """Median/p95 wall time in microseconds over an iterable of zero-argument calls"""
+    samples = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {'median_us': round(statistics.median(samples) * 1e6, 1),
+            'p95_us': round(samples[int(len(samples) * 0.95)] * 1e6, 1),
+            'runs': len(samples)}
+
+
+def run_suite(db_file, repeat, slow_repeat):
+    """{operation: timings} for the hot paths and every AdminAnalytics chart.
+
+    Fast operations run `repeat` times, loads, saves, DataFrame builds and
+    charts `slow_repeat` times. Console output is swallowed and charts go
+    to the non-interactive Agg backend.
+    """
+    import contextlib
+    import io
+    from functools import partial
+
+    os.environ['MPLBACKEND'] = 'Agg'
+    from lib_management import AdminAnalytics, _plotting
+
+    if os.path.splitext(db_file)[1] in ('.db', '.sqlite', '.sqlite3'):
+        from sqlite_backend import SQLiteLibrarySystem
+        lib = SQLiteLibrarySystem(db_file)
+    else:
+        # Keep snapshot compaction out of the borrow/return timings
+        lib = LibrarySystem(db_file, compact_every=10 ** 9)
+    matrix = lib.get_co_borrow_matrix()
+    top_srn = matrix.student_totals.most_common(1)[0][0]
+    top_book = matrix.book_totals.most_common(1)[0][0]
+    free_books = [book_id for genre in lib.availability_by_genre()
+                  for book_id, *_ in lib.iter_books_by_genre(genre, limit=repeat)][:repeat]
+    analytics = AdminAnalytics(lib)
+
+    def charts():
+        import matplotlib.pyplot as plt
+        for name in ('genre_analysis', 'most_borrowed_books', 'borrowing_frequency',
+                     'student_book_matrix', 'monthly_trends', 'student_ranking',
+                     'popular_genres_pie', 'duration_analysis'):
+            method = getattr(analytics, name)
+            yield name, [lambda: (method(), plt.close('all'))] * slow_repeat
+        yield 'student_book_pivot', [analytics.student_book_pivot] * slow_repeat
+        yield 'co_borrowed_books', [partial(analytics.co_borrowed_books, top_book)] * slow_repeat
+        yield 'dashboard_charts', [analytics.dashboard_charts] * slow_repeat
+
+    operations = [
+        ('load_database', [lib.load_database] * slow_repeat),
+        ('save_database', [lib.save_database] * slow_repeat),
+        ('borrow_book', [partial(lib.borrow_book, top_srn, b) for b in free_books]),
+        ('return_book', [partial(lib.return_book, top_srn, b) for b in free_books]),
+        ('student_history', [partial(lib.student_history, top_srn)] * repeat),
+        ('display_books_by_genre', [lib.display_books_by_genre] * slow_repeat),
+        ('get_borrow_df', [lib.get_borrow_df] * slow_repeat),
+    ]
+    # Import pandas and the plotting stack outside the timed calls
+    lib.get_borrow_df()
+    _plotting()
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, calls in operations:
+            results[name] = measure(calls)
+        for name, calls in charts():
+            results[f"analytics.{name}"] = measure(calls)
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """Operations whose median grew by more than tolerance (a fraction) over baseline"""
+    regressions = []
+    for name, timing in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        slower = timing['median_us'] - before['median_us']
+        if slower > REGRESSION_FLOOR_US and slower > tolerance * before['median_us']:
+            regressions.append((name, before['median_us'], timing['median_us']))
+    return regressions
+
+
+def bench_suite(args):
+    """Generate a library at the given scale, time it and compare with a baseline"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, f"library_db.{args.format}")
+        start = time.perf_counter()
+        loans = generate_library(db_file, args.students, args.books, args.loans,
+                                 args.genres, args.skew, args.days, args.seed)
+        print(f"Generated {args.students:,} students, {args.books:,} books, {loans:,} loans "
+              f"in {time.perf_counter() - start:.1f}s")
+        results = run_suite(db_file, args.repeat, args.slow_repeat)
+
+    print(f"{'operation':<34} {'median us':>12} {'p95 us':>12} {'runs':>5}")
+    for name, timing in results.items():
+        print(f"{name:<34} {timing['median_us']:>12,.1f} {timing['p95_us']:>12,.1f} "
+              f"{timing['runs']:>5}")
+
+    report = {
+        'scale': {'students': args.students, 'books': args.books, 'loans': args.loans,
+                  'genres': args.genres, 'skew': args.skew, 'days': args.days,
+                  'seed': args.seed, 'format': args.format},
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if not args.baseline:
+        return False
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['scale'] != report['scale']:
+        print(f"  WARNING: baseline was run at a different scale: {baseline['scale']}")
+    regressions = find_regressions(results, baseline['results'], args.tolerance)
+    for name, before, after in regressions:
+        print(f"  FAIL: {name} {before:,.1f} us -> {after:,.1f} us")
+    return bool(regressions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Library system benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    loans = commands.add_parser('loans', help="borrow/return/history latency vs history size")
+    loans.add_argument('--sizes', type=int, nargs='+',
+                       default=[1_000, 10_000, 100_000, 1_000_000],
+                       help="borrow_history sizes to test (e.g. add 10000000)")
+
+    memory = commands.add_parser('memory', help="bytes per borrow record in memory")
+    memory.add_argument('--records', type=int, default=1_000_000)
+
+    snapshot = commands.add_parser('snapshot', help="cold start of JSON vs binary snapshots")
+    snapshot.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+
+    startup = commands.add_parser('startup', help="import time of the CLI modules")
+    startup.add_argument('--modules', nargs='+', default=['lib_management', 'new_code'])
+    startup.add_argument('--max-ms', type=float, default=100.0,
+                         help="fail if any module takes longer than this to import")
+
+    stress = commands.add_parser('stress', help="concurrent borrow/return from many processes")
+    stress.add_argument('--processes', type=int, default=8)
+    stress.add_argument('--rounds', type=int, default=200)
+
+    http = commands.add_parser('http', help="load-test the HTTP service")
+    http.add_argument('--clients', type=int, default=50)
+    http.add_argument('--seconds', type=float, default=10.0)
+    http.add_argument('--books', type=int, default=10_000)
+
+    search = commands.add_parser('search', help="title index build cost and query latency")
+    search.add_argument('--titles', type=int, default=1_000_000)
+    search.add_argument('--max-ms', type=float, default=1.0,
+                        help="fail if any query's median latency exceeds this")
+
+    def add_scale_arguments(command):
+        command.add_argument('--students', type=int, default=2_000)
+        command.add_argument('--books', type=int, default=10_000)
+        command.add_argument('--loans', type=int, default=200_000)
+        command.add_argument('--genres', type=int, default=8)
+        command.add_argument('--skew', type=float, default=1.1,
+                             help="Zipf exponent of book, student and genre popularity")
+        command.add_argument('--days', type=int, default=730,
+                             help="loans are spread over this many days up to today")
+        command.add_argument('--seed', type=int, default=42)
+
+    generate = commands.add_parser('generate', help="write a synthetic library database")
+    generate.add_argument('db', help="new .json, .snap or .db file")
+    add_scale_arguments(generate)
+
+    suite = commands.add_parser('suite', help="time the hot paths and analytics on a "
+                                              "synthetic library, as JSON")
+    add_scale_arguments(suite)
+    suite.add_argument('--format', choices=('json', 'snap', 'db'), default='json',
+                       help="storage backend to test")
+    suite.add_argument('--repeat', type=int, default=200,
+                       help="runs of borrow/return/student_history")
+    suite.add_argument('--slow-repeat', type=int, default=3,
+                       help="runs of load/save/display/get_borrow_df and each chart")
+    suite.add_argument('--output', help="write the results to this JSON file")
+    suite.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    suite.add_argument('--tolerance', type=float, default=0.25,
+                       help="fail if a median is this fraction slower than the baseline")
+
+    args = parser.parse_args()
+    if args.command == 'loans':
+        bench_loans(args.sizes)
+    elif args.command == 'memory':
+        bench_memory(args.records)
+    elif args.command == 'snapshot':
+        bench_snapshot(args.sizes)
+    elif args.command == 'startup':
+        sys.exit(1 if bench_startup(args.modules, args.max_ms) else 0)
+    elif args.command == 'http':
+        bench_http(args.clients, args.seconds, args.books)
+    elif args.command == 'stress':
+        sys.exit(1 if stress_test(args.processes, args.rounds) else 0)
+    elif args.command == 'search':
+        sys.exit(1 if bench_search(args.titles, args.max_ms) else 0)
+    elif args.command == 'generate':
+        if os.path.exists(args.db):
+            sys.exit(f"{args.db} already exists")
+        count = generate_library(args.db, args.students, args.books, args.loans,
+                                 args.genres, args.skew, args.days, args.seed)
+        print(f"Wrote {count:,} loans to {args.db}")
+    elif args.command == 'suite':
+        sys.exit(1 if bench_suite(args) else 0)
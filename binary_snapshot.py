@@ -0,0 +1,239 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from history_store import CATEGORY_FIELDS, BorrowHistory
+
+MAGIC = b'LIBSNAP\0'
+FORMAT_VERSION = 2
+# Versions this reader understands; 1 predates multi-copy titles
+READ_VERSIONS = (1, 2)
+# magic, format version, byte order of the arrays ('<' or '>'), section count
+HEADER = struct.Struct('<8sHcxI')
+# section name, offset from the start of the file, length in bytes
+SECTION = struct.Struct('<32sQQ')
+# Sections start on this boundary so each array is aligned in the mapping
+ALIGN = 8
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+# Windows cannot replace a file while it is mapped, so there columns are copied out
+MAP_COLUMNS = os.name != 'nt'
+
+# Per-entity fields stored as columns; any others go to the meta section
+BOOK_FIELDS = ('title', 'genre', 'copies', 'available')
+STUDENT_FIELDS = ('name', 'password')
+
+
+class StringTable:
+    """Distinct strings of a snapshot, written once as one NUL-separated block"""
+
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def id(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            if '\0' in value:
+                raise ValueError(f"NUL character in {value!r}")
+            string_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return string_id
+
+    def ids_of(self, values):
+        return array('i', map(self.id, values))
+
+
+def write_binary_snapshot(f, db, history):
+    """Write db (without borrow_history) and a BorrowHistory to a binary file.
+
+    Layout: a fixed header, a table of named sections, then the sections
+    themselves. Books, students and every history column are typed
+    arrays; all strings live once in the string table and are referenced
+    by index. Small, free-form data (admin, journal_seq, extra fields)
+    goes in a JSON meta section.
+    """
+    strings = StringTable()
+    sections = {}
+
+    books = db['books']
+    sections['books.id'] = strings.ids_of(books)
+    sections['books.title'] = strings.ids_of(book['title'] for book in books.values())
+    sections['books.genre'] = strings.ids_of(book['genre'] for book in books.values())
+    sections['books.copies'] = array('i', (book['copies'] for book in books.values()))
+    sections['books.available'] = array('i', (book['available'] for book in books.values()))
+
+    students = db['students']
+    sections['students.srn'] = strings.ids_of(students)
+    sections['students.name'] = strings.ids_of(s['name'] for s in students.values())
+    sections['students.password'] = strings.ids_of(s['password'] for s in students.values())
+
+    n = len(history)
+    for field in CATEGORY_FIELDS:
+        sections[f'history.{field}.values'] = strings.ids_of(history.categories[field].values)
+        sections[f'history.{field}'] = history.codes[field][:n]
+    sections['history.borrow_date'] = history.borrow_date[:n]
+    sections['history.return_date'] = history.return_date[:n]
+    sections['history.duration'] = history.duration[:n]
+
+    meta = {key: value for key, value in db.items() if key not in ('books', 'students')}
+    meta['book_extras'] = _extras(books, BOOK_FIELDS)
+    meta['student_extras'] = _extras(students, STUDENT_FIELDS)
+    sections['meta'] = json.dumps(meta, separators=(',', ':')).encode()
+    sections['strings'] = '\0'.join(strings.values).encode()
+
+    offset = _aligned(HEADER.size + SECTION.size * len(sections))
+    table = []
+    for name, data in sections.items():
+        size = memoryview(data).nbytes
+        table.append((name, offset, size))
+        offset = _aligned(offset + size)
+
+    f.write(HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, len(sections)))
+    for name, offset, size in table:
+        f.write(SECTION.pack(name.encode(), offset, size))
+    for (name, offset, size), data in zip(table, sections.values()):
+        f.write(b'\0' * (offset - f.tell()))
+        f.write(data)
+
+
+def read_binary_snapshot(file_name):
+    """(db without borrow_history, BorrowHistory) from a binary snapshot.
+
+    The file is mapped rather than read, and the history columns are
+    int32 views of the mapping, not copies: rows are paged in as they
+    are scanned, and the mapping stays open for as long as the
+    BorrowHistory (or a frame() of it) uses them. The mapping is private
+    copy-on-write, so returning a loan from the snapshot changes this
+    process's page and never the file; snapshots are only ever replaced,
+    never rewritten in place. Books and students are decoded eagerly into
+    the db dicts the library works on, and the string table with them:
+    nearly every string in it is a book or student field, so lazy
+    decoding would skip next to nothing.
+    """
+    with open(file_name, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mm)
+    version, byte_order, sections = _section_table(mm, file_name)
+    mapped = MAP_COLUMNS and byte_order == BYTE_ORDER
+
+    def column(name, typecode='i'):
+        offset, size = sections[name]
+        if mapped:
+            return view[offset:offset + size].cast(typecode)
+        values = array(typecode)
+        values.frombytes(view[offset:offset + size])
+        if byte_order != BYTE_ORDER:
+            values.byteswap()
+        return values
+
+    def raw(name):
+        offset, size = sections[name]
+        return view[offset:offset + size].tobytes()
+
+    strings = raw('strings').decode().split('\0')
+    meta = json.loads(raw('meta'))
+
+    book_ids = [strings[i] for i in column('books.id')]
+    if version == 1:
+        # One copy per book, available as a flag
+        available = column('books.available', 'b')
+        copies = [1] * len(available)
+    else:
+        available = column('books.available')
+        copies = column('books.copies')
+    books = {
+        book_id: {'title': strings[title], 'genre': strings[genre],
+                  'copies': book_copies, 'available': book_available}
+        for book_id, title, genre, book_copies, book_available in zip(
+            book_ids, column('books.title'), column('books.genre'), copies, available)
+    }
+    srns = [strings[i] for i in column('students.srn')]
+    students = {
+        srn: {'name': strings[name], 'password': strings[password]}
+        for srn, name, password in zip(
+            srns, column('students.name'), column('students.password'))
+    }
+    for book_id, extra in meta.pop('book_extras').items():
+        books[book_id].update(extra)
+    for srn, extra in meta.pop('student_extras').items():
+        students[srn].update(extra)
+
+    history = BorrowHistory.from_columns(
+        {field: [strings[i] for i in column(f'history.{field}.values')]
+         for field in CATEGORY_FIELDS},
+        {field: column(f'history.{field}') for field in CATEGORY_FIELDS},
+        column('history.borrow_date'), column('history.return_date'),
+        column('history.duration'))
+
+    db = {'students': students, 'books': books, **meta}
+    return db, history
+
+
+def read_binary_meta(file_name):
+    """Only the meta section of a binary snapshot; the columns are never paged in"""
+    with open(file_name, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        _, _, sections = _section_table(mm, file_name)
+        offset, size = sections['meta']
+        return json.loads(mm[offset:offset + size])
+
+
+def _section_table(mm, file_name):
+    """(format version, byte order, {section name: (offset, size)}) from a mapped snapshot"""
+    magic, version, byte_order, count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{file_name}: not a library snapshot")
+    if version not in READ_VERSIONS:
+        raise ValueError(f"{file_name}: unsupported snapshot version {version}")
+
+    sections = {}
+    for i in range(count):
+        name, offset, size = SECTION.unpack_from(mm, HEADER.size + i * SECTION.size)
+        sections[name.rstrip(b'\0').decode()] = (offset, size)
+    return version, byte_order, sections
+
+
+def convert(source, dest):
+    """Convert a snapshot between JSON and binary, by file extension.
+
+    Any journal next to source is replayed first, so dest holds the
+    current state. Returns the number of borrow records written.
+    """
+    from lib_management import BINARY_EXTENSIONS, LibrarySystem, write_json_snapshot
+
+    if os.path.exists(dest):
+        raise FileExistsError(f"{dest} already exists")
+    lib = LibrarySystem(source)
+    with open(dest, 'wb') as f:
+        if os.path.splitext(dest)[1] in BINARY_EXTENSIONS:
+            write_binary_snapshot(f, lib.snapshot_db(), lib.history)
+        else:
+            write_json_snapshot(f, lib.snapshot_db(), lib.history)
+    return len(lib.history)
+
+
+def _extras(entities, fields):
+    """{key: fields beyond the column set} for entities that have any"""
+    extras = {}
+    for key, entity in entities.items():
+        if len(entity) > len(fields):
+            extras[key] = {name: value for name, value in entity.items() if name not in fields}
+    return extras
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a library database between JSON and the binary snapshot format")
+    parser.add_argument('source', help="existing .json or .snap database")
+    parser.add_argument('dest', help="new .json or .snap file to write")
+    args = parser.parse_args()
+    count = convert(args.source, args.dest)
+    print(f"Wrote {count} borrow records to {args.dest}")
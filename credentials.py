@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+# scrypt cost: about 50 ms and 16 MiB per hash
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+# PBKDF2-SHA256 rounds, for Pythons whose OpenSSL lacks scrypt
+PBKDF2_ROUNDS = 600_000
+SALT_BYTES = 16
+# A login session stays valid this long
+SESSION_TTL = 15 * 60
+# This many failed logins in a row lock the account...
+MAX_FAILURES = 5
+# ...for this many seconds after the last one
+LOCKOUT_SECONDS = 5 * 60
+
+
+def hash_password(password):
+    """Salted slow hash of password, as 'scheme$params$salt$hash' text"""
+    salt = os.urandom(SALT_BYTES)
+    if hasattr(hashlib, 'scrypt'):
+        digest = hashlib.scrypt(password.encode(), salt=salt,
+                                n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PBKDF2_ROUNDS)
+    return f"pbkdf2_sha256${PBKDF2_ROUNDS}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    """Whether stored is a hash from hash_password rather than plaintext"""
+    return stored.startswith(('scrypt$', 'pbkdf2_sha256$'))
+
+
+# Checked against when there is no account, so a wrong SRN takes as long as a wrong password
+_DUMMY_HASH = None
+
+
+def verify_password(password, stored):
+    """Whether password matches stored, a hash from hash_password.
+
+    Passwords not yet migrated are still stored as plaintext; those are
+    compared directly. Safe to call from worker threads: hashlib releases
+    the GIL while it hashes.
+    """
+    global _DUMMY_HASH
+    if stored is None:
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = hash_password(secrets.token_hex(8))
+        verify_password(password, _DUMMY_HASH)
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    scheme, *params, salt, digest = stored.split('$')
+    salt, digest = bytes.fromhex(salt), bytes.fromhex(digest)
+    if scheme == 'scrypt':
+        n, r, p = map(int, params)
+        computed = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                  dklen=len(digest), maxmem=256 * n * r + 2 ** 20)
+    else:
+        computed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, int(params[0]))
+    return hmac.compare_digest(computed, digest)
+
+
+def hash_passwords(passwords, workers=None):
+    """hash_password of each password on a pool of threads; hashes pass through"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    passwords = list(passwords)
+    plain = [password for password in passwords if not is_hashed(password)]
+    if not plain:
+        return passwords
+    with ThreadPoolExecutor(workers) as pool:
+        hashed = iter(pool.map(hash_password, plain))
+    return [password if is_hashed(password) else next(hashed) for password in passwords]
+
+
+def hash_database(db, workers=None):
+    """Hash every plaintext password of a JSON-layout db in place; returns how many"""
+    accounts = [account for account in (*db['students'].values(), db['admin'])
+                if not is_hashed(account['password'])]
+    hashed = hash_passwords((account['password'] for account in accounts), workers)
+    for account, password in zip(accounts, hashed):
+        account['password'] = password
+    return len(accounts)
+
+
+class LoginLimiter:
+    """Refuses logins for an account after MAX_FAILURES failures in a row.
+
+    The lockout lasts LOCKOUT_SECONDS from the last failure, and a run of
+    failures is forgotten once that long passes without another. Entries
+    are kept oldest failure first, so stale ones are dropped from the
+    front as new failures come in and the table stays bounded by the
+    failure rate rather than by how many SRNs are tried.
+    """
+
+    def __init__(self, max_failures=MAX_FAILURES, lockout=LOCKOUT_SECONDS):
+        self.max_failures = max_failures
+        self.lockout = lockout
+        # key -> (failures in a row, monotonic time of the last)
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, key):
+        """Seconds until key may try to log in again; 0 if it may now"""
+        failures, last = self._failures.get(key, (0, 0.0))
+        if failures < self.max_failures:
+            return 0
+        return max(0, last + self.lockout - time.monotonic())
+
+    def record(self, key, ok):
+        """Note the outcome of a login attempt"""
+        now = time.monotonic()
+        with self._lock:
+            failures, last = self._failures.pop(key, (0, 0.0))
+            if ok:
+                return
+            if now - last > self.lockout:
+                failures = 0
+            self._failures[key] = (failures + 1, now)
+            for stale, (_, when) in list(self._failures.items()):
+                if now - when <= self.lockout:
+                    break
+                del self._failures[stale]
+
+
+class SessionCache:
+    """Logged-in sessions by bearer token, so requests after the login
+    are authorised by a dict lookup instead of another slow hash check.
+    Tokens expire SESSION_TTL after they were issued.
+    """
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        # token -> (session, expiry), in issue order and so in expiry order
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def issue(self, session):
+        """New token for session"""
+        now = time.monotonic()
+        for token, (_, expires) in list(self._sessions.items()):
+            if expires > now:
+                break
+            del self._sessions[token]
+        token = secrets.token_hex(16)
+        self._sessions[token] = (session, now + self.ttl)
+        return token
+
+    def get(self, token):
+        """The session of token, or None if it is unknown or expired"""
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        session, expires = entry
+        if expires <= time.monotonic():
+            del self._sessions[token]
+            return None
+        return session
+
+    def revoke(self, token):
+        """End the session of token, if it has one"""
+        self._sessions.pop(token, None)
+
+
+if __name__ == "__main__":
+    from lib_management import open_library, path
+
+    parser = argparse.ArgumentParser(
+        description="Replace plaintext passwords with salted hashes")
+    parser.add_argument('--db', default=path, help="JSON, .snap or SQLite database file")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="hashing threads (default: one per CPU, plus a few)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = open_library(args.db).hash_passwords(args.workers)
+    print(f"Hashed {count} passwords in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,115 @@
+import argparse
+import os
+import re
+
+from binary_snapshot import read_binary_meta, read_binary_snapshot, write_binary_snapshot
+
+# Closed loans returned more than this many days ago are moved to the archive
+ARCHIVE_AFTER_DAYS = 365
+# <borrow month>.<archive run>.snap
+SEGMENT_RE = re.compile(r'^(\d{4}-\d{2})\.(\d+)\.snap$')
+# Fields whose values each segment lists in its meta, so lookups can pass it by
+KEY_FIELDS = ('srn', 'book_id')
+
+
+class HistoryArchive:
+    """Cold tier of borrow_history: closed loans in per-month partitions.
+
+    Each archive run writes one segment file per borrow month it touches,
+    named <YYYY-MM>.<run>.snap, in the binary snapshot format. The
+    segment's BorrowStats and co-borrow counts are precomputed into its
+    meta section, so aggregates are read without paging in any rows, as
+    are the srns and book_ids it holds, so a lookup by either only opens
+    the segments that have loans to show.
+
+    A run only counts once the database snapshot records it as
+    archive_run; segments from a later run (a crash between writing the
+    segments and saving the snapshot) still have their rows in the hot
+    history and are deleted on open.
+    """
+
+    def __init__(self, directory, committed_run):
+        self.directory = directory
+        self.segments = []
+        # path -> {field: set of the KEY_FIELDS values in that segment}, as metas are read
+        self._keys = {}
+        for file_name in sorted(os.listdir(directory)):
+            match = SEGMENT_RE.match(file_name)
+            if match is None:
+                continue
+            month, run = match.group(1), int(match.group(2))
+            path = os.path.join(directory, file_name)
+            if run > committed_run:
+                os.remove(path)
+            else:
+                self.segments.append((month, run, path))
+
+    def months(self, start=None, end=None):
+        """Segment files whose month overlaps start..end ('YYYY-MM-DD', inclusive)"""
+        return [path for month, _, path in self.segments
+                if (start is None or month >= start[:7]) and (end is None or month <= end[:7])]
+
+    def aggregates(self):
+        """The precomputed {'stats', 'co_borrow'} of every segment"""
+        metas = []
+        for _, _, path in self.segments:
+            meta = read_binary_meta(path)
+            self._keys[path] = _segment_keys(meta)
+            metas.append(meta)
+        return metas
+
+    def histories(self, start=None, end=None, field=None, value=None):
+        """BorrowHistory of each segment in start..end, oldest month first.
+
+        With field (one of KEY_FIELDS), only segments holding a loan
+        whose field is value.
+        """
+        for path in self.months(start, end):
+            if field is not None:
+                keys = self._keys.get(path)
+                if keys is None:
+                    keys = self._keys[path] = _segment_keys(read_binary_meta(path))
+                if value not in keys[field]:
+                    continue
+            yield read_binary_snapshot(path)[1]
+
+    def write_run(self, run, partitions):
+        """Write {month: BorrowHistory} as segments of archive run `run`"""
+        from lib_management import BorrowStats, CoBorrowMatrix
+
+        for month, history in sorted(partitions.items()):
+            meta = {'books': {}, 'students': {},
+                    'stats': BorrowStats().add_history(history).to_dict(),
+                    'co_borrow': CoBorrowMatrix().add_history(history).to_dict(),
+                    'keys': {field: history.categories[field].values for field in KEY_FIELDS}}
+            path = os.path.join(self.directory, f"{month}.{run}.snap")
+            tmp_file = path + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                write_binary_snapshot(f, meta, history)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, path)
+            self.segments.append((month, run, path))
+            self._keys[path] = _segment_keys(meta)
+        self.segments.sort()
+
+
+def _segment_keys(meta):
+    """{field: set of values} for the KEY_FIELDS of a segment, from its meta"""
+    if 'keys' in meta:
+        return {field: set(values) for field, values in meta['keys'].items()}
+    # Segments from before the lists were kept: their co-borrow pairs name every loan
+    pairs = meta['co_borrow']['pairs']
+    return {'srn': {srn for srn, _, _ in pairs}, 'book_id': {book_id for _, book_id, _ in pairs}}
+
+
+if __name__ == "__main__":
+    from lib_management import open_library, path
+
+    parser = argparse.ArgumentParser(description="Move old closed loans to the history archive")
+    parser.add_argument('--db', default=path, help="JSON or .snap database file")
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive loans returned more than this many days ago")
+    args = parser.parse_args()
+    count = open_library(args.db).archive_history(args.days)
+    print(f"Archived {count} borrow records")
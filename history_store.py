@@ -0,0 +1,331 @@
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from datetime import date
+from functools import lru_cache
+
+HISTORY_FIELDS = ('srn', 'student_name', 'book_id', 'book_title', 'genre',
+                  'borrow_date', 'return_date', 'duration')
+# Columns stored as codes into a table of distinct strings
+CATEGORY_FIELDS = ('srn', 'student_name', 'book_id', 'book_title', 'genre')
+# Marks a missing return_date or duration in the int32 columns
+NULL = -2 ** 31
+# Rows allocated the first time a history grows
+MIN_CAPACITY = 1024
+# date.toordinal() of 1970-01-01
+EPOCH_ORDINAL = 719163
+
+
+@lru_cache(maxsize=65536)
+def iso_date(ordinal):
+    """'YYYY-MM-DD' for a date ordinal"""
+    return date.fromordinal(ordinal).isoformat()
+
+
+@lru_cache(maxsize=65536)
+def date_ordinal(day):
+    """Date ordinal of a 'YYYY-MM-DD' string"""
+    return date.fromisoformat(day).toordinal()
+
+
+class Categories:
+    """Distinct strings of one column, each stored once and referenced by code"""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class HistoryRecord(Mapping):
+    """Read-only view of one borrow record, decoded field by field on access"""
+
+    __slots__ = ('_history', 'row')
+
+    def __init__(self, history, row):
+        self._history = history
+        self.row = row
+
+    def __getitem__(self, field):
+        return self._history.value(self.row, field)
+
+    def __iter__(self):
+        return iter(HISTORY_FIELDS)
+
+    def __len__(self):
+        return len(HISTORY_FIELDS)
+
+    def __repr__(self):
+        return f"HistoryRecord({dict(self)!r})"
+
+
+class BorrowHistory:
+    """borrow_history held as typed columns instead of a list of dicts.
+
+    The string fields are categorical: each row stores an int32 code and
+    the distinct strings are kept once per column. Dates are int32 date
+    ordinals and duration is int32, with NULL standing in for None. A
+    record costs 32 bytes here against several hundred as a dict.
+
+    Columns are preallocated and only ever written past the current
+    length, so zero-copy NumPy views handed out by frame() stay valid
+    while new loans are appended; growing switches to fresh arrays
+    rather than resizing ones that may be exported.
+    """
+
+    def __init__(self, records=()):
+        self.categories = {field: Categories() for field in CATEGORY_FIELDS}
+        self.codes = {field: array('i') for field in CATEGORY_FIELDS}
+        self.borrow_date = array('i')
+        self.return_date = array('i')
+        self.duration = array('i')
+        self._length = 0
+        if isinstance(records, list):
+            # Loading a snapshot: size the columns once, with room to grow
+            self._grow(len(records) + MIN_CAPACITY)
+        for record in records:
+            self.append(record)
+
+    @classmethod
+    def from_columns(cls, categories, codes, borrow_date, return_date, duration):
+        """Adopt already-encoded columns: categories {field: [value]}, the
+        rest array('i') or int32 memoryviews of equal length. The columns
+        are taken over, not copied; views are written to on return and
+        replaced by arrays the first time the history grows.
+        """
+        history = cls()
+        for field in CATEGORY_FIELDS:
+            table = history.categories[field]
+            table.values = categories[field]
+            table.codes = {value: code for code, value in enumerate(table.values)}
+        history.codes = dict(codes)
+        history.borrow_date = borrow_date
+        history.return_date = return_date
+        history.duration = duration
+        history._length = len(borrow_date)
+        return history
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for row in range(self._length):
+            yield HistoryRecord(self, row)
+
+    def record(self, row):
+        """View of one row"""
+        return HistoryRecord(self, row)
+
+    def _grow(self, capacity=None):
+        """Move every column to larger arrays (twice the capacity by default)"""
+        capacity = capacity or max(MIN_CAPACITY, 2 * len(self.borrow_date))
+        for field, column in self.codes.items():
+            self.codes[field] = _regrow(column, self._length, capacity)
+        self.borrow_date = _regrow(self.borrow_date, self._length, capacity)
+        self.return_date = _regrow(self.return_date, self._length, capacity)
+        self.duration = _regrow(self.duration, self._length, capacity)
+
+    def append(self, record):
+        """Add a borrow record (a mapping with HISTORY_FIELDS); returns its row"""
+        row = self._length
+        if row == len(self.borrow_date):
+            self._grow()
+        for field in CATEGORY_FIELDS:
+            self.codes[field][row] = self.categories[field].code(record[field])
+        self.borrow_date[row] = date_ordinal(record['borrow_date'])
+        self.return_date[row] = NULL if record['return_date'] is None \
+            else date_ordinal(record['return_date'])
+        self.duration[row] = NULL if record['duration'] is None else record['duration']
+        self._length += 1
+        return row
+
+    def set_return(self, row, return_date, duration):
+        """Close the loan in row"""
+        self.return_date[row] = date_ordinal(return_date)
+        self.duration[row] = duration
+
+    def rename(self, field, mapping):
+        """Replace values of a categorical field per mapping {old: new}.
+
+        Values renamed to the same thing end up sharing one code. The
+        column is rewritten into a fresh array, so views from frame()
+        keep the old codes.
+        """
+        table = Categories()
+        recode = [table.code(mapping.get(value, value))
+                  for value in self.categories[field].values]
+        column = array('i', self.codes[field])
+        for row in range(self._length):
+            column[row] = recode[column[row]]
+        self.categories[field] = table
+        self.codes[field] = column
+
+    def value(self, row, field):
+        """Decoded value of one field"""
+        if field in self.codes:
+            return self.categories[field].values[self.codes[field][row]]
+        if field == 'borrow_date':
+            return iso_date(self.borrow_date[row])
+        if field == 'return_date':
+            ordinal = self.return_date[row]
+            return None if ordinal == NULL else iso_date(ordinal)
+        if field == 'duration':
+            duration = self.duration[row]
+            return None if duration == NULL else duration
+        raise KeyError(field)
+
+    # ---------------- bulk scans over the code columns ---------------- #
+
+    def counts(self, field):
+        """Counter of rows per value of a categorical field"""
+        values = self.categories[field].values
+        return Counter({values[code]: count
+                        for code, count in Counter(self.codes[field][:self._length]).items()})
+
+    def day_counts(self):
+        """Counter of rows per borrow_date ('YYYY-MM-DD')"""
+        return Counter({iso_date(ordinal): count for ordinal, count
+                        in Counter(self.borrow_date[:self._length]).items()})
+
+    def pair_counts(self, first, second):
+        """Counter of rows per (first value, second value)"""
+        first_values = self.categories[first].values
+        second_values = self.categories[second].values
+        pairs = Counter(zip(self.codes[first][:self._length], self.codes[second][:self._length]))
+        return {(first_values[a], second_values[b]): count for (a, b), count in pairs.items()}
+
+    def latest(self, key, field):
+        """{key value: field value of the last row with that key}"""
+        key_values = self.categories[key].values
+        field_values = self.categories[field].values
+        pairs = dict(zip(self.codes[key][:self._length], self.codes[field][:self._length]))
+        return {key_values[a]: field_values[b] for a, b in pairs.items()}
+
+    def rows_by(self, field):
+        """{value: array of its rows} for a categorical field"""
+        groups = [array('i') for _ in self.categories[field].values]
+        for row, code in enumerate(self.codes[field][:self._length]):
+            groups[code].append(row)
+        values = self.categories[field].values
+        return {values[code]: rows for code, rows in enumerate(groups) if rows}
+
+    def open_rows(self):
+        """Rows whose loan has not been returned"""
+        return [row for row, ordinal in enumerate(self.return_date[:self._length])
+                if ordinal == NULL]
+
+    def durations_by(self, field):
+        """(Counter of summed duration, Counter of returned loans) per field value"""
+        sums, counts = Counter(), Counter()
+        values = self.categories[field].values
+        for code, returned, duration in zip(self.codes[field][:self._length],
+                                            self.return_date[:self._length],
+                                            self.duration[:self._length]):
+            if returned != NULL and duration != NULL:
+                sums[values[code]] += duration
+                counts[values[code]] += 1
+        return sums, counts
+
+    def returned_before(self, ordinal):
+        """Rows of loans returned before a date ordinal"""
+        return [row for row, returned in enumerate(self.return_date[:self._length])
+                if returned != NULL and returned < ordinal]
+
+    def rows_with(self, field, value):
+        """Rows whose categorical field equals value"""
+        code = self.categories[field].codes.get(value)
+        if code is None:
+            return []
+        return [row for row, row_code in enumerate(self.codes[field][:self._length])
+                if row_code == code]
+
+    def in_period(self, rows=None, start=None, end=None):
+        """rows borrowed between start and end ('YYYY-MM-DD', inclusive).
+
+        rows=None stands for every row, and is returned as is when there
+        is no date range to apply.
+        """
+        if start is None and end is None:
+            return rows
+        rows = range(self._length) if rows is None else rows
+        first = date_ordinal(start) if start is not None else NULL
+        last = date_ordinal(end) if end is not None else -NULL
+        borrow_date = self.borrow_date
+        return [row for row in rows if first <= borrow_date[row] <= last]
+
+    def take(self, rows):
+        """New BorrowHistory with just rows, its string tables trimmed to what they use"""
+        categories, codes = {}, {}
+        for field in CATEGORY_FIELDS:
+            column, values = self.codes[field], self.categories[field].values
+            remap, kept = {}, []
+            new_codes = array('i')
+            for row in rows:
+                code = remap.get(column[row])
+                if code is None:
+                    code = remap[column[row]] = len(kept)
+                    kept.append(values[column[row]])
+                new_codes.append(code)
+            categories[field], codes[field] = kept, new_codes
+        return BorrowHistory.from_columns(
+            categories, codes,
+            array('i', (self.borrow_date[row] for row in rows)),
+            array('i', (self.return_date[row] for row in rows)),
+            array('i', (self.duration[row] for row in rows)))
+
+    def dicts(self, rows=None):
+        """Plain dict copies of rows (all rows by default), e.g. for JSON"""
+        rows = range(self._length) if rows is None else rows
+        return [dict(HistoryRecord(self, row)) for row in rows]
+
+    def frame(self, rows=None):
+        """DataFrame of rows (all rows by default).
+
+        Over all rows the categorical columns wrap the stored code arrays
+        without copying (pandas narrows codes to int8/int16 for columns
+        with few distinct values, which costs a small copy of just those).
+        borrow_date/return_date become datetime64 and duration a nullable
+        Int32 column.
+        """
+        import numpy as np
+        import pandas as pd
+
+        n = self._length
+        if rows is None:
+            def column(values):
+                return np.frombuffer(values, dtype=np.int32, count=n)
+        else:
+            take = np.asarray(rows, dtype=np.intp)
+
+            def column(values):
+                return np.frombuffer(values, dtype=np.int32, count=n)[take]
+
+        data = {}
+        for field in CATEGORY_FIELDS:
+            data[field] = pd.Categorical.from_codes(
+                column(self.codes[field]), categories=self.categories[field].values,
+                validate=False)
+        borrow = column(self.borrow_date)
+        data['borrow_date'] = pd.to_datetime(borrow - EPOCH_ORDINAL, unit='D')
+        # return_date and duration change on return: copy so the frame is a snapshot
+        returned = column(self.return_date).copy()
+        missing = returned == NULL
+        returned[missing] = EPOCH_ORDINAL
+        data['return_date'] = pd.to_datetime(returned - EPOCH_ORDINAL, unit='D').where(~missing)
+        duration = column(self.duration).copy()
+        data['duration'] = pd.arrays.IntegerArray(duration, duration == NULL)
+        return pd.DataFrame(data, copy=False)
+
+
+def _regrow(column, length, capacity):
+    grown = array('i', bytes(4 * capacity))
+    memoryview(grown)[:length] = column[:length]
+    return grown
@@ -0,0 +1,139 @@
+from collections import deque
+from datetime import date, timedelta
+
+# Days a returned book waits on the hold shelf for the next student in line
+HOLD_PICKUP_DAYS = 3
+
+
+class HoldQueues:
+    """First-come, first-served hold queues for borrowed books.
+
+    Each book has a deque of (srn, ticket) and each student a dict of the
+    books they hold, so placing, cancelling and serving a hold are all
+    O(1): a cancelled hold only leaves a stale ticket in its deque, which
+    is skipped when it reaches the front. A returned copy with holders
+    waiting goes on the hold shelf (ready) for the first of them until
+    its pickup deadline; a title can have several copies there at once.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        # srn -> {book_id: ticket of their place in that book's queue}
+        self.by_srn = {}
+        # book_id -> live holds in its queue
+        self.waiting = {}
+        # book_id -> {srn a copy is kept for: last pickup day 'YYYY-MM-DD'}
+        self.ready = {}
+        self._tickets = 0
+
+    def __bool__(self):
+        return bool(self.by_srn or self.ready)
+
+    def holds(self, srn, book_id):
+        """Whether srn is in the queue for book_id"""
+        return book_id in self.by_srn.get(srn, ())
+
+    def is_ready(self, srn, book_id):
+        """Whether a copy of book_id is on the hold shelf for srn"""
+        return srn in self.ready.get(book_id, ())
+
+    def place(self, srn, book_id):
+        """Join the queue for book_id; returns the place in line (1 = next)"""
+        self._tickets += 1
+        self.queues.setdefault(book_id, deque()).append((srn, self._tickets))
+        self.by_srn.setdefault(srn, {})[book_id] = self._tickets
+        self.waiting[book_id] = self.waiting.get(book_id, 0) + 1
+        return self.waiting[book_id]
+
+    def cancel(self, srn, book_id):
+        """Leave the queue for book_id (its ticket is skipped later)"""
+        books = self.by_srn[srn]
+        del books[book_id]
+        if not books:
+            del self.by_srn[srn]
+        self.waiting[book_id] -= 1
+        if not self.waiting[book_id]:
+            del self.waiting[book_id], self.queues[book_id]
+
+    def next_holder(self, book_id):
+        """Take the first live hold off book_id's queue; its srn, or None"""
+        queue = self.queues.get(book_id)
+        while queue:
+            srn, ticket = queue.popleft()
+            if self.by_srn.get(srn, {}).get(book_id) == ticket:
+                self.cancel(srn, book_id)
+                return srn
+        return None
+
+    def shelve(self, book_id, day):
+        """Keep a copy for the next holder until HOLD_PICKUP_DAYS after day.
+
+        Returns the srn it is kept for, or None if nobody is waiting.
+        """
+        srn = self.next_holder(book_id)
+        if srn is None:
+            return None
+        until = date.fromisoformat(day) + timedelta(days=HOLD_PICKUP_DAYS)
+        self.ready.setdefault(book_id, {})[srn] = until.isoformat()
+        return srn
+
+    def unshelve(self, srn, book_id):
+        """Take srn's copy of book_id off the hold shelf"""
+        shelf = self.ready[book_id]
+        del shelf[srn]
+        if not shelf:
+            del self.ready[book_id]
+
+    def expired(self, today):
+        """(book_id, srn) of copies whose pickup deadline passed before today"""
+        return [(book_id, srn) for book_id, shelf in self.ready.items()
+                for srn, until in shelf.items() if until < today]
+
+    def position(self, srn, book_id):
+        """srn's place in line for book_id, counting only live holds"""
+        ticket = self.by_srn[srn][book_id]
+        place = 0
+        for other, other_ticket in self.queues[book_id]:
+            if self.by_srn.get(other, {}).get(book_id) == other_ticket:
+                place += 1
+            if other_ticket == ticket:
+                return place
+        raise KeyError(book_id)
+
+    def student_holds(self, srn):
+        """[(book_id, place in line, or None if it is ready for pickup, deadline)]"""
+        holds = [(book_id, None, shelf[srn]) for book_id, shelf in self.ready.items()
+                 if srn in shelf]
+        holds += [(book_id, self.position(srn, book_id), None)
+                  for book_id in self.by_srn.get(srn, ())]
+        return holds
+
+    def to_dict(self):
+        """JSON-friendly form: live queues in order, and the hold shelf"""
+        return {'queues': {book_id: [srn for srn, ticket in queue
+                                     if self.by_srn.get(srn, {}).get(book_id) == ticket]
+                           for book_id, queue in self.queues.items()},
+                'ready': {book_id: dict(shelf) for book_id, shelf in self.ready.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        holds = cls()
+        if data:
+            for book_id, srns in data['queues'].items():
+                for srn in srns:
+                    holds.place(srn, book_id)
+            # Before multi-copy titles a book held one [srn, until] pair
+            holds.ready = {book_id: shelf if isinstance(shelf, dict) else {shelf[0]: shelf[1]}
+                           for book_id, shelf in data['ready'].items()}
+        return holds
+
+    def renamed(self, book_ids):
+        """A copy with books renamed per {old book_id: new}; merged queues stay first-come"""
+        holds = HoldQueues()
+        live = sorted((ticket, srn, book_id) for srn, books in self.by_srn.items()
+                      for book_id, ticket in books.items())
+        for _, srn, book_id in live:
+            holds.place(srn, book_ids.get(book_id, book_id))
+        for book_id, shelf in self.ready.items():
+            holds.ready.setdefault(book_ids.get(book_id, book_id), {}).update(shelf)
+        return holds
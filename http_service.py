@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from credentials import SessionCache, verify_password
+from lib_management import open_library, path
+
+# The writer task waits this long for more commits before flushing a batch
+FLUSH_INTERVAL = 0.005
+# ...unless this many commits are already waiting
+FLUSH_BATCH = 256
+# Content type of the /metrics text exposition
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4'
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+           404: 'Not Found', 409: 'Conflict', 429: 'Too Many Requests',
+           500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class LibraryService:
+    """asyncio HTTP/JSON front-end over a LibrarySystem.
+
+    All library calls run one at a time on the single library_pool
+    thread, so they never race each other, and the event loop never
+    waits on the database lock another process may be holding. Calls
+    that write are queued for a background writer, which runs each
+    batch under one hold of the database lock: it catches up with other
+    processes, applies the batch and flushes its journal entries with
+    one fsync, and only then are those responses sent. Between batches
+    the lock is free for checkout desks sharing the database. Password
+    checks run on auth_pool threads instead, so a burst of logins does
+    not stall everyone else.
+    """
+
+    def __init__(self, lib):
+        self.lib = lib
+        self.sessions = SessionCache()
+        self.auth_pool = ThreadPoolExecutor(thread_name_prefix='auth')
+        self.library_pool = ThreadPoolExecutor(1, thread_name_prefix='library')
+        # (future, library method, args) waiting for the next batch
+        self._writes = []
+        self._commit_ready = asyncio.Event()
+        self.routes = {
+            ('POST', '/login'): self.login,
+            ('POST', '/logout'): self.logout,
+            ('GET', '/books'): self.books,
+            ('GET', '/search'): self.search,
+            ('POST', '/borrow'): self.borrow,
+            ('POST', '/return'): self.return_book,
+            ('GET', '/history'): self.history,
+            ('POST', '/hold'): self.hold,
+            ('POST', '/cancel_hold'): self.cancel_hold,
+            ('GET', '/holds'): self.holds,
+            ('GET', '/analytics'): self.analytics,
+            ('GET', '/fines'): self.fines,
+        }
+        if lib.metrics is not None:
+            self.routes[('GET', '/metrics')] = self.metrics
+
+    # ---------------- writer ---------------- #
+
+    async def writer(self):
+        """Apply queued writes in batches and wake the requests waiting on them"""
+        while True:
+            await self._commit_ready.wait()
+            if len(self._writes) < FLUSH_BATCH:
+                await asyncio.sleep(FLUSH_INTERVAL)
+            self._commit_ready.clear()
+
+            batch, self._writes = self._writes, []
+            try:
+                outcomes = await self._call(self._apply, batch)
+            except Exception as exc:
+                for waiter, _, _ in batch:
+                    waiter.set_exception(exc)
+                continue
+            for (waiter, _, _), (ok, outcome) in zip(batch, outcomes):
+                if ok:
+                    waiter.set_result(outcome)
+                else:
+                    waiter.set_exception(outcome)
+
+    def _apply(self, batch):
+        """Run a batch of writes and make them durable; [(ok, result or exception)]"""
+        with self.lib.lock:
+            # Other processes may have written since the last batch
+            self.lib.refresh()
+            outcomes = []
+            for _, method, args in batch:
+                try:
+                    outcomes.append((True, method(*args)))
+                except Exception as exc:
+                    outcomes.append((False, exc))
+            try:
+                self.lib.flush_journal()
+            except Exception:
+                # Memory is now ahead of the disk: go back to what is there
+                self.lib.load_database()
+                raise
+        return outcomes
+
+    async def _call(self, function, *args):
+        """Run function on the library thread; its result"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.library_pool, function, *args)
+
+    async def _write(self, method, *args):
+        """Call a library method that writes in the next batch; its result once on disk"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._writes.append((waiter, method, args))
+        self._commit_ready.set()
+        return await waiter
+
+    # ---------------- handlers ---------------- #
+
+    def _session(self, headers, admin=False):
+        session = self.sessions.get(_token(headers))
+        if session is None:
+            raise HTTPError(401, "Login required")
+        role, user = session
+        if admin and role != 'admin':
+            raise HTTPError(403, "Admin access required")
+        if not admin and role != 'student':
+            raise HTTPError(403, "Student access required")
+        return user
+
+    async def login(self, query, body, headers):
+        if 'srn' in body:
+            session = ('student', body['srn'].upper())
+            stored = await self._call(self.lib.student_password, session[1])
+        else:
+            session = ('admin', body.get('username', ''))
+            stored = await self._call(self.lib.admin_password, session[1])
+
+        limiter = self.lib.login_limiter
+        wait = limiter.retry_after(session)
+        if wait:
+            raise HTTPError(
+                429, f"Too many failed attempts! Try again in {int(wait) + 1} seconds.")
+        started = time.perf_counter()
+        ok = await asyncio.get_running_loop().run_in_executor(
+            self.auth_pool, verify_password, body.get('password', ''), stored)
+        if self.lib.metrics is not None:
+            await self._call(self.lib.metrics.time, 'login', time.perf_counter() - started)
+        limiter.record(session, ok)
+
+        if not ok:
+            raise HTTPError(401, "Invalid credentials!")
+        return {'token': self.sessions.issue(session), 'role': session[0],
+                'expires_in': self.sessions.ttl}
+
+    async def logout(self, query, body, headers):
+        token = _token(headers)
+        if self.sessions.get(token) is None:
+            raise HTTPError(401, "Login required")
+        self.sessions.revoke(token)
+        return {'message': "Logged out"}
+
+    async def books(self, query, body, headers):
+        available_only = query.get('available', '1') != '0'
+        genre = query.get('genre')
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 50))
+
+        def listing():
+            # Other processes may have changed the catalog since the last call
+            self.lib.refresh()
+            if genre is None:
+                return {'genres': self.lib.availability_by_genre()}
+            books = [{'book_id': book_id, 'title': title, 'available': available,
+                      'copies': copies}
+                     for book_id, title, available, copies
+                     in self.lib.iter_books_by_genre(genre, available_only, offset, limit)]
+            return {'genre': genre, 'offset': offset, 'books': books}
+
+        return await self._call(listing)
+
+    async def search(self, query, body, headers):
+        available_only = query.get('available', '0') != '0'
+        limit = int(query.get('limit', 20))
+        found = await self._call(self.lib.search_books, query.get('q', ''),
+                                 query.get('genre'), available_only, limit)
+        books = [{'book_id': book_id, **book} for book_id, book in found]
+        return {'query': query.get('q', ''), 'books': books}
+
+    async def borrow(self, query, body, headers):
+        srn = self._session(headers)
+        result = await self._write(self.lib.borrow_book, srn, body.get('book_id', '').upper())
+        if not result.startswith("Successfully"):
+            raise HTTPError(409, result)
+        return {'message': result}
+
+    async def return_book(self, query, body, headers):
+        srn = self._session(headers)
+        result = await self._write(self.lib.return_book, srn, body.get('book_id', '').upper())
+        if not result.startswith("Successfully"):
+            raise HTTPError(409, result)
+        return {'message': result}
+
+    async def hold(self, query, body, headers):
+        srn = self._session(headers)
+        result = await self._write(self.lib.place_hold, srn, body.get('book_id', '').upper())
+        if not result.startswith("Hold placed"):
+            raise HTTPError(409, result)
+        return {'message': result}
+
+    async def cancel_hold(self, query, body, headers):
+        srn = self._session(headers)
+        result = await self._write(self.lib.cancel_hold, srn, body.get('book_id', '').upper())
+        if not result.endswith("cancelled"):
+            raise HTTPError(409, result)
+        return {'message': result}
+
+    async def holds(self, query, body, headers):
+        srn = self._session(headers)
+        # Listing holds expires those past their pickup deadline, which is a write
+        holds = await self._write(self.lib.student_holds, srn)
+        return {'srn': srn, 'holds': [
+            {'book_id': book_id, 'title': title, 'place': place, 'ready_until': until}
+            for book_id, title, place, until in holds]}
+
+    async def history(self, query, body, headers):
+        srn = self._session(headers)
+        return {'srn': srn, 'history': await self._call(self.lib.student_records, srn)}
+
+    async def fines(self, query, body, headers):
+        srn = self._session(headers)
+        owed, overdue = await self._call(self.lib.amount_owed, srn)
+        return {'srn': srn, 'owed': owed, 'overdue': overdue}
+
+    async def analytics(self, query, body, headers):
+        self._session(headers, admin=True)
+        top_n = int(query.get('top', 10))
+        return await self._call(self._analytics, top_n)
+
+    def _analytics(self, top_n):
+        """The /analytics payload, built on the library thread"""
+        stats = self.lib.get_borrow_stats()
+        return {
+            'total_borrows': stats.total,
+            'by_genre': dict(stats.by_genre.most_common()),
+            'top_books': dict(stats.by_book.most_common(top_n)),
+            'top_students': dict(stats.by_student.most_common(top_n)),
+            'by_month': dict(sorted(stats.by_month.items())),
+            'average_duration': {title: stats.duration_sum[title] / count
+                                 for title, count in stats.duration_count.items()},
+        }
+
+    async def metrics(self, query, body, headers):
+        # Prometheus text format, for scrapers rather than JSON clients
+        return await self._call(lambda: self.lib.metrics.render(self.lib.record_counts()))
+
+    async def nightly_fines(self):
+        """Run the fine batch now and then just after every midnight"""
+        while True:
+            # On the library thread like every other library call; it takes
+            # about a second per few million open loans
+            await self._call(self.lib.run_fine_batch)
+            now = datetime.now()
+            midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            await asyncio.sleep((midnight - now).total_seconds())
+
+    # ---------------- HTTP plumbing ---------------- #
+
+    async def handle_connection(self, reader, writer):
+        """Serve keep-alive HTTP/1.1 requests on one connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                raw_body = b''
+                if int(headers.get('content-length', 0)):
+                    raw_body = await reader.readexactly(int(headers['content-length']))
+
+                status, payload = await self.dispatch(method, target, raw_body, headers)
+                if isinstance(payload, str):
+                    content_type, data = PROMETHEUS_TYPE, payload.encode()
+                else:
+                    content_type, data = 'application/json', json.dumps(payload).encode()
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, raw_body, headers):
+        """Route one request; returns (status, JSON payload)"""
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            return 404, {'error': f"No route for {method} {url.path}"}
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+            return 200, await handler(query, body, headers)
+        except HTTPError as exc:
+            return exc.status, {'error': exc.message}
+        except (ValueError, KeyError, AttributeError) as exc:
+            return 400, {'error': str(exc)}
+        except Exception as exc:
+            return 500, {'error': str(exc)}
+
+
+def _token(headers):
+    return headers.get('authorization', '').removeprefix('Bearer ').strip()
+
+
+async def serve(lib, host='127.0.0.1', port=8080):
+    """Run the service until cancelled"""
+    service = LibraryService(lib)
+    # Writes only happen inside the writer task's batches, which take the
+    # database lock themselves; it is never held while waiting for requests
+    lib.batch_commits = True
+    writer_task = asyncio.create_task(service.writer())
+    fines_task = asyncio.create_task(service.nightly_fines())
+    server = await asyncio.start_server(service.handle_connection, host, port, backlog=1024)
+    print(f"Library service listening on http://{host}:{port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+        fines_task.cancel()
+        service.auth_pool.shutdown(cancel_futures=True)
+        service.library_pool.shutdown(cancel_futures=True)
+        lib.batch_commits = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON API for the library system")
+    parser.add_argument('--db', default=path, help="database file (.json or .db)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(open_library(args.db), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+import argparse
+
+# Status of one copy of a title
+AVAILABLE = 'available'
+ON_LOAN = 'on_loan'
+ON_HOLD = 'on_hold'
+
+
+class CopyInventory:
+    """Status of every copy of every title.
+
+    Copies of a title are numbered 1..copies. Only those off the shelf
+    are stored, as book_id -> {copy: (status, srn)}, so idle copies cost
+    nothing, and (book_id, srn) -> copy finds the copy a student has.
+    The free copies of a title are kept in an insertion-ordered dict
+    built the first time one is taken, so taking, handing on and
+    putting back a copy are all O(1).
+    """
+
+    def __init__(self):
+        self.out = {}
+        self.by_holder = {}
+        # book_id -> {free copy: None}; popitem() gives the next one to lend
+        self._free = {}
+
+    def __bool__(self):
+        return bool(self.out)
+
+    def copy_of(self, book_id, srn):
+        """The copy of book_id srn has on loan or on hold, or None"""
+        return self.by_holder.get((book_id, srn))
+
+    def statuses(self, book_id, copies):
+        """[(copy, status, srn or None)] for copies 1..copies of book_id"""
+        out = self.out.get(book_id, {})
+        return [(copy, *out.get(copy, (AVAILABLE, None))) for copy in range(1, copies + 1)]
+
+    def take(self, book_id, copies, srn, status, copy=None):
+        """Give srn a free copy of book_id (any, or the one given); returns its number"""
+        free = self._free.get(book_id)
+        if free is None:
+            out = self.out.get(book_id, ())
+            # Highest first, so the lowest-numbered copy is lent first
+            free = self._free[book_id] = dict.fromkeys(
+                number for number in range(copies, 0, -1) if number not in out)
+        if copy is None:
+            copy, _ = free.popitem()
+        else:
+            del free[copy]
+        self.out.setdefault(book_id, {})[copy] = (status, srn)
+        self.by_holder[book_id, srn] = copy
+        return copy
+
+    def move(self, book_id, srn, status, to_srn=None):
+        """Change the status of srn's copy, passing it to to_srn if given"""
+        copy = self.by_holder.pop((book_id, srn))
+        to_srn = srn if to_srn is None else to_srn
+        self.out[book_id][copy] = (status, to_srn)
+        self.by_holder[book_id, to_srn] = copy
+        return copy
+
+    def release(self, book_id, srn):
+        """Put srn's copy back on the shelf; returns its number"""
+        copy = self.by_holder.pop((book_id, srn))
+        out = self.out[book_id]
+        del out[copy]
+        if not out:
+            del self.out[book_id]
+        free = self._free.get(book_id)
+        if free is not None:
+            free[copy] = None
+        return copy
+
+    def add(self, book_id, first, last):
+        """Shelve new copies first..last of book_id"""
+        free = self._free.get(book_id)
+        if free is not None:
+            free.update(dict.fromkeys(range(last, first - 1, -1)))
+
+    def to_dict(self):
+        """JSON-friendly form: the copies off the shelf"""
+        return {book_id: {copy: list(held) for copy, held in out.items()}
+                for book_id, out in self.out.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        inventory = cls()
+        for book_id, out in (data or {}).items():
+            for copy, (status, srn) in out.items():
+                inventory.out.setdefault(book_id, {})[int(copy)] = (status, srn)
+                inventory.by_holder[book_id, srn] = int(copy)
+        return inventory
+
+
+if __name__ == "__main__":
+    from lib_management import open_library, path
+
+    parser = argparse.ArgumentParser(
+        description="Merge books entered once per copy into multi-copy titles")
+    parser.add_argument('--db', default=path, help="JSON, .snap or SQLite database file")
+    args = parser.parse_args()
+
+    merged, skipped = open_library(args.db).merge_duplicate_titles()
+    print(f"Merged {merged} duplicate book ids into their titles")
+    if skipped:
+        print(f"Left {skipped} titles as they are: a student has two of their copies "
+              f"out or on hold; run again once those are returned")
@@ -1,328 +1,1765 @@
+import csv
 import json
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from collections import Counter, defaultdict
+from array import array
+from functools import lru_cache, partial
+from itertools import chain, islice
 import os
+import time
+
+from credentials import LoginLimiter, hash_database, hash_passwords, verify_password
+from history_store import CATEGORY_FIELDS, HISTORY_FIELDS, NULL, BorrowHistory
+from holds import HoldQueues
+from inventory import ON_HOLD, ON_LOAN, CopyInventory
+from metrics import METRICS_ENV, Metrics, timed
+from schema import SCHEMA_VERSION, VERSION_KEY, upgrade
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 path=r"C:\Volume A\VS code codesss\gitt\Libraray_management\library_db.json"
-# Set style for visualizations
-sns.set_style("whitegrid")
-plt.rcParams['figure.figsize'] = (12, 6)
+# Journaled mutations are folded into a fresh snapshot after this many entries
+COMPACT_EVERY = 1000
+# Book listings pause for input after this many lines
+PAGE_SIZE = 20
+# Seconds to wait for another process to release the database lock
+LOCK_TIMEOUT = 10
+# Rows per batch when bulk loading into a database that writes in chunks
+CHUNK_SIZE = 10_000
+# Database files with these extensions use the binary snapshot format
+BINARY_EXTENSIONS = ('.snap',)
+
+
+def sample_database():
+    """Sample data used to seed a new database"""
+    return {
+        'students': {
+            'R25EH017': {'name': 'Anish Kumar', 'password': 'pass123'},
+            'R25EH018': {'name': 'Anish Madhav', 'password': 'pass123'},
+            'R25EH032': {'name': 'Chinmay', 'password': 'pass123'},
+            'R25EH052': {'name': 'Edwin John', 'password': 'pass123'},
+        },
+        'admin': {'username': 'admin', 'password': 'admin123'},
+        'books': {
+            'B001': {'title': 'Python Programming', 'genre': 'Technology',
+                     'copies': 3, 'available': 3},
+            'B002': {'title': 'Data Science Handbook', 'genre': 'Technology',
+                     'copies': 1, 'available': 1},
+            'B003': {'title': 'The Great Gatsby', 'genre': 'Fiction',
+                     'copies': 2, 'available': 2},
+            'B004': {'title': '1984', 'genre': 'Fiction',
+                     'copies': 2, 'available': 2},
+            'B005': {'title': 'Sapiens', 'genre': 'History',
+                     'copies': 1, 'available': 1},
+            'B006': {'title': 'Educated', 'genre': 'Biography',
+                     'copies': 1, 'available': 1},
+            'B007': {'title': 'Atomic Habits', 'genre': 'Self-Help',
+                     'copies': 2, 'available': 2},
+            'B008': {'title': 'The Alchemist', 'genre': 'Fiction',
+                     'copies': 1, 'available': 1},
+            'B009': {'title': 'Machine Learning Basics', 'genre': 'Technology',
+                     'copies': 1, 'available': 1},
+            'B010': {'title': 'Brief History of Time', 'genre': 'Science',
+                     'copies': 1, 'available': 1}
+        },
+        'borrow_history': [],
+        'journal_seq': 0
+    }
+
+
+def _file_format(file_name, fmt=None):
+    """'csv' or 'jsonl', from fmt or the file extension"""
+    fmt = fmt or os.path.splitext(file_name)[1].lstrip('.').lower()
+    if fmt in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if fmt == 'csv':
+        return 'csv'
+    raise ValueError(f"{file_name}: unsupported format '{fmt}' (use csv or jsonl)")
+
+
+def read_rows(source, fmt=None):
+    """Stream (line number, dict) rows from a CSV or JSON-lines file"""
+    fmt = _file_format(source, fmt)
+    with open(source, 'r', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    raise ValueError(f"{source}: line {line_no}: invalid JSON") from None
+
+
+def _required(row, fields, where):
+    """Pull required non-empty string fields out of an import row"""
+    values = []
+    for field in fields:
+        value = row.get(field)
+        value = str(value).strip() if value is not None else ''
+        if not value:
+            raise ValueError(f"{where}: missing {field}")
+        values.append(value)
+    return values
+
+
+def parse_book_row(row, where):
+    """Validate an imported book row -> (book_id, book dict with every copy on the shelf)"""
+    book_id, title, genre = _required(row, ('book_id', 'title', 'genre'), where)
+    try:
+        copies = int(row.get('copies') or 1)
+    except ValueError:
+        raise ValueError(f"{where}: copies must be a whole number") from None
+    if copies < 1:
+        raise ValueError(f"{where}: copies must be at least 1")
+    return book_id.upper(), {'title': title, 'genre': genre, 'copies': copies, 'available': copies}
+
+
+def parse_student_row(row, where):
+    """Validate an imported student row -> (srn, student dict)"""
+    srn, name, password = _required(row, ('srn', 'name', 'password'), where)
+    return srn.upper(), {'name': name, 'password': password}
+
+
+def parse_event_row(row, where):
+    """Validate an imported borrow/return event -> (event, srn, book_id, date)"""
+    event, srn, book_id, day = _required(row, ('event', 'srn', 'book_id', 'date'), where)
+    event = event.lower()
+    if event not in ('borrow', 'return'):
+        raise ValueError(f"{where}: event must be 'borrow' or 'return'")
+    try:
+        date.fromisoformat(day)
+    except ValueError:
+        raise ValueError(f"{where}: date must be YYYY-MM-DD") from None
+    return event, srn.upper(), book_id.upper(), day
+
+
+def days_between(start, end):
+    """Whole days from one YYYY-MM-DD date to another"""
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days
+
+
+def write_rows(dest, rows, fields, fmt=None):
+    """Stream dict rows to a CSV or JSON-lines file; returns the count"""
+    fmt = _file_format(dest, fmt)
+    count = 0
+    with open(dest, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps({field: row.get(field) for field in fields}) + '\n')
+                count += 1
+    return count
+
+
+def read_json_snapshot(f):
+    """(db without borrow_history, BorrowHistory) from a JSON snapshot file.
+
+    Files in an older layout, new_code.py's included, are upgraded as
+    they are read; schema.py upgrades them on disk.
+    """
+    db = upgrade(json.load(f))
+    return db, BorrowHistory(db.pop('borrow_history'))
+
+
+def write_json_snapshot(f, db, history):
+    """Write db and history to a binary file as one JSON document.
+
+    Without indent, dumps() runs in json's C encoder (indent=4 is pure
+    Python). History goes out in CHUNK_SIZE slices, so only one slice is
+    ever expanded to dicts.
+    """
+    # The schema header, then everything but the history with its braces left off
+    f.write(f'{{"{VERSION_KEY}":{SCHEMA_VERSION},'.encode())
+    f.write(json.dumps(db, separators=(',', ':'))[1:-1].encode())
+    f.write(b',"borrow_history":[')
+    for start in range(0, len(history), CHUNK_SIZE):
+        if start:
+            f.write(b',')
+        rows = range(start, min(start + CHUNK_SIZE, len(history)))
+        f.write(json.dumps(history.dicts(rows), separators=(',', ':'))[1:-1].encode())
+    f.write(b']}')
+
+
+class FileLock:
+    """Exclusive lock shared between processes, re-entrant within one"""
+
+    def __init__(self, lock_file, timeout=LOCK_TIMEOUT):
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self._depth = 0
+        self._f = None
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._acquire()
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            self._release()
+        return False
+
+    def _acquire(self):
+        f = open(self.lock_file, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    f.close()
+                    raise TimeoutError(f"{self.lock_file} is held by another process")
+                time.sleep(0.005)
+        self._f = f
+
+    def _release(self):
+        if not fcntl:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        # Closing the file drops the flock
+        self._f.close()
+        self._f = None
+
+
+class BorrowStats:
+    """Running borrow aggregates, updated as loans are made and returned"""
+
+    COUNTERS = ('by_genre', 'by_book', 'by_student', 'by_day', 'by_month',
+                'duration_sum', 'duration_count')
+
+    def __init__(self):
+        self.total = 0
+        self.by_genre = Counter()
+        self.by_book = Counter()
+        self.by_student = Counter()
+        self.by_day = Counter()
+        self.by_month = Counter()
+        self.duration_sum = Counter()
+        self.duration_count = Counter()
+
+    def add_history(self, history):
+        """Count a whole BorrowHistory, column by column"""
+        self.total += len(history)
+        self.by_genre.update(history.counts('genre'))
+        self.by_book.update(history.counts('book_title'))
+        self.by_student.update(history.counts('student_name'))
+        by_day = history.day_counts()
+        self.by_day.update(by_day)
+        for day, count in by_day.items():
+            self.by_month[day[:7]] += count
+        duration_sum, duration_count = history.durations_by('book_title')
+        self.duration_sum.update(duration_sum)
+        self.duration_count.update(duration_count)
+        return self
+
+    def to_dict(self):
+        """Plain-dict form, for storing precomputed aggregates"""
+        return {'total': self.total,
+                **{name: dict(getattr(self, name)) for name in self.COUNTERS}}
+
+    def merge(self, counts):
+        """Add aggregates previously saved with to_dict()"""
+        self.total += counts['total']
+        for name in self.COUNTERS:
+            getattr(self, name).update(counts[name])
+
+    def add_borrow(self, record):
+        """Count a new borrow record"""
+        self.total += 1
+        self.by_genre[record['genre']] += 1
+        self.by_book[record['book_title']] += 1
+        self.by_student[record['student_name']] += 1
+        self.by_day[record['borrow_date']] += 1
+        self.by_month[record['borrow_date'][:7]] += 1
+
+    def add_return(self, record):
+        """Count the duration of a returned borrow record"""
+        self.duration_sum[record['book_title']] += record['duration']
+        self.duration_count[record['book_title']] += 1
+
+    def genre_counts(self):
+        """Borrows per genre, most borrowed first"""
+        import pandas as pd
+        return pd.Series(dict(self.by_genre.most_common()), dtype='int64')
+
+    def book_counts(self, top_n=None):
+        """Borrows per book title, most borrowed first"""
+        import pandas as pd
+        return pd.Series(dict(self.by_book.most_common(top_n)), dtype='int64')
+
+    def student_counts(self):
+        """Borrows per student, most active first"""
+        import pandas as pd
+        return pd.Series(dict(self.by_student.most_common()), dtype='int64')
+
+    def daily_counts(self):
+        """Borrows per day in date order"""
+        import pandas as pd
+        daily = pd.Series(self.by_day, dtype='int64').sort_index()
+        daily.index = pd.to_datetime(daily.index)
+        return daily
+
+    def monthly_counts(self):
+        """Borrows per month in date order"""
+        import pandas as pd
+        return pd.Series(self.by_month, dtype='int64').sort_index()
+
+    def average_durations(self):
+        """Average days borrowed per book title, longest first"""
+        import pandas as pd
+        averages = {title: self.duration_sum[title] / count
+                    for title, count in self.duration_count.items()}
+        return pd.Series(averages, dtype='float64').sort_values(ascending=False)
+
+
+class CoBorrowMatrix:
+    """Sparse student x book loan counts, stored as dicts of counters.
+
+    Only (student, book) pairs that actually occur are stored, in both
+    orientations, so memory grows with distinct loans rather than
+    students x books.
+    """
+
+    def __init__(self):
+        self.by_student = defaultdict(Counter)
+        self.by_book = defaultdict(Counter)
+        self.student_totals = Counter()
+        self.book_totals = Counter()
+        self.student_labels = {}
+        self.book_labels = {}
+        self.book_genres = {}
+        self.total = 0
+
+    def add(self, srn, book_id, student_name=None, book_title=None, genre=None, count=1):
+        """Count loans of book_id by srn"""
+        self.by_student[srn][book_id] += count
+        self.by_book[book_id][srn] += count
+        self.student_totals[srn] += count
+        self.book_totals[book_id] += count
+        self.total += count
+        if student_name is not None:
+            self.student_labels[srn] = student_name
+        if book_title is not None:
+            self.book_labels[book_id] = book_title
+        if genre is not None:
+            self.book_genres[book_id] = genre
+
+    def add_history(self, history):
+        """Count a whole BorrowHistory, column by column"""
+        for (srn, book_id), count in history.pair_counts('srn', 'book_id').items():
+            self.add(srn, book_id, count=count)
+        self.student_labels.update(history.latest('srn', 'student_name'))
+        self.book_labels.update(history.latest('book_id', 'book_title'))
+        self.book_genres.update(history.latest('book_id', 'genre'))
+        return self
+
+    def to_dict(self):
+        """Plain-dict form, for storing precomputed aggregates"""
+        return {'pairs': [[srn, book_id, count] for srn, books in self.by_student.items()
+                          for book_id, count in books.items()],
+                'student_labels': self.student_labels, 'book_labels': self.book_labels,
+                'book_genres': self.book_genres}
+
+    def merge(self, counts):
+        """Add a matrix previously saved with to_dict()"""
+        for srn, book_id, count in counts['pairs']:
+            self.add(srn, book_id, count=count)
+        self.student_labels.update(counts['student_labels'])
+        self.book_labels.update(counts['book_labels'])
+        self.book_genres.update(counts['book_genres'])
+
+    @property
+    def nnz(self):
+        """Number of stored (student, book) cells"""
+        return sum(len(books) for books in self.by_student.values())
+
+    def top_k(self, n_students=20, n_books=20):
+        """Dense DataFrame of the most active students x most borrowed books"""
+        import pandas as pd
+        students = [srn for srn, _ in self.student_totals.most_common(n_students)]
+        books = [book_id for book_id, _ in self.book_totals.most_common(n_books)]
+        cells = [[self.by_student[srn].get(book_id, 0) for book_id in books]
+                 for srn in students]
+        return pd.DataFrame(
+            cells,
+            index=[self.student_labels.get(srn, srn) for srn in students],
+            columns=[self.book_labels.get(book_id, book_id) for book_id in books],
+            dtype='int64')
+
+    def co_borrowed_with(self, book_id, top_n=10):
+        """Books most often borrowed by the same students as book_id.
+
+        Row book_id of the book x book product A^T A, computed only over
+        the students who borrowed book_id. Returns [(book_id, score)].
+        """
+        scores = Counter()
+        for srn, count in self.by_book.get(book_id, {}).items():
+            for other, other_count in self.by_student[srn].items():
+                if other != book_id:
+                    scores[other] += count * other_count
+        return scores.most_common(top_n)
 
 
 class LibrarySystem:
-    def __init__(self, db_file=path):
+    def __init__(self, db_file=path, journal=True, compact_every=COMPACT_EVERY, metrics=None):
         self.db_file = db_file
+        # A Metrics instance to record latencies and write sizes in, or None
+        self.metrics = metrics
+        self.journal = journal
+        self.journal_file = os.path.splitext(db_file)[0] + '.log'
+        self.compact_every = compact_every
+        # When set, commits queue up until flush_journal() is called
+        self.batch_commits = False
+        self._pending = []
+        self._recommender = None
+        self.search_file = os.path.splitext(db_file)[0] + '.search'
+        self._title_index = None
+        # Old closed loans are moved here by archive_history()
+        self.archive_dir = os.path.splitext(db_file)[0] + '.archive'
+        # Snapshots in the binary format are read through mmap instead of json.load
+        self.binary = os.path.splitext(db_file)[1] in BINARY_EXTENSIONS
+        # Serializes writers across processes sharing this database
+        self.lock = FileLock(os.path.splitext(db_file)[0] + '.lock')
+        # Failed logins per ('student', srn) / ('admin', username)
+        self.login_limiter = LoginLimiter()
         self.load_database()
 
+    @timed('load')
     def load_database(self):
-        """Load or create database"""
-        if os.path.exists(self.db_file):
-            with open(self.db_file, 'r') as f:
-                self.db = json.load(f)
-        else:
-            # Initialize with sample data
-            self.db = {
-                'students': {
-                    'R25EH017': {'name': 'Anish Kumar', 'password': 'pass123'},
-                    'R25EH018': {'name': 'Anish Madhav', 'password': 'pass123'},
-                    'R25EH032': {'name': 'Chinmay', 'password': 'pass123'},
-                    'R25EH052': {'name': 'Edwin John', 'password': 'pass123'},
-                },
-                'admin': {'username': 'admin', 'password': 'admin123'},
-                'books': {
-                    'B001': {'title': 'Python Programming', 'genre': 'Technology', 'available': True},
-                    'B002': {'title': 'Data Science Handbook', 'genre': 'Technology', 'available': True},
-                    'B003': {'title': 'The Great Gatsby', 'genre': 'Fiction', 'available': True},
-                    'B004': {'title': '1984', 'genre': 'Fiction', 'available': True},
-                    'B005': {'title': 'Sapiens', 'genre': 'History', 'available': True},
-                    'B006': {'title': 'Educated', 'genre': 'Biography', 'available': True},
-                    'B007': {'title': 'Atomic Habits', 'genre': 'Self-Help', 'available': True},
-                    'B008': {'title': 'The Alchemist', 'genre': 'Fiction', 'available': True},
-                    'B009': {'title': 'Machine Learning Basics', 'genre': 'Technology', 'available': True},
-                    'B010': {'title': 'Brief History of Time', 'genre': 'Science', 'available': True}
-                },
-                'borrow_history': []
-            }
-            self.save_database()
+        """Load or create database, then replay the journal on top of it"""
+        self._journal_entries = 0
+        self._journal_offset = 0
+        with self.lock:
+            if os.path.exists(self.db_file):
+                if self.binary:
+                    from binary_snapshot import read_binary_snapshot
+                    self.db, self.history = read_binary_snapshot(self.db_file)
+                else:
+                    with open(self.db_file, 'rb') as f:
+                        self.db, self.history = read_json_snapshot(f)
+                self.holds = HoldQueues.from_dict(self.db.pop('holds', None))
+                self.copies = CopyInventory.from_dict(self.db.pop('copies_out', None))
+                self._snapshot_stamp = self._stat_snapshot()
+                self.db.setdefault('journal_seq', 0)
+                self.archive = self._open_archive()
+                self._build_indexes()
+                if not self.copies and (self._open_loans or self.holds.ready):
+                    # Snapshot from before copies were tracked
+                    self._assign_copies()
+                self._replay_journal()
+            else:
+                # Initialize with sample data
+                self.db = sample_database()
+                hash_database(self.db)
+                self.history = BorrowHistory(self.db.pop('borrow_history'))
+                self.holds = HoldQueues()
+                self.copies = CopyInventory()
+                self.archive = None
+                self._build_indexes()
+                self.save_database()
 
+    def _open_archive(self):
+        """The history archive next to the database, if one has been started"""
+        if not os.path.isdir(self.archive_dir):
+            return None
+        from history_archive import HistoryArchive
+        return HistoryArchive(self.archive_dir, self.db.get('archive_run', 0))
+
+    def _stat_snapshot(self):
+        """Identity of the snapshot file on disk; changes when it is rewritten"""
+        st = os.stat(self.db_file)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def refresh(self):
+        """Catch up with changes other processes have written"""
+        with self.lock:
+            if self._stat_snapshot() != self._snapshot_stamp:
+                # Another process compacted: its journal entries are in the new snapshot
+                self.load_database()
+            else:
+                self._replay_journal()
+
+    def _build_indexes(self):
+        """Build the in-memory lookup indexes over books and borrow_history"""
+        # genre -> {'available'/'borrowed': {book_id: None} by whether a copy is on
+        # the shelf, 'copies'/'copies_available': copies in the genre / on the shelf}
+        self._genre_index = {}
+        for book_id, book in self.db['books'].items():
+            self._index_book(book_id, book)
+
+        # srn/book_id -> rows of their loans; (srn, book_id) -> row of an open loan
+        self._history_by_srn = defaultdict(partial(array, 'i'), self.history.rows_by('srn'))
+        self._history_by_book = defaultdict(partial(array, 'i'), self.history.rows_by('book_id'))
+        self._open_loans = {
+            (self.history.value(row, 'srn'), self.history.value(row, 'book_id')): row
+            for row in self.history.open_rows()}
+        # Archived months contribute their precomputed aggregates, not their rows
+        self._stats = BorrowStats()
+        self._co_borrow = CoBorrowMatrix()
+        if self.archive is not None:
+            for counts in self.archive.aggregates():
+                self._stats.merge(counts['stats'])
+                self._co_borrow.merge(counts['co_borrow'])
+        self._stats.add_history(self.history)
+        self._co_borrow.add_history(self.history)
+        # srn -> (fines owed, overdue loans) as of _owed_date
+        self._owed = {}
+        self._owed_date = None
+
+    def _index_book(self, book_id, book):
+        """Add one catalog entry to the genre index"""
+        if 'copies' not in book:
+            # Catalog entries from before multi-copy titles are a single copy
+            book['copies'] = 1
+            book['available'] = int(book['available'])
+        shelf = self._genre_index.setdefault(
+            book['genre'], {'available': {}, 'borrowed': {}, 'copies': 0, 'copies_available': 0})
+        shelf['available' if book['available'] else 'borrowed'][book_id] = None
+        shelf['copies'] += book['copies']
+        shelf['copies_available'] += book['available']
+
+    def _count_available(self, book_id, change):
+        """Change a title's count of copies on the shelf.
+
+        The title moves within the genre index when its last copy goes
+        out or its first one comes back.
+        """
+        book = self.db['books'][book_id]
+        was_available = book['available']
+        book['available'] += change
+        shelf = self._genre_index[book['genre']]
+        shelf['copies_available'] += change
+        if not was_available:
+            del shelf['borrowed'][book_id]
+            shelf['available'][book_id] = None
+        elif not book['available']:
+            del shelf['available'][book_id]
+            shelf['borrowed'][book_id] = None
+
+    def _index_record(self, record):
+        """Add one borrow record (a view into self.history) to the lookup indexes"""
+        self._history_by_srn[record['srn']].append(record.row)
+        self._history_by_book[record['book_id']].append(record.row)
+        self._stats.add_borrow(record)
+        self._co_borrow.add(record['srn'], record['book_id'], record['student_name'],
+                            record['book_title'], record['genre'])
+        if record['return_date'] is None:
+            self._open_loans[record['srn'], record['book_id']] = record.row
+        elif record['duration'] is not None:
+            self._stats.add_return(record)
+
+    @timed('save')
     def save_database(self):
-        """Save database to JSON"""
-        with open(self.db_file, 'w') as f:
-            json.dump(self.db, f, indent=4)
+        """Save a full snapshot and truncate the journal"""
+        with self.lock:
+            # Write to a temp file and rename so a crash never leaves a half-written snapshot
+            tmp_file = self.db_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                if self.binary:
+                    from binary_snapshot import write_binary_snapshot
+                    write_binary_snapshot(f, self.snapshot_db(), self.history)
+                else:
+                    write_json_snapshot(f, self.snapshot_db(), self.history)
+                f.flush()
+                os.fsync(f.fileno())
+                if self.metrics is not None:
+                    self.metrics.wrote('snapshot', f.tell())
+            os.replace(tmp_file, self.db_file)
+            self._snapshot_stamp = self._stat_snapshot()
+
+            # Entries up to journal_seq are now in the snapshot
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self._journal_entries = 0
+            self._journal_offset = 0
+
+    def snapshot_db(self):
+        """The db as a snapshot stores it, with hold queues and copies out folded back in"""
+        db = self.db
+        if self.holds:
+            db = {**db, 'holds': self.holds.to_dict()}
+        if self.copies:
+            db = {**db, 'copies_out': self.copies.to_dict()}
+        return db
+
+    def _commit(self, entry):
+        """Persist one mutation, either as a journal append or a full save"""
+        self.db['journal_seq'] += 1
+        entry['seq'] = self.db['journal_seq']
+        self._pending.append((json.dumps(entry, separators=(',', ':')) + '\n').encode())
+        if not self.batch_commits:
+            self.flush_journal()
+
+    def flush_journal(self):
+        """Write out pending commits with a single fsync; returns how many.
+
+        Commits are written immediately unless batch_commits is set, in
+        which case the caller decides when to flush (group commit).
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        with self.lock:
+            if not self.journal:
+                self.save_database()
+                return len(pending)
+
+            data = b''.join(pending)
+            with open(self.journal_file, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self.metrics is not None:
+                self.metrics.wrote('journal', len(data))
+            self._journal_offset += len(data)
+            self._journal_entries += len(pending)
+            if self._journal_entries >= self.compact_every:
+                self.save_database()
+        return len(pending)
+
+    def _replay_journal(self):
+        """Re-apply journal entries that are newer than what is in memory.
+
+        Reads from the last offset already consumed, so catching up costs
+        only the entries appended since. Must be called holding the lock.
+        """
+        if not os.path.exists(self.journal_file):
+            return
 
+        good_offset = self._journal_offset
+        with open(self.journal_file, 'rb') as f:
+            f.seek(good_offset)
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete entry')
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash: drop it and everything after it
+                    break
+                good_offset += len(line)
+
+                if entry['seq'] <= self.db['journal_seq']:
+                    continue
+                if entry['op'] == 'borrow':
+                    self._apply_borrow(entry['record'], entry.get('copy'))
+                elif entry['op'] == 'return':
+                    record = self._find_active_record(entry['srn'], entry['book_id'])
+                    self._apply_return(record, entry['return_date'], entry['duration'])
+                elif entry['op'] == 'hold':
+                    self._apply_hold(entry['srn'], entry['book_id'])
+                elif entry['op'] == 'cancel_hold':
+                    self._apply_cancel_hold(entry['srn'], entry['book_id'], entry['date'])
+                elif entry['op'] == 'expire_hold':
+                    # Entries from before multi-copy titles name only the book
+                    srn = entry.get('srn') or next(iter(self.holds.ready[entry['book_id']]))
+                    self._apply_expire_hold(entry['book_id'], srn, entry['date'])
+                self.db['journal_seq'] = entry['seq']
+                self._journal_entries += 1
+
+        if good_offset < os.path.getsize(self.journal_file):
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(good_offset)
+        self._journal_offset = good_offset
+
+    @timed('login')
     def student_login(self, srn, password):
         """Student login authentication"""
-        if srn in self.db['students']:
-            if self.db['students'][srn]['password'] == password:
-                return True
-        return False
+        return self._check_login(('student', srn), self.student_password(srn), password)
+
+    def student_password(self, srn):
+        """Stored password (a salted hash once migrated); None for an unknown srn"""
+        self.refresh()
+        student = self.db['students'].get(srn)
+        return student and student['password']
+
+    def admin_password(self, username):
+        """Stored admin password; None for any username but the admin's"""
+        admin = self.db['admin']
+        return admin['password'] if username == admin['username'] else None
+
+    def _check_login(self, account, stored, password):
+        """Verify password against stored unless account is locked out"""
+        if self.login_limiter.retry_after(account):
+            return False
+        ok = verify_password(password, stored)
+        self.login_limiter.record(account, ok)
+        return ok
+
+    def hash_passwords(self, workers=None):
+        """Replace any plaintext passwords with salted hashes; returns how many.
+
+        Each hash takes tens of milliseconds, so they are computed on a
+        pool of worker threads and saved in a single write.
+        """
+        with self.lock:
+            self.refresh()
+            count = hash_database(self.db, workers)
+            if count:
+                self.save_database()
+            return count
 
+    def get_book(self, book_id):
+        """Look up a catalog entry; None if there is no such book"""
+        return self.db['books'].get(book_id)
+
+    def get_student_name(self, srn):
+        """Look up a student's display name"""
+        return self.db['students'][srn]['name']
+
+    @timed('login')
     def admin_login(self, username, password):
         """Admin login authentication"""
-        return (username == self.db['admin']['username'] and
-                password == self.db['admin']['password'])
+        return self._check_login(('admin', username), self.admin_password(username), password)
 
     def view_available_books(self):
         """Display available books grouped by genre"""
+        import pandas as pd
+        self.refresh()
         books_df = pd.DataFrame.from_dict(self.db['books'], orient='index')
         books_df.index.name = 'Book ID'
-        available = books_df[books_df['available'] == True]
+        available = books_df[books_df['available'] > 0]
         return available
 
-    def display_books_by_genre(self, available_only=True):
-        """Display books organized by genre"""
-        books_df = pd.DataFrame.from_dict(self.db['books'], orient='index')
-        books_df['Book Code'] = books_df.index
+    def availability_by_genre(self):
+        """Per genre, in genre order: titles with a copy on the shelf and in all,
+        and copies on the shelf and in all"""
+        return {
+            genre: {'available': len(shelf['available']),
+                    'total': len(shelf['available']) + len(shelf['borrowed']),
+                    'copies_available': shelf['copies_available'],
+                    'copies': shelf['copies']}
+            for genre, shelf in sorted(self._genre_index.items())
+        }
 
-        if available_only:
-            books_df = books_df[books_df['available'] == True]
-            print("\n" + "=" * 70)
-            print("AVAILABLE BOOKS BY GENRE")
-            print("=" * 70)
-        else:
-            print("\n" + "=" * 70)
-            print("ALL BOOKS BY GENRE")
-            print("=" * 70)
+    def iter_books_by_genre(self, genre, available_only=True, offset=0, limit=None):
+        """Yield (book_id, title, copies available, copies) for one genre, available titles first"""
+        shelf = self._genre_index.get(genre)
+        if shelf is None:
+            return
+        book_ids = shelf['available']
+        if not available_only:
+            book_ids = chain(book_ids, shelf['borrowed'])
+        stop = offset + limit if limit is not None else None
+        for book_id in islice(book_ids, offset, stop):
+            book = self.db['books'][book_id]
+            yield book_id, book['title'], book['available'], book['copies']
+
+    def display_books_by_genre(self, available_only=True, page_size=None):
+        """Display books organized by genre, pausing every page_size lines"""
+        self.refresh()
+        print("\n" + "=" * 70)
+        print("AVAILABLE BOOKS BY GENRE" if available_only else "ALL BOOKS BY GENRE")
+        print("=" * 70)
 
-        if books_df.empty:
+        counts = self.availability_by_genre()
+        key = 'available' if available_only else 'total'
+        remaining = sum(count[key] for count in counts.values())
+        if not remaining:
             print("\nNo books available at the moment.")
             return
 
-        # Group by genre
-        genres = books_df['genre'].unique()
-        genres = sorted(genres)
-
-        for genre in genres:
-            genre_books = books_df[books_df['genre'] == genre]
-            print(f"\n📚 {genre.upper()}")
+        shown = 0
+        for genre, count in counts.items():
+            if not count[key]:
+                continue
+            print(f"\n📚 {genre.upper()} ({count['available']}/{count['total']} titles, "
+                  f"{count['copies_available']}/{count['copies']} copies available)")
             print("-" * 70)
 
-            for idx, row in genre_books.iterrows():
-                status = "✓ Available" if row['available'] else "✗ Borrowed"
-                print(f"  [{idx}] {row['title']:<40} {status}")
+            books = self.iter_books_by_genre(genre, available_only)
+            for book_id, title, available, copies in books:
+                print(f"  [{book_id}] {title:<40} {copy_status(available, copies)}")
+                shown += 1
+                remaining -= 1
+                if page_size and remaining and shown % page_size == 0:
+                    if input("\nPress Enter for more, or q to stop: ").strip().lower() == 'q':
+                        return
 
         print("\n" + "=" * 70)
 
+    @timed('borrow')
     def borrow_book(self, srn, book_id):
         """Borrow a book"""
-        if book_id not in self.db['books']:
-            return "Book not found!"
-
-        if not self.db['books'][book_id]['available']:
-            return "Book is currently unavailable!"
-
-        # Update book availability
-        self.db['books'][book_id]['available'] = False
-
-        # Add to borrow history
-        borrow_record = {
-            'srn': srn,
-            'student_name': self.db['students'][srn]['name'],
-            'book_id': book_id,
-            'book_title': self.db['books'][book_id]['title'],
-            'genre': self.db['books'][book_id]['genre'],
-            'borrow_date': datetime.now().strftime('%Y-%m-%d'),
-            'return_date': None,
-            'duration': None
-        }
-        self.db['borrow_history'].append(borrow_record)
-        self.save_database()
+        with self.lock:
+            # Pick up loans made at other desks before checking availability
+            self.refresh()
+            book = self.db['books'].get(book_id)
+            if book is None:
+                return "Book not found!"
+            if (srn, book_id) in self._open_loans:
+                return "You already have this book!"
+
+            # A copy kept on the hold shelf for this student will do as well as a free one
+            if not (book['available'] or self.holds.is_ready(srn, book_id)):
+                self._expire_holds()
+                if not (book['available'] or self.holds.is_ready(srn, book_id)):
+                    if book_id in self.holds.ready:
+                        return "Book is on hold for another student!"
+                    return "Book is currently unavailable! You can place a hold on it."
+
+            # Add to borrow history
+            borrow_record = {
+                'srn': srn,
+                'student_name': self.db['students'][srn]['name'],
+                'book_id': book_id,
+                'book_title': book['title'],
+                'genre': book['genre'],
+                'borrow_date': datetime.now().strftime('%Y-%m-%d'),
+                'return_date': None,
+                'duration': None
+            }
+            copy = self._apply_borrow(borrow_record)
+            self._commit({'op': 'borrow', 'record': borrow_record, 'copy': copy})
 
-        return f"Successfully borrowed '{self.db['books'][book_id]['title']}'"
+            if book['copies'] > 1:
+                return f"Successfully borrowed '{book['title']}' (copy {copy} of {book['copies']})"
+            return f"Successfully borrowed '{book['title']}'"
 
+    @timed('return')
     def return_book(self, srn, book_id):
         """Return a book"""
-        # Find the active borrow record
-        for record in reversed(self.db['borrow_history']):
-            if (record['srn'] == srn and
-                    record['book_id'] == book_id and
-                    record['return_date'] is None):
-                # Update return information
-                record['return_date'] = datetime.now().strftime('%Y-%m-%d')
-                borrow_date = datetime.strptime(record['borrow_date'], '%Y-%m-%d')
-                return_date = datetime.strptime(record['return_date'], '%Y-%m-%d')
-                record['duration'] = (return_date - borrow_date).days
-
-                # Make book available again
-                self.db['books'][book_id]['available'] = True
-                self.save_database()
-
-                return f"Successfully returned '{self.db['books'][book_id]['title']}'"
+        with self.lock:
+            self.refresh()
+            record = self._find_active_record(srn, book_id)
+            if record is None:
+                return "No active borrow record found for this book!"
+
+            # Update return information
+            return_date = datetime.now().strftime('%Y-%m-%d')
+            duration = days_between(record['borrow_date'], return_date)
+
+            held_for = self._apply_return(record, return_date, duration)
+            self._commit({'op': 'return', 'srn': srn, 'book_id': book_id,
+                          'return_date': return_date, 'duration': duration})
+
+            title = self.db['books'][book_id]['title']
+            if held_for is not None:
+                return f"Successfully returned '{title}' - it is now held for the next reader"
+            return f"Successfully returned '{title}'"
+
+    def _find_active_record(self, srn, book_id):
+        """Find the open borrow record for a student and book"""
+        row = self._open_loans.get((srn, book_id))
+        return None if row is None else self.history.record(row)
+
+    def _apply_borrow(self, record, copy=None):
+        """Apply a borrow to the in-memory database; returns the copy lent.
+
+        That is the copy kept on the hold shelf for the student if there
+        is one, else a free copy (the one given, when replaying).
+        """
+        book_id, srn = record['book_id'], record['srn']
+        if self.holds.is_ready(srn, book_id):
+            self.holds.unshelve(srn, book_id)
+            copy = self.copies.move(book_id, srn, ON_LOAN)
+        else:
+            copy = self.copies.take(book_id, self.db['books'][book_id]['copies'],
+                                    srn, ON_LOAN, copy)
+            self._count_available(book_id, -1)
+        row = self.history.append(record)
+        self._index_record(self.history.record(row))
+        self._owed.pop(srn, None)
+        return copy
+
+    def _apply_return(self, record, return_date, duration):
+        """Apply a return to the in-memory database; returns who the copy is now held for"""
+        self.history.set_return(record.row, return_date, duration)
+        del self._open_loans[record['srn'], record['book_id']]
+        self._stats.add_return(record)
+        self._owed.pop(record['srn'], None)
+        return self._pass_on(record['book_id'], record['srn'], return_date)
+
+    def _pass_on(self, book_id, srn, day):
+        """Hand srn's copy to the next student waiting, or put it back on the shelf.
+
+        Returns the srn it is now kept for, or None.
+        """
+        holder = self.holds.shelve(book_id, day)
+        if holder is None:
+            self.copies.release(book_id, srn)
+            self._count_available(book_id, 1)
+        else:
+            self.copies.move(book_id, srn, ON_HOLD, holder)
+        return holder
+
+    # ---------------- holds ---------------- #
+
+    def place_hold(self, srn, book_id):
+        """Join the queue for a borrowed book"""
+        with self.lock:
+            self.refresh()
+            if book_id not in self.db['books']:
+                return "Book not found!"
+            self._expire_holds()
+            book = self.db['books'][book_id]
+            if book['available']:
+                return "Book is available - borrow it instead!"
+            if (srn, book_id) in self._open_loans:
+                return "You already have this book!"
+            if self.holds.holds(srn, book_id) or self.holds.is_ready(srn, book_id):
+                return "You already have a hold on this book!"
+
+            place = self._apply_hold(srn, book_id)
+            self._commit({'op': 'hold', 'srn': srn, 'book_id': book_id})
+            return f"Hold placed on '{book['title']}' - you are number {place} in line"
+
+    def cancel_hold(self, srn, book_id):
+        """Give up a place in line, or a book waiting on the hold shelf"""
+        with self.lock:
+            self.refresh()
+            if not (self.holds.holds(srn, book_id) or self.holds.is_ready(srn, book_id)):
+                return "No hold found for this book!"
+
+            today = date.today().isoformat()
+            self._apply_cancel_hold(srn, book_id, today)
+            self._commit({'op': 'cancel_hold', 'srn': srn, 'book_id': book_id, 'date': today})
+            return f"Hold on '{self.db['books'][book_id]['title']}' cancelled"
+
+    def student_holds(self, srn):
+        """[(book_id, title, place in line or None once ready, pickup deadline)]"""
+        with self.lock:
+            self.refresh()
+            self._expire_holds()
+            return [(book_id, self.db['books'][book_id]['title'], place, until)
+                    for book_id, place, until in self.holds.student_holds(srn)]
+
+    def _expire_holds(self):
+        """Pass on books left on the hold shelf past their pickup deadline.
+
+        Must be called holding the lock.
+        """
+        today = date.today().isoformat()
+        for book_id, srn in self.holds.expired(today):
+            self._apply_expire_hold(book_id, srn, today)
+            self._commit({'op': 'expire_hold', 'book_id': book_id, 'srn': srn, 'date': today})
+
+    def _apply_hold(self, srn, book_id):
+        """Queue a hold in memory; returns the place in line"""
+        return self.holds.place(srn, book_id)
+
+    def _apply_cancel_hold(self, srn, book_id, day):
+        """Drop a queued or shelved hold in memory"""
+        if self.holds.is_ready(srn, book_id):
+            self._apply_expire_hold(book_id, srn, day)
+        else:
+            self.holds.cancel(srn, book_id)
+
+    def _apply_expire_hold(self, book_id, srn, day):
+        """Hand the copy shelved for srn to the next holder, or back to the shelves"""
+        self.holds.unshelve(srn, book_id)
+        self._pass_on(book_id, srn, day)
+
+    # ---------------- copies ---------------- #
+
+    def book_copies(self, book_id):
+        """[(copy, status, srn or None)] for every copy of a book"""
+        self.refresh()
+        return self.copies.statuses(book_id, self.db['books'][book_id]['copies'])
+
+    def add_copies(self, book_id, count):
+        """Put more copies of a title into circulation, serving its hold queue first"""
+        if count < 1:
+            return "Number of copies must be at least 1!"
+        with self.lock:
+            self.refresh()
+            book = self.db['books'].get(book_id)
+            if book is None:
+                return "Book not found!"
+            first = book['copies'] + 1
+            book['copies'] += count
+            self._genre_index[book['genre']]['copies'] += count
+            self.copies.add(book_id, first, book['copies'])
+            self._count_available(book_id, count)
+            self._serve_holds(book_id, date.today().isoformat())
+            self.save_database()
+            return f"'{book['title']}' now has {book['copies']} copies"
+
+    def _serve_holds(self, book_id, day):
+        """Move copies from the shelf to the hold shelf while students are queued for them"""
+        book = self.db['books'][book_id]
+        while book['available'] and self.holds.waiting.get(book_id):
+            srn = self.holds.shelve(book_id, day)
+            self.copies.take(book_id, book['copies'], srn, ON_HOLD)
+            self._count_available(book_id, -1)
+
+    def _assign_copies(self):
+        """Give each open loan and shelved hold a copy, for data from before copies were tracked"""
+        books = self.db['books']
+        for srn, book_id in self._open_loans:
+            self.copies.take(book_id, books[book_id]['copies'], srn, ON_LOAN)
+        for book_id, shelf in self.holds.ready.items():
+            for srn in shelf:
+                self.copies.take(book_id, books[book_id]['copies'], srn, ON_HOLD)
+
+    def merge_duplicate_titles(self):
+        """Fold books entered once per copy into multi-copy titles.
+
+        Books sharing a title and genre become copies of the lowest
+        book_id among them, taking their loans, holds and history along;
+        archived months keep the ids they were lent under. A title is
+        skipped while one student has two of its books out or on hold.
+        Returns (book ids merged away, titles skipped).
+        """
+        with self.lock:
+            self.refresh()
+            books = self.db['books']
+            # book_id -> students with a loan or hold on it
+            people = defaultdict(list)
+            for srn, book_id in self._open_loans:
+                people[book_id].append(srn)
+            for book_id, shelf in self.holds.ready.items():
+                people[book_id].extend(shelf)
+            for srn, held in self.holds.by_srn.items():
+                for book_id in held:
+                    people[book_id].append(srn)
+
+            titles = defaultdict(list)
+            for book_id, book in books.items():
+                titles[book['title'], book['genre']].append(book_id)
+            renames, skipped = {}, 0
+            for book_ids in titles.values():
+                if len(book_ids) < 2:
+                    continue
+                srns = [srn for book_id in book_ids for srn in people[book_id]]
+                if len(srns) != len(set(srns)):
+                    skipped += 1
+                    continue
+                keep = min(book_ids)
+                renames.update((book_id, keep) for book_id in book_ids if book_id != keep)
+            if not renames:
+                return 0, skipped
+
+            for old, new in renames.items():
+                book = books.pop(old)
+                books[new]['copies'] += book['copies']
+                books[new]['available'] += book['available']
+            self.history.rename('book_id', renames)
+            self.holds = self.holds.renamed(renames)
+            self.copies = CopyInventory()
+            self._build_indexes()
+            self._assign_copies()
+            today = date.today().isoformat()
+            for book_id in set(renames.values()):
+                self._serve_holds(book_id, today)
+
+            self._recommender = None
+            self._title_index = None
+            if os.path.exists(self.search_file):
+                os.remove(self.search_file)
+            self.save_database()
+            return len(renames), skipped
+
+    def student_records(self, srn, start=None, end=None):
+        """Get borrowing history for a student as a list of records"""
+        self.refresh()
+        return [record for history, rows in self._select('srn', srn, start, end)
+                for record in history.dicts(rows)]
+
+    def borrowed_books(self, srn):
+        """[(book_id, genre, times borrowed)] over a student's whole history"""
+        matrix = self.get_co_borrow_matrix()
+        return [(book_id, matrix.book_genres.get(book_id), count)
+                for book_id, count in matrix.by_student.get(srn, {}).items()]
+
+    def recommend_books(self, srn, top_n=5):
+        """Books this student is likely to want next: [(book_id, book)]"""
+        if self._recommender is None:
+            from recommender import Recommender
+            self._recommender = Recommender(self)
+        return self._recommender.recommend(srn, top_n)
+
+    def iter_catalog(self):
+        """Yield (book_id, title, genre) for every book"""
+        for book_id, book in self.db['books'].items():
+            yield book_id, book['title'], book['genre']
+
+    def iter_borrow_history(self):
+        """Yield every borrow record, archived months first, then the hot history"""
+        for history, rows in self._select():
+            for row in (range(len(history)) if rows is None else rows):
+                yield history.record(row)
+
+    def catalog_version(self):
+        """Changes whenever books are added to the catalog"""
+        self.refresh()
+        return len(self.db['books'])
+
+    def _title_search(self):
+        """The title index for the current catalog, loaded from disk or rebuilt"""
+        from search_index import TitleIndex
+        version = self.catalog_version()
+        if self._title_index is None or self._title_index.signature != version:
+            index = TitleIndex.load(self.search_file, version)
+            if index is None:
+                index = TitleIndex.build(self.iter_catalog(), version)
+                index.save(self.search_file)
+            self._title_index = index
+        return self._title_index
+
+    def _index_titles(self, books):
+        """Add newly imported {book_id: book} entries to a loaded title index"""
+        if self._title_index is None:
+            return
+        for book_id, book in books.items():
+            self._title_index.add(book_id, book['title'], book['genre'])
+        self._title_index.signature = self.catalog_version()
+        self._title_index.save(self.search_file)
+
+    def search_books(self, query, genre=None, available_only=False, limit=20):
+        """Books whose titles match query: [(book_id, book)].
+
+        Every word must appear in the title; the last may be a prefix and
+        misspelled words match their closest spellings.
+        """
+        index = self._title_search()
+        books = {}
+
+        def listed(book_id):
+            # An index built by another process may still name books merged away since
+            book = books[book_id] = self.get_book(book_id)
+            return book is not None and (not available_only or book['available'])
+
+        return [(book_id, books[book_id])
+                for book_id in index.search(query, genre, listed, limit)]
+
+    def _select(self, field=None, value=None, start=None, end=None):
+        """Yield (BorrowHistory, rows) for loans with field == value, borrowed in start..end.
+
+        Archived months come first and only those overlapping the date
+        range, and holding a loan with field == value, are opened; the
+        hot history is last. rows=None means all.
+        """
+        if self.archive is not None:
+            for history in self.archive.histories(start, end, field, value):
+                rows = None if field is None else history.rows_with(field, value)
+                rows = history.in_period(rows, start, end)
+                if len(history) if rows is None else rows:
+                    yield history, rows
+
+        if field is None:
+            rows = None
+        else:
+            index = self._history_by_srn if field == 'srn' else self._history_by_book
+            rows = index.get(value, ())
+        rows = self.history.in_period(rows, start, end)
+        if len(self.history) if rows is None else rows:
+            yield self.history, rows
+
+    @staticmethod
+    def _frame(parts):
+        """One DataFrame from _select() parts"""
+        import pandas as pd
+        frames = [history.frame(rows) for history, rows in parts]
+        if not frames:
+            return pd.DataFrame()
+        if len(frames) == 1:
+            return frames[0]
+        # Each part has its own categories; concat falls back to object columns
+        df = pd.concat(frames, ignore_index=True)
+        for field in CATEGORY_FIELDS:
+            df[field] = df[field].astype('category')
+        return df
+
+    def student_history(self, srn, start=None, end=None):
+        """Get borrowing history for a student, optionally only start..end"""
+        self.refresh()
+        return self._frame(self._select('srn', srn, start, end))
+
+    def book_history(self, book_id, start=None, end=None):
+        """Get borrowing history for a book, optionally only start..end"""
+        self.refresh()
+        return self._frame(self._select('book_id', book_id, start, end))
+
+    def record_counts(self):
+        """Records currently held in memory, by kind"""
+        return {'books': len(self.db['books']), 'students': len(self.db['students']),
+                'borrow_records': len(self.history), 'open_loans': len(self._open_loans),
+                'pending_commits': len(self._pending),
+                'archive_segments': len(self.archive.segments) if self.archive else 0}
+
+    def get_borrow_stats(self):
+        """Get the running borrow aggregates"""
+        self.refresh()
+        return self._stats
+
+    def borrow_count(self):
+        """Loans recorded so far, archived ones included; cheap enough to poll"""
+        self.refresh()
+        return self._stats.total
+
+    def get_co_borrow_matrix(self):
+        """Get the sparse student x book loan matrix"""
+        self.refresh()
+        return self._co_borrow
+
+    def get_borrow_df(self, start=None, end=None):
+        """Get borrow history as DataFrame, optionally only loans borrowed start..end.
+
+        Without an archive or date range this wraps the history columns.
+        """
+        import numpy as np
+        import pandas as pd
+        self.refresh()
+        df = self._frame(self._select(start=start, end=end))
+        if not df.empty:
+            months, codes = np.unique(df['borrow_date'].to_numpy().astype('datetime64[M]'),
+                                      return_inverse=True)
+            df['month'] = pd.Categorical.from_codes(codes, categories=months.astype(str))
+            return df
+        return pd.DataFrame()
 
-        return "No active borrow record found for this book!"
+    # ---------------- due dates and fines ---------------- #
 
-    def student_history(self, srn):
-        """Get borrowing history for a student"""
-        history = [record for record in self.db['borrow_history']
-                   if record['srn'] == srn]
-        if history:
-            return pd.DataFrame(history)
-        return pd.DataFrame()
+    def loan_policy(self):
+        """The LoanPolicy deciding due dates and fines"""
+        from fines import LoanPolicy
+        return LoanPolicy.from_dict(self.db.get('loan_policy'))
 
-    def get_borrow_df(self):
-        """Get borrow history as DataFrame"""
-        if self.db['borrow_history']:
-            df = pd.DataFrame(self.db['borrow_history'])
-            df['borrow_date'] = pd.to_datetime(df['borrow_date'])
-            df['month'] = df['borrow_date'].dt.to_period('M').astype(str)
-            return df
-        return pd.DataFrame()
+    def set_loan_policy(self, policy):
+        """Replace the LoanPolicy; cached fines are recomputed under the new one"""
+        with self.lock:
+            self.refresh()
+            self.db['loan_policy'] = policy.to_dict()
+            self.save_database()
+            self._owed.clear()
+
+    def student_classes(self):
+        """{srn: class} for students that belong to one"""
+        return {srn: student['class'] for srn, student in self.db['students'].items()
+                if 'class' in student}
+
+    def open_loans_frame(self):
+        """DataFrame of every loan not yet returned"""
+        self.refresh()
+        return self.history.frame(sorted(self._open_loans.values()))
+
+    def run_fine_batch(self, today=None):
+        """Assess every open loan in one pass and refill the per-student fine cache.
+
+        Meant to run nightly; returns the assessed loans (see fines.assess).
+        """
+        from fines import assess, owed_by_student
+        today = today or date.today()
+        assessed = assess(self.open_loans_frame(), self.loan_policy(),
+                          self.student_classes(), today)
+        self._owed = owed_by_student(assessed)
+        self._owed_date = today
+        return assessed
+
+    def amount_owed(self, srn):
+        """(fines accrued on srn's open loans, number of them overdue) as of today.
+
+        Served from the per-student cache the batch fills; students it has
+        not seen, or whose loans changed since, are assessed from their
+        own rows alone.
+        """
+        from fines import assess_loan
+        self.refresh()
+        today = date.today()
+        if self._owed_date != today:
+            self._owed = {}
+            self._owed_date = today
+        owed = self._owed.get(srn)
+        if owed is not None:
+            return owed
+
+        policy = self.loan_policy()
+        student_class = self.db['students'].get(srn, {}).get('class')
+        total, overdue = 0.0, 0
+        for row in self._history_by_srn.get(srn, ()):
+            if self.history.return_date[row] != NULL:
+                continue
+            days, fine = assess_loan(policy, self.history.value(row, 'genre'), student_class,
+                                     self.history.borrow_date[row], today.toordinal())
+            if days:
+                total += fine
+                overdue += 1
+        owed = self._owed[srn] = (total, overdue)
+        return owed
+
+    # ---------------- bulk import/export ---------------- #
+
+    def import_books(self, source, fmt=None):
+        """Add books from a CSV/JSON-lines file (book_id, title, genre[, copies]).
+
+        Every row is validated before anything changes, then the whole
+        import is saved in a single write. Returns the number of books added.
+        """
+        with self.lock:
+            self.refresh()
+            new_books = {}
+            for line_no, row in read_rows(source, fmt):
+                book_id, book = parse_book_row(row, f"{source}: line {line_no}")
+                if book_id in self.db['books'] or book_id in new_books:
+                    raise ValueError(f"{source}: line {line_no}: duplicate book_id {book_id}")
+                new_books[book_id] = book
+
+            for book_id, book in new_books.items():
+                self.db['books'][book_id] = book
+                self._index_book(book_id, book)
+            self.save_database()
+            self._index_titles(new_books)
+            return len(new_books)
+
+    def import_students(self, source, fmt=None):
+        """Add students from a CSV/JSON-lines file (srn, name, password).
+
+        Validated in full first, then saved in a single write with the
+        passwords hashed. Returns the number of students added.
+        """
+        with self.lock:
+            self.refresh()
+            new_students = {}
+            for line_no, row in read_rows(source, fmt):
+                srn, student = parse_student_row(row, f"{source}: line {line_no}")
+                if srn in self.db['students'] or srn in new_students:
+                    raise ValueError(f"{source}: line {line_no}: duplicate srn {srn}")
+                new_students[srn] = student
+
+            passwords = hash_passwords(student['password'] for student in new_students.values())
+            for student, password in zip(new_students.values(), passwords):
+                student['password'] = password
+            self.db['students'].update(new_students)
+            self.save_database()
+            return len(new_students)
+
+    def import_borrow_events(self, source, fmt=None):
+        """Replay historical loans from a CSV/JSON-lines file (event, srn, book_id, date).
+
+        event is 'borrow' or 'return'; rows are applied in file order with
+        the same rules as borrow_book/return_book. The file is checked in
+        one pass against scratch copies of availability and the holds,
+        then applied and saved in a single write. Returns the number of
+        events imported.
+        """
+        with self.lock:
+            self.refresh()
+            books = self.db['books']
+            students = self.db['students']
+            # (srn, book_id) -> borrow_date of the open loan (None once returned),
+            # and book_id -> copies on the shelf, for what the file touches
+            loans = {}
+            free = {}
+            # Played forward as applying the events will play self.holds
+            holds = HoldQueues.from_dict(self.holds.to_dict())
+            events = []
+            for line_no, row in read_rows(source, fmt):
+                where = f"{source}: line {line_no}"
+                event, srn, book_id, day = parse_event_row(row, where)
+                if srn not in students:
+                    raise ValueError(f"{where}: unknown srn {srn}")
+                if book_id not in books:
+                    raise ValueError(f"{where}: unknown book_id {book_id}")
+
+                if (srn, book_id) in loans:
+                    borrowed = loans[srn, book_id]
+                else:
+                    row = self._open_loans.get((srn, book_id))
+                    borrowed = None if row is None else self.history.value(row, 'borrow_date')
+                if book_id not in free:
+                    free[book_id] = books[book_id]['available']
+                if event == 'borrow':
+                    if borrowed is not None:
+                        raise ValueError(f"{where}: {srn} already has {book_id}")
+                    # A copy on the hold shelf is lent only to the student it is kept for
+                    if holds.is_ready(srn, book_id):
+                        holds.unshelve(srn, book_id)
+                    elif free[book_id]:
+                        free[book_id] -= 1
+                    elif book_id in holds.ready:
+                        raise ValueError(f"{where}: {book_id} is on hold for another student")
+                    else:
+                        raise ValueError(f"{where}: no copy of {book_id} is available")
+                    loans[srn, book_id] = day
+                else:
+                    if borrowed is None:
+                        raise ValueError(f"{where}: {srn} has no open loan of {book_id}")
+                    if day < borrowed:
+                        raise ValueError(f"{where}: returned before it was borrowed")
+                    # Returned copies go to students on the hold queue first
+                    if holds.shelve(book_id, day) is None:
+                        free[book_id] += 1
+                    loans[srn, book_id] = None
+                events.append((event, srn, book_id, day))
+
+            for event, srn, book_id, day in events:
+                if event == 'borrow':
+                    self._apply_borrow({
+                        'srn': srn,
+                        'student_name': students[srn]['name'],
+                        'book_id': book_id,
+                        'book_title': books[book_id]['title'],
+                        'genre': books[book_id]['genre'],
+                        'borrow_date': day,
+                        'return_date': None,
+                        'duration': None
+                    })
+                else:
+                    record = self.history.record(self._open_loans[srn, book_id])
+                    self._apply_return(record, day, days_between(record['borrow_date'], day))
+            self.save_database()
+            return len(events)
+
+    def export_borrow_history(self, dest, fmt=None):
+        """Stream borrow_history to a CSV/JSON-lines file; returns the row count"""
+        self.refresh()
+        return write_rows(dest, self.iter_borrow_history(), HISTORY_FIELDS, fmt)
+
+    def archive_history(self, max_age_days=None):
+        """Move loans returned more than max_age_days ago into per-month archive segments.
+
+        Open loans and recent history stay in memory. Defaults to
+        ARCHIVE_AFTER_DAYS. Returns the number of records archived.
+        """
+        from history_archive import ARCHIVE_AFTER_DAYS, HistoryArchive
+        if max_age_days is None:
+            max_age_days = ARCHIVE_AFTER_DAYS
+
+        with self.lock:
+            self.refresh()
+            old = self.history.returned_before(date.today().toordinal() - max_age_days)
+            if not old:
+                return 0
+
+            partitions = defaultdict(list)
+            for row in old:
+                partitions[self.history.value(row, 'borrow_date')[:7]].append(row)
+            os.makedirs(self.archive_dir, exist_ok=True)
+            if self.archive is None:
+                self.archive = HistoryArchive(self.archive_dir, self.db.get('archive_run', 0))
+            run = self.db.get('archive_run', 0) + 1
+            self.archive.write_run(run, {month: self.history.take(rows)
+                                         for month, rows in partitions.items()})
+
+            # The run takes effect once the snapshot without these rows is saved
+            archived = set(old)
+            self.history = self.history.take(
+                [row for row in range(len(self.history)) if row not in archived])
+            self.db['archive_run'] = run
+            self._build_indexes()
+            self.save_database()
+            return len(old)
+
+
+def open_library(db_file=path):
+    """Open a library with the storage backend matching the file extension.
+
+    Setting the LIBRARY_METRICS environment variable turns on instrumentation.
+    """
+    metrics = Metrics() if os.environ.get(METRICS_ENV) else None
+    if os.path.splitext(db_file)[1] in ('.db', '.sqlite', '.sqlite3'):
+        from sqlite_backend import SQLiteLibrarySystem
+        return SQLiteLibrarySystem(db_file, metrics=metrics)
+    return LibrarySystem(db_file, metrics=metrics)
+
+
+@lru_cache(maxsize=None)
+def _plotting():
+    """Import the plotting stack on first use and set the chart style"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set_style("whitegrid")
+    plt.rcParams['figure.figsize'] = (12, 6)
+    return plt, sns
+
+
+def _show():
+    """Show the current chart window"""
+    plt, _ = _plotting()
+    plt.show()
+
+
+def plot_genre_bar(genre_counts):
+    """Bar chart of borrows per genre"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x=genre_counts.values, y=genre_counts.index, palette='viridis')
+    plt.title('Books Borrowed by Genre', fontsize=16, fontweight='bold')
+    plt.xlabel('Number of Borrows', fontsize=12)
+    plt.ylabel('Genre', fontsize=12)
+    plt.tight_layout()
+
+
+def plot_top_books(book_counts, top_n):
+    """Bar chart of the most borrowed books"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(12, 6))
+    sns.barplot(x=book_counts.values, y=book_counts.index, palette='rocket')
+    plt.title(f'Top {top_n} Most Borrowed Books', fontsize=16, fontweight='bold')
+    plt.xlabel('Number of Borrows', fontsize=12)
+    plt.ylabel('Book Title', fontsize=12)
+    plt.tight_layout()
+
+
+def plot_daily_borrows(daily_borrows):
+    """Line chart of borrows per day"""
+    plt, _ = _plotting()
+    plt.figure(figsize=(12, 6))
+    plt.plot(daily_borrows.index, daily_borrows.values, marker='o', linewidth=2)
+    plt.title('Borrowing Frequency Over Time', fontsize=16, fontweight='bold')
+    plt.xlabel('Date', fontsize=12)
+    plt.ylabel('Number of Books Borrowed', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.grid(True, alpha=0.3)
+    plt.tight_layout()
+
+
+def plot_student_book_matrix(pivot):
+    """Heatmap of student x book borrow counts"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(14, 8))
+    sns.heatmap(pivot, annot=True, fmt='d', cmap='YlOrRd', cbar_kws={'label': 'Times Borrowed'})
+    plt.title('Student-Book Borrowing Matrix', fontsize=16, fontweight='bold')
+    plt.xlabel('Book Title', fontsize=12)
+    plt.ylabel('Student Name', fontsize=12)
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+
+
+def plot_monthly_borrows(monthly_borrows):
+    """Bar chart of borrows per month"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(12, 6))
+    sns.barplot(x=monthly_borrows.index, y=monthly_borrows.values, palette='mako')
+    plt.title('Monthly Borrowing Trends', fontsize=16, fontweight='bold')
+    plt.xlabel('Month', fontsize=12)
+    plt.ylabel('Number of Books Borrowed', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+
+
+def plot_student_ranking(student_counts):
+    """Ranked bar chart of borrows per student"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(10, 6))
+    colors = sns.color_palette('coolwarm', len(student_counts))
+    sns.barplot(x=student_counts.values, y=student_counts.index, palette=colors)
+    plt.title('Student Borrowing Ranking', fontsize=16, fontweight='bold')
+    plt.xlabel('Books Borrowed', fontsize=12)
+    plt.ylabel('Student Name', fontsize=12)
+
+    # Add ranking numbers
+    for i, v in enumerate(student_counts.values):
+        plt.text(v + 0.1, i, f'#{i + 1}', va='center', fontweight='bold')
+
+    plt.tight_layout()
+
+
+def plot_genre_pie(genre_counts):
+    """Pie chart of genre popularity"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(10, 8))
+    colors = sns.color_palette('Set3', len(genre_counts))
+    plt.pie(genre_counts.values, labels=genre_counts.index, autopct='%1.1f%%',
+            colors=colors, startangle=90)
+    plt.title('Most Popular Genres', fontsize=16, fontweight='bold')
+    plt.axis('equal')
+    plt.tight_layout()
+
+
+def plot_copies_in_use(in_use):
+    """Bar chart of the share of each genre's copies that are out"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(10, 6))
+    sns.barplot(x=in_use.values, y=in_use.index, palette='crest')
+    plt.title('Copies Out on Loan or Hold by Genre', fontsize=16, fontweight='bold')
+    plt.xlabel('% of Copies Out', fontsize=12)
+    plt.ylabel('Genre', fontsize=12)
+    plt.xlim(0, 100)
+    plt.tight_layout()
+
+
+def plot_average_durations(avg_duration):
+    """Bar chart of average days borrowed per book"""
+    plt, sns = _plotting()
+    plt.figure(figsize=(12, 6))
+    sns.barplot(x=avg_duration.values, y=avg_duration.index, palette='viridis')
+    plt.title('Average Borrowing Duration by Book', fontsize=16, fontweight='bold')
+    plt.xlabel('Average Days Borrowed', fontsize=12)
+    plt.ylabel('Book Title', fontsize=12)
+    plt.tight_layout()
 
 
 class AdminAnalytics:
     def __init__(self, library_system):
         self.lib = library_system
-        self.df = self.lib.get_borrow_df()
+
+    @property
+    def stats(self):
+        """Current borrow aggregates, kept up to date by the library"""
+        return self.lib.get_borrow_stats()
+
+    @property
+    def df(self):
+        """Full borrow history as a DataFrame, built on demand"""
+        return self.lib.get_borrow_df()
 
     def genre_analysis(self):
         """Visualize borrowing by genre"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(10, 6))
-        genre_counts = self.df['genre'].value_counts()
-
-        sns.barplot(x=genre_counts.values, y=genre_counts.index, palette='viridis')
-        plt.title('Books Borrowed by Genre', fontsize=16, fontweight='bold')
-        plt.xlabel('Number of Borrows', fontsize=12)
-        plt.ylabel('Genre', fontsize=12)
-        plt.tight_layout()
-        plt.show()
+        plot_genre_bar(stats.genre_counts())
+        _show()
 
     def most_borrowed_books(self, top_n=10):
         """Visualize most borrowed books"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(12, 6))
-        book_counts = self.df['book_title'].value_counts().head(top_n)
-
-        sns.barplot(x=book_counts.values, y=book_counts.index, palette='rocket')
-        plt.title(f'Top {top_n} Most Borrowed Books', fontsize=16, fontweight='bold')
-        plt.xlabel('Number of Borrows', fontsize=12)
-        plt.ylabel('Book Title', fontsize=12)
-        plt.tight_layout()
-        plt.show()
+        plot_top_books(stats.book_counts(top_n), top_n)
+        _show()
 
     def borrowing_frequency(self):
         """Visualize borrowing frequency over time"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(12, 6))
-        daily_borrows = self.df.groupby('borrow_date').size()
+        plot_daily_borrows(stats.daily_counts())
+        _show()
+
+    def student_book_pivot(self, n_students=20, n_books=20):
+        """Borrow counts for the most active students x most borrowed books"""
+        return self.lib.get_co_borrow_matrix().top_k(n_students, n_books)
+
+    def co_borrowed_books(self, book_id, top_n=10):
+        """Print the books most often borrowed by readers of book_id"""
+        matrix = self.lib.get_co_borrow_matrix()
+        if book_id not in matrix.by_book:
+            print("No borrowing data for this book!")
+            return
 
-        plt.plot(daily_borrows.index, daily_borrows.values, marker='o', linewidth=2)
-        plt.title('Borrowing Frequency Over Time', fontsize=16, fontweight='bold')
-        plt.xlabel('Date', fontsize=12)
-        plt.ylabel('Number of Books Borrowed', fontsize=12)
-        plt.xticks(rotation=45)
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
-        plt.show()
+        print(f"\nReaders of '{matrix.book_labels.get(book_id, book_id)}' also borrowed:")
+        for rank, (other, score) in enumerate(matrix.co_borrowed_with(book_id, top_n), start=1):
+            print(f"  {rank:>2}. [{other}] {matrix.book_labels.get(other, other):<40} {score}")
 
     def student_book_matrix(self):
         """Show which student borrowed which books"""
-        if self.df.empty:
+        if not self.stats.total:
             print("No borrowing data available!")
             return
 
-        # Create pivot table
-        pivot = self.df.pivot_table(
-            index='student_name',
-            columns='book_title',
-            aggfunc='size',
-            fill_value=0
-        )
-
-        plt.figure(figsize=(14, 8))
-        sns.heatmap(pivot, annot=True, fmt='d', cmap='YlOrRd', cbar_kws={'label': 'Times Borrowed'})
-        plt.title('Student-Book Borrowing Matrix', fontsize=16, fontweight='bold')
-        plt.xlabel('Book Title', fontsize=12)
-        plt.ylabel('Student Name', fontsize=12)
-        plt.xticks(rotation=45, ha='right')
-        plt.tight_layout()
-        plt.show()
+        plot_student_book_matrix(self.student_book_pivot())
+        _show()
 
     def monthly_trends(self):
         """Analyze monthly borrowing trends"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(12, 6))
-        monthly_borrows = self.df.groupby('month').size()
-
-        sns.barplot(x=monthly_borrows.index, y=monthly_borrows.values, palette='mako')
-        plt.title('Monthly Borrowing Trends', fontsize=16, fontweight='bold')
-        plt.xlabel('Month', fontsize=12)
-        plt.ylabel('Number of Books Borrowed', fontsize=12)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.show()
+        plot_monthly_borrows(stats.monthly_counts())
+        _show()
 
     def student_ranking(self):
         """Rank students by borrowing activity"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(10, 6))
-        student_counts = self.df['student_name'].value_counts()
-
-        colors = sns.color_palette('coolwarm', len(student_counts))
-        sns.barplot(x=student_counts.values, y=student_counts.index, palette=colors)
-        plt.title('Student Borrowing Ranking', fontsize=16, fontweight='bold')
-        plt.xlabel('Books Borrowed', fontsize=12)
-        plt.ylabel('Student Name', fontsize=12)
-
-        # Add ranking numbers
-        for i, v in enumerate(student_counts.values):
-            plt.text(v + 0.1, i, f'#{i + 1}', va='center', fontweight='bold')
-
-        plt.tight_layout()
-        plt.show()
+        plot_student_ranking(stats.student_counts())
+        _show()
 
     def popular_genres_pie(self):
         """Show genre popularity as pie chart"""
-        if self.df.empty:
+        stats = self.stats
+        if not stats.total:
             print("No borrowing data available!")
             return
 
-        plt.figure(figsize=(10, 8))
-        genre_counts = self.df['genre'].value_counts()
-
-        colors = sns.color_palette('Set3', len(genre_counts))
-        plt.pie(genre_counts.values, labels=genre_counts.index, autopct='%1.1f%%',
-                colors=colors, startangle=90)
-        plt.title('Most Popular Genres', fontsize=16, fontweight='bold')
-        plt.axis('equal')
-        plt.tight_layout()
-        plt.show()
+        plot_genre_pie(stats.genre_counts())
+        _show()
 
     def duration_analysis(self):
         """Analyze average borrowing duration"""
-        completed = self.df[self.df['duration'].notna()]
+        avg_duration = self.stats.average_durations()
 
-        if completed.empty:
+        if avg_duration.empty:
             print("No completed borrows with duration data!")
             return
 
-        plt.figure(figsize=(12, 6))
-        avg_duration = completed.groupby('book_title')['duration'].mean().sort_values(ascending=False)
+        plot_average_durations(avg_duration)
+        _show()
+
+    def copies_in_use(self):
+        """Percent of each genre's copies out on loan or on hold, busiest first.
+
+        Read from the per-genre copy counters, so this costs one step per
+        genre however large the catalog is.
+        """
+        import pandas as pd
+        self.lib.refresh()
+        in_use = {genre: 100 * (count['copies'] - count['copies_available']) / count['copies']
+                  for genre, count in self.lib.availability_by_genre().items() if count['copies']}
+        return pd.Series(in_use, dtype='float64').sort_values(ascending=False)
+
+    def copy_utilization(self):
+        """Visualize how much of each genre's stock is in use"""
+        in_use = self.copies_in_use()
+        if in_use.empty:
+            print("No books in the catalog!")
+            return
 
-        sns.barplot(x=avg_duration.values, y=avg_duration.index, palette='viridis')
-        plt.title('Average Borrowing Duration by Book', fontsize=16, fontweight='bold')
-        plt.xlabel('Average Days Borrowed', fontsize=12)
-        plt.ylabel('Book Title', fontsize=12)
-        plt.tight_layout()
-        plt.show()
+        plot_copies_in_use(in_use)
+        _show()
+
+    def dashboard_charts(self, top_n=10):
+        """Plot function and data for every dashboard chart that has data.
+
+        Aggregates are read once and shared, so the genre counts behind
+        both the bar and pie charts are only computed a single time.
+        """
+        stats = self.stats
+        charts = {}
+        if stats.total:
+            genre_counts = stats.genre_counts()
+            charts['genre_analysis'] = (plot_genre_bar, (genre_counts,))
+            charts['most_borrowed_books'] = (plot_top_books, (stats.book_counts(top_n), top_n))
+            charts['borrowing_frequency'] = (plot_daily_borrows, (stats.daily_counts(),))
+            charts['student_book_matrix'] = (plot_student_book_matrix, (self.student_book_pivot(),))
+            charts['monthly_trends'] = (plot_monthly_borrows, (stats.monthly_counts(),))
+            charts['student_ranking'] = (plot_student_ranking, (stats.student_counts(),))
+            charts['popular_genres_pie'] = (plot_genre_pie, (genre_counts,))
+
+        avg_duration = stats.average_durations()
+        if not avg_duration.empty:
+            charts['duration_analysis'] = (plot_average_durations, (avg_duration,))
+        in_use = self.copies_in_use()
+        if not in_use.empty:
+            charts['copy_utilization'] = (plot_copies_in_use, (in_use,))
+        return charts
 
     def comprehensive_dashboard(self):
         """Display all analytics"""
@@ -354,23 +1791,50 @@ class AdminAnalytics:
         print("\n8. Duration Analysis")
         self.duration_analysis()
 
+        print("\n9. Copy Utilization")
+        self.copy_utilization()
+
+
+def copy_status(available, copies):
+    """'✓ Available' or '✗ Borrowed', with the copies left for multi-copy titles"""
+    status = "✓ Available" if available else "✗ Borrowed"
+    return status if copies == 1 else f"{status} ({available}/{copies} copies)"
+
+
+def print_books(books):
+    """Print (book_id, book) pairs one per line with their availability"""
+    for book_id, book in books:
+        print(f"  [{book_id}] {book['title']:<40} {book['genre']:<12} "
+              f"{copy_status(book['available'], book['copies'])}")
+
 
 def student_menu(lib, srn):
     """Student interface"""
     while True:
         print("\n" + "=" * 40)
-        print(f"STUDENT MENU - {lib.db['students'][srn]['name']}")
+        print(f"STUDENT MENU - {lib.get_student_name(srn)}")
+        owed, overdue = lib.amount_owed(srn)
+        if overdue:
+            print(f"You owe {owed:.2f} in fines on {overdue} overdue book(s)")
+        holds = lib.student_holds(srn)
+        for book_id, title, place, until in holds:
+            if place is None:
+                print(f"[{book_id}] '{title}' is waiting for you until {until}")
         print("=" * 40)
         print("1. View Available Books (by Genre)")
         print("2. Borrow Book")
         print("3. Return Book")
         print("4. View My Borrowing History")
-        print("5. Logout")
+        print("5. Recommended for You")
+        print("6. Search Books")
+        print("7. Place Hold")
+        print("8. My Holds")
+        print("9. Logout")
 
         choice = input("\nEnter choice: ")
 
         if choice == '1':
-            lib.display_books_by_genre(available_only=True)
+            lib.display_books_by_genre(available_only=True, page_size=PAGE_SIZE)
 
         elif choice == '2':
             book_id = input("Enter Book ID to borrow: ").upper()
@@ -391,6 +1855,41 @@ def student_menu(lib, srn):
                 print("No borrowing history found!")
 
         elif choice == '5':
+            recommendations = lib.recommend_books(srn)
+            if recommendations:
+                print("\n--- Recommended for You ---")
+                print_books(recommendations)
+            else:
+                print("No recommendations yet!")
+
+        elif choice == '6':
+            query = input("Search titles: ")
+            genre = input("Genre (blank for all): ").strip() or None
+            available_only = input("Available only? (y/n): ").strip().lower() == 'y'
+            results = lib.search_books(query, genre, available_only)
+            if results:
+                print(f"\n--- Results for '{query}' ---")
+                print_books(results)
+            else:
+                print("No matching books found!")
+
+        elif choice == '7':
+            book_id = input("Enter Book ID to reserve: ").upper()
+            print(lib.place_hold(srn, book_id))
+
+        elif choice == '8':
+            if not holds:
+                print("You have no holds.")
+                continue
+            print("\n--- Your Holds ---")
+            for book_id, title, place, until in holds:
+                status = f"ready until {until}" if place is None else f"number {place} in line"
+                print(f"  [{book_id}] {title:<40} {status}")
+            book_id = input("Enter Book ID to cancel (blank to keep all): ").strip().upper()
+            if book_id:
+                print(lib.cancel_hold(srn, book_id))
+
+        elif choice == '9':
             print("Logging out...")
             break
 
@@ -407,12 +1906,17 @@ def admin_menu(lib):
         print("2. Genre Analysis")
         print("3. Most Borrowed Books")
         print("4. Borrowing Frequency")
-        print("5. Logout")
+        print("5. Bulk Import")
+        print("6. Export Borrow History")
+        print("7. Books Borrowed Together")
+        print("8. Metrics & Profiling")
+        print("9. Book Copies")
+        print("10. Logout")
 
         choice = input("\nEnter choice: ")
 
         if choice == '1':
-            lib.display_books_by_genre(available_only=False)
+            lib.display_books_by_genre(available_only=False, page_size=PAGE_SIZE)
 
         elif choice == '2':
             analytics.genre_analysis()
@@ -424,48 +1928,141 @@ def admin_menu(lib):
             analytics.borrowing_frequency()
 
         elif choice == '5':
+            kind = input("Import books, students or loans? ").strip().lower()
+            importers = {'books': lib.import_books, 'students': lib.import_students,
+                         'loans': lib.import_borrow_events}
+            if kind not in importers:
+                print("Invalid choice!")
+                continue
+            source = input("Enter CSV/JSONL file path: ").strip()
+            try:
+                print(f"Imported {importers[kind](source)} {kind}.")
+            except (OSError, ValueError) as exc:
+                print(f"Import failed, nothing was changed: {exc}")
+
+        elif choice == '6':
+            dest = input("Enter CSV/JSONL file path: ").strip()
+            try:
+                print(f"Exported {lib.export_borrow_history(dest)} records to {dest}.")
+            except (OSError, ValueError) as exc:
+                print(f"Export failed: {exc}")
+
+        elif choice == '7':
+            book_id = input("Enter Book ID: ").upper()
+            analytics.co_borrowed_books(book_id)
+
+        elif choice == '8':
+            metrics_menu(lib)
+
+        elif choice == '9':
+            book_id = input("Enter Book ID: ").upper()
+            book = lib.get_book(book_id)
+            if book is None:
+                print("Book not found!")
+                continue
+            print(f"\n--- Copies of '{book['title']}' ---")
+            for copy, status, srn in lib.book_copies(book_id):
+                print(f"  Copy {copy:<4} {status.replace('_', ' '):<10} {srn or ''}")
+            count = input("Copies to add (blank for none): ").strip()
+            if count.isdigit():
+                print(lib.add_copies(book_id, int(count)))
+            elif count:
+                print("Invalid number!")
+
+        elif choice == '10':
             print("Logging out...")
             break
 
 
-def main():
-    """Main program"""
-    lib = LibrarySystem()
+def metrics_menu(lib):
+    """Show instrumentation and start/stop on-demand profiling"""
+    metrics = lib.metrics
+    if metrics is None:
+        print(f"Metrics are off. Set {METRICS_ENV}=1 before starting the library system.")
+        return
 
     while True:
         print("\n" + "=" * 40)
-        print("LIBRARY MANAGEMENT SYSTEM")
+        print("METRICS")
         print("=" * 40)
-        print("1. Student Login")
-        print("2. Admin Login")
-        print("3. Exit")
+        print("1. Show Metrics")
+        print(f"2. {'Stop' if metrics.profiling else 'Start'} CPU Profile")
+        print(f"3. {'Stop' if metrics.tracing else 'Start'} Memory Trace")
+        print("4. Back")
 
         choice = input("\nEnter choice: ")
 
         if choice == '1':
-            srn = input("Enter SRN: ").upper()
-            password = input("Enter Password: ")
-
-            if lib.student_login(srn, password):
-                print(f"\nWelcome, {lib.db['students'][srn]['name']}!")
-                student_menu(lib, srn)
-            else:
-                print("Invalid credentials!")
+            print(metrics.render(lib.record_counts()))
 
         elif choice == '2':
-            username = input("Enter Admin Username: ")
-            password = input("Enter Admin Password: ")
-
-            if lib.admin_login(username, password):
-                print("\nAdmin access granted!")
-                admin_menu(lib)
+            if metrics.profiling:
+                print(metrics.stop_profile())
             else:
-                print("Invalid credentials!")
+                metrics.start_profile()
+                print("Profiling started; choose this option again to see the report.")
 
         elif choice == '3':
-            print("Thank you for using the Library System!")
+            if metrics.tracing:
+                print(metrics.stop_trace())
+            else:
+                metrics.start_trace()
+                print("Tracing allocations; choose this option again to see the report.")
+
+        elif choice == '4':
             break
 
 
+def _login_failed(lib, account):
+    """Message for a refused login"""
+    wait = lib.login_limiter.retry_after(account)
+    if wait:
+        return f"Too many failed attempts! Try again in {int(wait) + 1} seconds."
+    return "Invalid credentials!"
+
+
+def main():
+    """Main program"""
+    lib = open_library()
+
+    while True:
+        print("\n" + "=" * 40)
+        print("LIBRARY MANAGEMENT SYSTEM")
+        print("=" * 40)
+        print("1. Student Login")
+        print("2. Admin Login")
+        print("3. Exit")
+
+        choice = input("\nEnter choice: ")
+
+        try:
+            if choice == '1':
+                srn = input("Enter SRN: ").upper()
+                password = input("Enter Password: ")
+
+                if lib.student_login(srn, password):
+                    print(f"\nWelcome, {lib.get_student_name(srn)}!")
+                    student_menu(lib, srn)
+                else:
+                    print(_login_failed(lib, ('student', srn)))
+
+            elif choice == '2':
+                username = input("Enter Admin Username: ")
+                password = input("Enter Admin Password: ")
+
+                if lib.admin_login(username, password):
+                    print("\nAdmin access granted!")
+                    admin_menu(lib)
+                else:
+                    print(_login_failed(lib, ('admin', username)))
+
+            elif choice == '3':
+                print("Thank you for using the Library System!")
+                break
+        except TimeoutError:
+            # Another process kept the database locked past LOCK_TIMEOUT
+            print("The library database is busy - please try again.")
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds in seconds of the operation latency buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds in bytes of the write size buckets (256 B .. 1 GB)
+SIZE_BUCKETS = tuple(4 ** power for power in range(4, 16))
+# Set this environment variable to instrument libraries opened by open_library()
+METRICS_ENV = 'LIBRARY_METRICS'
+# Lines of profiler and allocation output reported
+PROFILE_LINES = 25
+
+
+class Histogram:
+    """Prometheus-style histogram: counts per bucket plus a running sum"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last slot is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Exposition lines: cumulative _bucket series, then _sum and _count"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.bounds, '+Inf'), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Opt-in instrumentation of one library.
+
+    Operation latencies and bytes written go into fixed-bucket
+    histograms; recording one is a bisect over a short tuple, far below
+    the cost of the borrow or save it measures. CPU profiling and
+    allocation tracing are off until started from the admin menu.
+    """
+
+    def __init__(self):
+        self.latency = {}
+        self.written = {}
+        self._profiler = None
+
+    def time(self, op, seconds):
+        """Record the latency of one operation"""
+        histogram = self.latency.get(op)
+        if histogram is None:
+            histogram = self.latency[op] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+
+    def wrote(self, target, size):
+        """Record size bytes written to target ('snapshot', 'journal')"""
+        histogram = self.written.get(target)
+        if histogram is None:
+            histogram = self.written[target] = Histogram(SIZE_BUCKETS)
+        histogram.observe(size)
+
+    def render(self, record_counts):
+        """Prometheus text exposition of every metric plus record_counts gauges"""
+        lines = ['# HELP library_operation_seconds Latency of library operations.',
+                 '# TYPE library_operation_seconds histogram']
+        for op, histogram in sorted(self.latency.items()):
+            lines += histogram.render('library_operation_seconds', f'op="{op}"')
+        lines += ['# HELP library_bytes_written Bytes written per snapshot save or journal flush.',
+                  '# TYPE library_bytes_written histogram']
+        for target, histogram in sorted(self.written.items()):
+            lines += histogram.render('library_bytes_written', f'file="{target}"')
+        lines += ['# HELP library_records Records currently held by the library.',
+                  '# TYPE library_records gauge']
+        for kind, count in record_counts.items():
+            lines.append(f'library_records{{kind="{kind}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    # ---------------- on-demand profiling ---------------- #
+
+    @property
+    def profiling(self):
+        return self._profiler is not None
+
+    def start_profile(self):
+        """Start collecting a cProfile of this thread"""
+        import cProfile
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop_profile(self):
+        """Stop profiling; the top functions by cumulative time, as text"""
+        import io
+        import pstats
+        profiler, self._profiler = self._profiler, None
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return out.getvalue()
+
+    @property
+    def tracing(self):
+        import tracemalloc
+        return tracemalloc.is_tracing()
+
+    def start_trace(self):
+        """Start tracing memory allocations"""
+        import tracemalloc
+        tracemalloc.start()
+
+    def stop_trace(self):
+        """Stop tracing; the lines holding the most memory, as text"""
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = [f"Traced {current / 2 ** 20:.1f} MB live, {peak / 2 ** 20:.1f} MB peak"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_LINES]]
+        return '\n'.join(lines)
+
+
+def timed(op):
+    """Decorate a library method so its latency is recorded under op.
+
+    A library without metrics pays one attribute check per call.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.time(op, time.perf_counter() - start)
+        return wrapper
+    return decorator
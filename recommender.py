@@ -0,0 +1,166 @@
+from collections import Counter
+
+import numpy as np
+
+# Similar books kept per book
+NEIGHBORS = 20
+# Popular books kept per genre for the cold-start fallback
+POPULAR_PER_GENRE = 50
+# Rebuild the similarity model once loans have grown by this fraction...
+REBUILD_FRACTION = 0.1
+# ...and by at least this many loans
+REBUILD_MIN = 100
+# Upper bound on (book, book) pairs expanded at once while building
+PAIR_CHUNK = 5_000_000
+
+
+def _pair_keys(cols, indptr, lengths, first, last, n_items):
+    """book_a * n_items + book_b for every pair of distinct books a student borrowed.
+
+    Covers students first..last-1 of the CSR arrays in one vectorized step.
+    """
+    n = lengths[first:last]
+    left = np.arange(indptr[first], indptr[last])
+    reps = np.repeat(n, n)
+    left_rep = np.repeat(left, reps)
+    group_start = np.repeat(np.repeat(indptr[first:last], n), reps)
+    offsets = np.arange(reps.sum()) - np.repeat(np.cumsum(reps) - reps, reps)
+    right = group_start + offsets
+
+    keep = left_rep != right
+    return cols[left_rep[keep]] * n_items + cols[right[keep]]
+
+
+def item_neighbors(by_student, n_neighbors=NEIGHBORS):
+    """Top cosine neighbors for every book from {srn: {book_id: count}}.
+
+    Treats loans as binary (borrowed or not), so cosine(a, b) is
+    co-readers / sqrt(readers(a) * readers(b)). Returns (book_ids,
+    indptr, neighbor index array, similarity array) in CSR layout.
+    """
+    book_ids = list({book_id for books in by_student.values() for book_id in books})
+    index = {book_id: i for i, book_id in enumerate(book_ids)}
+    n_items = len(book_ids)
+
+    lengths = np.fromiter((len(books) for books in by_student.values()),
+                          dtype=np.int64, count=len(by_student))
+    cols = np.fromiter((index[book_id] for books in by_student.values() for book_id in books),
+                       dtype=np.int64, count=int(lengths.sum()))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    readers = np.bincount(cols, minlength=n_items)
+
+    # Co-reader counts, reduced per chunk so raw pairs never all sit in memory
+    keys, counts = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    pair_totals = np.cumsum(lengths ** 2)
+    first = 0
+    while first < len(lengths):
+        done = pair_totals[first - 1] if first else 0
+        last = max(first + 1, int(np.searchsorted(pair_totals, done + PAIR_CHUNK, side='right')))
+        chunk_keys, chunk_counts = np.unique(
+            _pair_keys(cols, indptr, lengths, first, last, n_items), return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+        first = last
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    co_counts = np.bincount(inverse, weights=np.concatenate(counts))
+
+    a, b = np.divmod(keys, n_items)
+    similarity = co_counts / np.sqrt(readers[a] * readers[b])
+
+    # Keep the n_neighbors most similar books per book
+    order = np.lexsort((-similarity, a))
+    a, b, similarity = a[order], b[order], similarity[order]
+    group_start = np.searchsorted(a, a, side='left')
+    keep = np.arange(len(a)) - group_start < n_neighbors
+    a, b, similarity = a[keep], b[keep], similarity[keep]
+    neighbor_ptr = np.searchsorted(a, np.arange(n_items + 1), side='left')
+    return book_ids, neighbor_ptr, b, similarity
+
+
+class Recommender:
+    """Item-item recommendations over borrow history.
+
+    Book-to-book cosine similarities are precomputed in one vectorized
+    pass and rebuilt only after loans grow by REBUILD_FRACTION; between
+    rebuilds each student's own, current loans drive the scores. Results
+    are cached per student until their history or the model changes.
+    Students with little or no history are topped up with the most
+    borrowed books in the genres they read, then overall.
+    """
+
+    def __init__(self, lib):
+        self.lib = lib
+        self._built_total = None
+        self._version = 0
+        self._cache = {}
+
+    def _ensure_model(self):
+        total = self.lib.borrow_count()
+        if (self._built_total is not None and
+                total - self._built_total < max(REBUILD_MIN, self._built_total * REBUILD_FRACTION)):
+            return
+
+        matrix = self.lib.get_co_borrow_matrix()
+        if matrix.by_student:
+            self.book_ids, self.neighbor_ptr, self.neighbors, self.similarity = \
+                item_neighbors(matrix.by_student)
+        else:
+            self.book_ids, self.neighbor_ptr = [], np.zeros(1, dtype=np.int64)
+            self.neighbors, self.similarity = np.empty(0, dtype=np.int64), np.empty(0)
+        self.index = {book_id: i for i, book_id in enumerate(self.book_ids)}
+
+        self.popular = [book_id for book_id, _ in matrix.book_totals.most_common()]
+        self.popular_by_genre = {}
+        for book_id in self.popular:
+            genre_books = self.popular_by_genre.setdefault(matrix.book_genres.get(book_id), [])
+            if len(genre_books) < POPULAR_PER_GENRE:
+                genre_books.append(book_id)
+        self.popular = self.popular[:POPULAR_PER_GENRE]
+
+        self._built_total = total
+        self._version += 1
+        self._cache.clear()
+
+    def recommend(self, srn, top_n=5):
+        """Up to top_n (book_id, book) pairs the student has not borrowed yet"""
+        self._ensure_model()
+        books = self.lib.borrowed_books(srn)
+        key = (self._version, sum(count for _, _, count in books), top_n)
+        cached = self._cache.get(srn)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        borrowed = {book_id for book_id, _, _ in books}
+        scores = Counter()
+        for book_id in borrowed:
+            i = self.index.get(book_id)
+            if i is None:
+                continue
+            start, stop = self.neighbor_ptr[i], self.neighbor_ptr[i + 1]
+            for j, similarity in zip(self.neighbors[start:stop], self.similarity[start:stop]):
+                other = self.book_ids[j]
+                if other not in borrowed:
+                    scores[other] += similarity
+
+        picks = [book_id for book_id, _ in scores.most_common(top_n)]
+        if len(picks) < top_n:
+            # Cold start: popular books in the student's genres, then overall
+            genres = Counter()
+            for _, genre, count in books:
+                genres[genre] += count
+            fallback = [self.popular_by_genre.get(genre, []) for genre, _ in genres.most_common()]
+            fallback.append(self.popular)
+            for candidates in fallback:
+                for book_id in candidates:
+                    if len(picks) >= top_n:
+                        break
+                    if book_id not in borrowed and book_id not in picks:
+                        picks.append(book_id)
+
+        result = []
+        for book_id in picks:
+            book = self.lib.get_book(book_id)
+            if book is not None:
+                result.append((book_id, book))
+        self._cache[srn] = (key, result)
+        return result
@@ -0,0 +1,98 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+from lib_management import AdminAnalytics, open_library, path
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def _init_worker():
+    """Render off-screen in pool workers"""
+    matplotlib.use('Agg')
+
+
+def _render_chart(name, plot, args, output_dir, formats):
+    """Draw one chart and save it in every requested format"""
+    import matplotlib.pyplot as plt
+
+    plot(*args)
+    files = []
+    for fmt in formats:
+        out_file = os.path.join(output_dir, f"{name}.{fmt}")
+        plt.savefig(out_file, format=fmt)
+        files.append(out_file)
+    plt.close('all')
+    return files
+
+
+def _chart_digest(plot, args):
+    """Fingerprint of the data a chart is drawn from"""
+    return hashlib.sha256(pickle.dumps((plot.__name__, args))).hexdigest()
+
+
+def _load_manifest(output_dir):
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def render_dashboard(lib, output_dir, formats=('png',), workers=None, skip_unchanged=False):
+    """Render every dashboard chart to files without opening any windows.
+
+    Charts are drawn in a process pool. With skip_unchanged, a chart whose
+    data fingerprint matches the previous run (and whose files still exist)
+    is not redrawn. Returns {chart name: 'rendered' | 'unchanged'}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    charts = AdminAnalytics(lib).dashboard_charts()
+    manifest = _load_manifest(output_dir) if skip_unchanged else {}
+
+    results = {}
+    pending = {}
+    for name, (plot, args) in charts.items():
+        digest = _chart_digest(plot, args)
+        previous = manifest.get(name)
+        if (previous and previous['digest'] == digest and
+                all(os.path.exists(f) for f in previous['files']) and
+                set(previous['formats']) >= set(formats)):
+            results[name] = 'unchanged'
+            continue
+        pending[name] = (plot, args, digest)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {name: pool.submit(_render_chart, name, plot, args, output_dir, formats)
+                       for name, (plot, args, digest) in pending.items()}
+            for name, future in futures.items():
+                manifest[name] = {'digest': pending[name][2], 'formats': list(formats),
+                                  'files': future.result()}
+                results[name] = 'rendered'
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the analytics dashboard to image files")
+    parser.add_argument('--db', default=path, help="database file (.json or .db)")
+    parser.add_argument('--out', default='reports', help="output directory")
+    parser.add_argument('--format', nargs='+', default=['png'], choices=['png', 'svg'],
+                        dest='formats')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="only redraw charts whose data changed since the last run")
+    args = parser.parse_args()
+
+    lib = open_library(args.db)
+    results = render_dashboard(lib, args.out, args.formats, args.workers, args.skip_unchanged)
+    for name, status in results.items():
+        print(f"  {name:<25} {status}")
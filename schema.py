@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+from contextlib import nullcontext
+from itertools import islice
+
+# Layout version of JSON snapshots, written as their first key
+SCHEMA_VERSION = 2
+VERSION_KEY = 'schema_version'
+# Files from before the header: new_code.py's layout ('history' records of
+# srn/student/book/genre/date) is version 0, lib_management.py's is 1
+HISTORY_KEYS = {0: 'history', 1: 'borrow_history'}
+# Characters read at a time when streaming a snapshot
+READ_SIZE = 1 << 20
+# Characters a JSON number can start with, and can go on with
+NUMBER_START = '-0123456789'
+NUMBER_CHARS = NUMBER_START + '+.eE'
+# Borrow records converted and written at a time by migrate_json()
+MIGRATE_CHUNK = 10_000
+
+
+def upgrade(db):
+    """Bring a decoded JSON snapshot to SCHEMA_VERSION; returns it without the header"""
+    version = db.pop(VERSION_KEY, None)
+    if version is None:
+        version = 0 if HISTORY_KEYS[0] in db else 1
+    _check_version(version)
+    if version == 0:
+        records = db.pop(HISTORY_KEYS[0])
+        legacy = LegacyHistory(db['books'], _last_rows(enumerate(records)))
+        db['borrow_history'] = [legacy.convert(row, record)
+                                for row, record in enumerate(records)]
+    return db
+
+
+def _check_version(version):
+    """Refuse a layout newer than this code knows how to read"""
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Database schema version {version} is newer than this program "
+                         f"supports ({SCHEMA_VERSION})")
+
+
+def _last_rows(records):
+    """{title: row of its last record} over (row, new_code.py record) pairs"""
+    return {record.get('book', ''): row for row, record in records}
+
+
+class LegacyHistory:
+    """Converts new_code.py 'history' records to borrow_history records.
+
+    Those only carry the title, so book_id is looked up in the catalog
+    ('' for a title no longer in it).
+    new_code.py could not return books: a record is an open loan only if
+    it is the last one of its title and the book is still out. Any other
+    was returned at some unrecorded point and is closed on the day it was
+    borrowed.
+    """
+
+    def __init__(self, books, last_rows):
+        self.books = books
+        self.last_rows = last_rows
+        self.ids_by_title = {}
+        for book_id, book in books.items():
+            # Of several books with one title, the one out is the one that was lent
+            if not book['available'] or book['title'] not in self.ids_by_title:
+                self.ids_by_title[book['title']] = book_id
+
+    def convert(self, row, record):
+        """The borrow_history record for the history record in row"""
+        title = record.get('book', '')
+        book_id = self.ids_by_title.get(title, '')
+        still_out = (book_id and self.last_rows.get(title) == row and
+                     not self.books[book_id]['available'])
+        return {
+            'srn': record['srn'],
+            'student_name': record.get('student', ''),
+            'book_id': book_id,
+            'book_title': title,
+            'genre': record.get('genre', ''),
+            'borrow_date': record['date'],
+            'return_date': None if still_out else record['date'],
+            'duration': None if still_out else 0,
+        }
+
+
+# ---------------- streaming ---------------- #
+
+class _Reader:
+    """Walks one JSON document a value at a time, holding about READ_SIZE characters"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read more of the file; False at the end"""
+        more = self.f.read(READ_SIZE)
+        if not more:
+            return False
+        self.buffer = self.buffer[self.pos:] + more
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, left unread"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, chars):
+        """Read one of chars (skipping whitespace) and return it"""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON document, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Cut off by the end of the buffer, unless the file is done
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the end of the buffer ('12.' then '5') decodes as a
+            # shorter one: read on until the character after it cannot continue it
+            if (self.buffer[self.pos] in NUMBER_START and
+                    (end == len(self.buffer) or self.buffer[end] in NUMBER_CHARS) and
+                    self._fill()):
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yield the keys of an object; the caller reads each value before the next"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def items(self):
+        """Yield the values of an array one by one"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def _scan(f):
+    """First pass: (version, db without history, {title: last row} for version 0)"""
+    reader = _Reader(f)
+    db, version, last_rows = {}, None, None
+    for key in reader.members():
+        if key == HISTORY_KEYS[0]:
+            version = 0 if version is None else version
+            last_rows = _last_rows(enumerate(reader.items()))
+        elif key == HISTORY_KEYS[1]:
+            version = 1 if version is None else version
+            for _ in reader.items():
+                pass
+        else:
+            db[key] = reader.value()
+    header = db.pop(VERSION_KEY, None)
+    if header is not None:
+        version = header
+    return (1 if version is None else version), db, last_rows
+
+
+def _history_items(reader):
+    """Second pass: the history records, in either layout, skipping everything else"""
+    for key in reader.members():
+        if key in HISTORY_KEYS.values():
+            yield from reader.items()
+        else:
+            reader.value()
+
+
+def _count_copies(books):
+    """Give catalog entries from before multi-copy titles a copy count, in place"""
+    for book in books.values():
+        if 'copies' not in book:
+            book['copies'] = 1
+            book['available'] = int(book['available'])
+
+
+def migrate_json(source, dest=None, chunk_size=MIGRATE_CHUNK):
+    """Upgrade a JSON snapshot to SCHEMA_VERSION without loading its history.
+
+    The file is read twice: once to pick up everything but the history
+    (and, for new_code.py files, each title's last record), then again
+    to convert the history and write it out chunk_size records at a
+    time. Memory stays bounded by the catalog and student table however
+    long the history is. dest defaults to replacing source; it is
+    written to a temp file and renamed into place, with the locks of
+    source and dest held throughout. Returns the number of borrow
+    records written, or None if source was already current.
+    """
+    from lib_management import FileLock
+
+    dest = source if dest is None else dest
+    journal_file = os.path.splitext(source)[0] + '.log'
+    if dest != source and os.path.exists(journal_file):
+        raise ValueError(f"{source} has changes in {journal_file} that only apply "
+                         f"to it; migrate it in place instead")
+
+    # Held across both passes, so source cannot change between them
+    source_lock = FileLock(os.path.splitext(source)[0] + '.lock')
+    dest_lock = FileLock(os.path.splitext(dest)[0] + '.lock') if dest != source else None
+    with source_lock, dest_lock or nullcontext():
+        with open(source, 'r', encoding='utf-8') as f:
+            version, db, last_rows = _scan(f)
+        _check_version(version)
+        if version == SCHEMA_VERSION and dest == source:
+            return None
+        legacy = LegacyHistory(db['books'], last_rows) if version == 0 else None
+        _count_copies(db['books'])
+
+        count = 0
+        tmp_file = dest + '.tmp'
+        with open(source, 'r', encoding='utf-8') as f, open(tmp_file, 'w', encoding='utf-8') as out:
+            out.write(f'{{"{VERSION_KEY}":{SCHEMA_VERSION},')
+            out.write(json.dumps(db, separators=(',', ':'))[1:-1])
+            out.write(',"borrow_history":[')
+            rows = enumerate(_history_items(_Reader(f)))
+            while chunk := [record if legacy is None else legacy.convert(row, record)
+                            for row, record in islice(rows, chunk_size)]:
+                if count:
+                    out.write(',')
+                out.write(json.dumps(chunk, separators=(',', ':'))[1:-1])
+                count += len(chunk)
+            out.write(']}')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_file, dest)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=f"Upgrade a JSON library database to schema version {SCHEMA_VERSION}")
+    parser.add_argument('source', help="JSON database written by lib_management.py or new_code.py")
+    parser.add_argument('dest', nargs='?', help="where to write it (default: in place)")
+    parser.add_argument('--chunk', type=int, default=MIGRATE_CHUNK,
+                        help="borrow records converted per batch")
+    args = parser.parse_args()
+
+    count = migrate_json(args.source, args.dest, args.chunk)
+    if count is None:
+        print(f"{args.source} is already at schema version {SCHEMA_VERSION}")
+    else:
+        print(f"Wrote {count} borrow records at schema version {SCHEMA_VERSION} "
+              f"to {args.dest or args.source}")
+
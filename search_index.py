@@ -0,0 +1,183 @@
+import os
+import pickle
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from math import ceil
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Fuzzy matches must share at least this Dice fraction of trigrams
+FUZZY_THRESHOLD = 0.4
+# Closest vocabulary words tried for a misspelled term
+FUZZY_WORDS = 10
+FORMAT_VERSION = 1
+
+
+def tokenize(text):
+    """Lowercase words of a title or query"""
+    return WORD_RE.findall(text.lower())
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Inverted word index over book titles with prefix and fuzzy lookup.
+
+    postings maps each title word to the books containing it. A sorted
+    vocabulary answers prefix queries with bisect, and a trigram index
+    over the vocabulary finds close spellings for words that do not
+    match exactly.
+    """
+
+    def __init__(self, signature=None):
+        # Catalog version the index was built for
+        self.signature = signature
+        self.postings = defaultdict(list)
+        self.titles = {}
+        self.genres = {}
+        self.word_trigrams = defaultdict(list)
+        self._vocab = None
+
+    def add(self, book_id, title, genre):
+        """Index one catalog entry"""
+        words = set(tokenize(title))
+        self.titles[book_id] = tuple(words)
+        self.genres[book_id] = genre
+        for word in words:
+            if word not in self.postings:
+                for gram in trigrams(word):
+                    self.word_trigrams[gram].append(word)
+                self._vocab = None
+            self.postings[word].append(book_id)
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def vocab(self):
+        if self._vocab is None:
+            self._vocab = sorted(self.postings)
+        return self._vocab
+
+    # ---------------- matching ---------------- #
+
+    def _prefix_words(self, prefix):
+        vocab = self.vocab
+        i = bisect_left(vocab, prefix)
+        while i < len(vocab) and vocab[i].startswith(prefix):
+            yield vocab[i]
+            i += 1
+
+    def similar_words(self, word):
+        """Vocabulary words spelled like word, closest first"""
+        # Dice >= t needs at least t/(2-t) of the query's trigrams in common,
+        # so only words holding one of the rarest remaining grams qualify
+        grams = sorted(trigrams(word), key=lambda gram: len(self.word_trigrams.get(gram, ())))
+        needed = max(1, ceil(len(grams) * FUZZY_THRESHOLD / (2 - FUZZY_THRESHOLD)))
+        candidates = set()
+        for gram in grams[:len(grams) - needed + 1]:
+            candidates.update(self.word_trigrams.get(gram, ()))
+
+        query_grams = set(grams)
+        scored = []
+        for other in candidates:
+            other_grams = trigrams(other)
+            dice = 2 * len(query_grams & other_grams) / (len(query_grams) + len(other_grams))
+            if dice >= FUZZY_THRESHOLD:
+                scored.append((dice, other))
+        scored.sort(reverse=True)
+        return [other for _, other in scored[:FUZZY_WORDS]]
+
+    def _matcher(self, term, prefix):
+        """(words accepted for term, test on a title's words, estimated hits)"""
+        if prefix:
+            words = []
+            hits = 0
+            for word in self._prefix_words(term):
+                words.append(word)
+                hits += len(self.postings[word])
+            if words:
+                return words, lambda title: any(w.startswith(term) for w in title), hits
+
+        if term in self.postings:
+            return [term], lambda title: term in title, len(self.postings[term])
+
+        accepted = self.similar_words(term) if len(term) >= 3 else []
+        accepted_set = set(accepted)
+        hits = sum(len(self.postings[word]) for word in accepted)
+        return accepted, lambda title: not accepted_set.isdisjoint(title), hits
+
+    def search(self, query, genre=None, is_available=None, limit=20):
+        """Book ids whose titles match every query word.
+
+        The last word also matches as a prefix; words that match nothing
+        exactly fall back to their closest spellings. genre and
+        is_available(book_id) filter the hits.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        matchers = [self._matcher(term, prefix=(i == len(terms) - 1))
+                    for i, term in enumerate(terms)]
+
+        # Walk the postings of the rarest term and test the others per title
+        driver = min(range(len(matchers)), key=lambda i: matchers[i][2])
+        driver_words = matchers[driver][0]
+        checks = [test for i, (_, test, _) in enumerate(matchers) if i != driver]
+
+        results = []
+        seen = set()
+        for word in driver_words:
+            for book_id in self.postings[word]:
+                if book_id in seen:
+                    continue
+                seen.add(book_id)
+                title = self.titles[book_id]
+                if not all(test(title) for test in checks):
+                    continue
+                if genre is not None and self.genres[book_id] != genre:
+                    continue
+                if is_available is not None and not is_available(book_id):
+                    continue
+                results.append(book_id)
+                if len(results) >= limit:
+                    return results
+        return results
+
+    # ---------------- persistence ---------------- #
+
+    def save(self, file_name):
+        """Write the index next to the database, tagged with its catalog signature"""
+        tmp_file = file_name + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((FORMAT_VERSION, self.signature, dict(self.postings), self.titles,
+                         self.genres, dict(self.word_trigrams), self.vocab),
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name, signature):
+        """Read a saved index; None if it is missing or was built for another catalog"""
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'rb') as f:
+            saved = pickle.load(f)
+        if saved[0] != FORMAT_VERSION or saved[1] != signature:
+            return None
+
+        index = cls(signature)
+        _, _, postings, index.titles, index.genres, word_trigrams, index._vocab = saved
+        index.postings.update(postings)
+        index.word_trigrams.update(word_trigrams)
+        return index
+
+    @classmethod
+    def build(cls, catalog, signature=None):
+        """Index every (book_id, title, genre) in catalog"""
+        index = cls(signature)
+        for book_id, title, genre in catalog:
+            index.add(book_id, title, genre)
+        return index
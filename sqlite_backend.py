@@ -0,0 +1,974 @@
+import argparse
+import json
+import os
+import sqlite3
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from credentials import LoginLimiter, hash_database, hash_passwords, is_hashed
+from lib_management import (CATEGORY_FIELDS, CHUNK_SIZE, HISTORY_FIELDS, BorrowStats,
+                            CoBorrowMatrix, LibrarySystem, days_between, parse_book_row,
+                            parse_event_row, parse_student_row, read_rows, sample_database,
+                            write_rows)
+from holds import HOLD_PICKUP_DAYS, HoldQueues
+from inventory import AVAILABLE, ON_HOLD, ON_LOAN
+from metrics import timed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    srn TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL,
+    class TEXT
+);
+CREATE TABLE IF NOT EXISTS admin (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS books (
+    book_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    available INTEGER NOT NULL DEFAULT 1,
+    copies INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS book_copies (
+    book_id TEXT NOT NULL,
+    copy INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'available',
+    srn TEXT,
+    PRIMARY KEY (book_id, copy)
+);
+CREATE TABLE IF NOT EXISTS borrow_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    srn TEXT NOT NULL,
+    student_name TEXT,
+    book_id TEXT,
+    book_title TEXT,
+    genre TEXT,
+    borrow_date TEXT NOT NULL,
+    return_date TEXT,
+    duration INTEGER
+);
+CREATE TABLE IF NOT EXISTS borrow_stats (
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    borrows INTEGER NOT NULL DEFAULT 0,
+    duration_sum INTEGER NOT NULL DEFAULT 0,
+    duration_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, key)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS holds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id TEXT NOT NULL,
+    srn TEXT NOT NULL,
+    ready_until TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_books_genre ON books (genre, available);
+CREATE INDEX IF NOT EXISTS idx_history_srn ON borrow_history (srn);
+CREATE INDEX IF NOT EXISTS idx_history_book ON borrow_history (book_id, return_date);
+CREATE INDEX IF NOT EXISTS idx_history_genre ON borrow_history (genre);
+CREATE INDEX IF NOT EXISTS idx_history_borrow_date ON borrow_history (borrow_date);
+CREATE INDEX IF NOT EXISTS idx_holds_book ON holds (book_id, ready_until, id);
+CREATE INDEX IF NOT EXISTS idx_holds_srn ON holds (srn);
+CREATE INDEX IF NOT EXISTS idx_holds_ready ON holds (ready_until);
+CREATE INDEX IF NOT EXISTS idx_copies_status ON book_copies (book_id, status, copy);
+CREATE INDEX IF NOT EXISTS idx_copies_srn ON book_copies (book_id, srn);
+"""
+
+HISTORY_COLUMNS = HISTORY_FIELDS
+
+# borrow_stats dimension -> expression over borrow_history it groups by
+STATS_DIMENSIONS = {
+    'genre': "genre",
+    'book': "book_title",
+    'student': "student_name",
+    'day': "borrow_date",
+    'month': "substr(borrow_date, 1, 7)",
+}
+
+
+class SQLiteLibrarySystem(LibrarySystem):
+    """LibrarySystem stored in SQLite instead of one JSON document.
+
+    Nothing is loaded up front: every call runs an indexed query, so
+    startup time and memory do not grow with the size of the database.
+    """
+
+    def __init__(self, db_file='library.db', metrics=None):
+        self.db_file = db_file
+        self.metrics = metrics
+        # SQLite does its own locking; this only satisfies callers of lib.lock
+        self.lock = nullcontext()
+        self._recommender = None
+        self.search_file = os.path.splitext(db_file)[0] + '.search'
+        self._title_index = None
+        # Failed logins per ('student', srn) / ('admin', username)
+        self.login_limiter = LoginLimiter()
+        self.load_database()
+
+    @timed('load')
+    def load_database(self):
+        """Open the database, creating the schema and sample data if needed"""
+        # Not tied to the opening thread: the HTTP service makes every call
+        # from its one library thread
+        self.conn = sqlite3.connect(self.db_file, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if 'class' not in {column for _, column, *_ in
+                           self.conn.execute("PRAGMA table_info(students)")}:
+            # Database predates student classes: nobody belongs to one
+            self.conn.execute("ALTER TABLE students ADD COLUMN class TEXT")
+
+        if self.conn.execute("SELECT 1 FROM admin").fetchone() is None:
+            db = sample_database()
+            hash_database(db)
+            with self._transaction():
+                _insert_database(self.conn, db)
+        elif (self.conn.execute("SELECT 1 FROM borrow_stats").fetchone() is None and
+              self.conn.execute("SELECT 1 FROM borrow_history").fetchone() is not None):
+            # Database predates borrow_stats
+            with self._transaction():
+                _rebuild_stats(self.conn)
+
+        if 'copies' not in {column for _, column, *_ in
+                            self.conn.execute("PRAGMA table_info(books)")}:
+            # Database predates multi-copy titles: every book is one copy
+            with self._transaction():
+                self.conn.execute(
+                    "ALTER TABLE books ADD COLUMN copies INTEGER NOT NULL DEFAULT 1")
+                self.conn.execute(
+                    "INSERT INTO book_copies (book_id, copy) SELECT book_id, 1 FROM books")
+                _assign_copies(self.conn)
+
+    @timed('save')
+    def save_database(self):
+        """Every change is committed as it happens; nothing to flush"""
+
+    def refresh(self):
+        """Every query already sees other connections' committed changes"""
+
+    def flush_journal(self):
+        """Borrow and return commit their own transactions; nothing is pending"""
+        return 0
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        """Write transaction that takes the database lock up front"""
+        return _Transaction(self.conn)
+
+    def student_password(self, srn):
+        """Stored password (a salted hash once migrated); None for an unknown srn"""
+        row = self.conn.execute(
+            "SELECT password FROM students WHERE srn = ?", (srn,)).fetchone()
+        return row and row[0]
+
+    def get_book(self, book_id):
+        """Look up a catalog entry; None if there is no such book"""
+        row = self.conn.execute(
+            "SELECT title, genre, copies, available FROM books WHERE book_id = ?",
+            (book_id,)).fetchone()
+        if row is None:
+            return None
+        return {'title': row[0], 'genre': row[1], 'copies': row[2], 'available': row[3]}
+
+    def get_student_name(self, srn):
+        """Look up a student's display name"""
+        return self.conn.execute(
+            "SELECT name FROM students WHERE srn = ?", (srn,)).fetchone()[0]
+
+    def admin_password(self, username):
+        """Stored admin password; None for any username but the admin's"""
+        row = self.conn.execute(
+            "SELECT password FROM admin WHERE username = ?", (username,)).fetchone()
+        return row and row[0]
+
+    def hash_passwords(self, workers=None):
+        """Replace any plaintext passwords with salted hashes; returns how many.
+
+        The hashing runs on a pool of worker threads before the write
+        transaction, so other writers are only held up by the UPDATEs; a
+        password changed in the meantime is left alone.
+        """
+        accounts = [(table, column, key, password)
+                    for table, column in (('students', 'srn'), ('admin', 'username'))
+                    for key, password in self.conn.execute(
+                        f"SELECT {column}, password FROM {table}")
+                    if not is_hashed(password)]
+        hashed = hash_passwords((password for *_, password in accounts), workers)
+        count = 0
+        with self._transaction():
+            for (table, column, key, password), new in zip(accounts, hashed):
+                count += self.conn.execute(
+                    f"UPDATE {table} SET password = ? WHERE {column} = ? AND password = ?",
+                    (new, key, password)).rowcount
+        return count
+
+    def view_available_books(self):
+        """Display available books grouped by genre"""
+        import pandas as pd
+        return pd.read_sql_query(
+            "SELECT book_id AS 'Book ID', title, genre, copies, available FROM books "
+            "WHERE available > 0", self.conn, index_col='Book ID')
+
+    def availability_by_genre(self):
+        """Per genre, in genre order: titles with a copy on the shelf and in all,
+        and copies on the shelf and in all"""
+        rows = self.conn.execute(
+            "SELECT genre, SUM(available > 0), COUNT(*), SUM(available), SUM(copies) "
+            "FROM books GROUP BY genre ORDER BY genre")
+        return {genre: {'available': available, 'total': total,
+                        'copies_available': copies_available, 'copies': copies}
+                for genre, available, total, copies_available, copies in rows}
+
+    def iter_books_by_genre(self, genre, available_only=True, offset=0, limit=None):
+        """Yield (book_id, title, copies available, copies) for one genre, available titles first"""
+        query = "SELECT book_id, title, available, copies FROM books WHERE genre = ?"
+        if available_only:
+            query += " AND available > 0"
+        query += " ORDER BY available = 0, book_id LIMIT ? OFFSET ?"
+        limit = -1 if limit is None else limit
+        yield from self.conn.execute(query, (genre, limit, offset))
+
+    @timed('borrow')
+    def borrow_book(self, srn, book_id):
+        """Borrow a book"""
+        with self._transaction():
+            book = self.conn.execute(
+                "SELECT title, genre, copies, available FROM books WHERE book_id = ?",
+                (book_id,)).fetchone()
+            if book is None:
+                return "Book not found!"
+            title, genre, copies, available = book
+            if self._copy_of(book_id, srn, ON_LOAN) is not None:
+                return "You already have this book!"
+
+            if not available and self._copy_of(book_id, srn, ON_HOLD) is None:
+                # Copies left on the hold shelf past their pickup deadline are free again
+                self._expire_holds()
+            copy = self._lend_copy(book_id, srn)
+            if copy is None:
+                if self._on_hold_shelf(book_id):
+                    return "Book is on hold for another student!"
+                return "Book is currently unavailable! You can place a hold on it."
+
+            student_name = self.get_student_name(srn)
+            borrow_date = datetime.now().strftime('%Y-%m-%d')
+            self.conn.execute(
+                "INSERT INTO borrow_history (srn, student_name, book_id, book_title, "
+                "genre, borrow_date) VALUES (?, ?, ?, ?, ?, ?)",
+                (srn, student_name, book_id, title, genre, borrow_date))
+            self.conn.executemany(
+                "INSERT INTO borrow_stats (dimension, key, borrows) VALUES (?, ?, 1) "
+                "ON CONFLICT (dimension, key) DO UPDATE SET borrows = borrows + 1",
+                [('genre', genre), ('book', title), ('student', student_name),
+                 ('day', borrow_date), ('month', borrow_date[:7])])
+
+        if copies > 1:
+            return f"Successfully borrowed '{title}' (copy {copy} of {copies})"
+        return f"Successfully borrowed '{title}'"
+
+    @timed('return')
+    def return_book(self, srn, book_id):
+        """Return a book"""
+        with self._transaction():
+            record = self.conn.execute(
+                "SELECT id, book_title, borrow_date FROM borrow_history "
+                "WHERE book_id = ? AND return_date IS NULL AND srn = ? "
+                "ORDER BY id DESC LIMIT 1", (book_id, srn)).fetchone()
+            if record is None:
+                return "No active borrow record found for this book!"
+
+            record_id, title, borrow_date = record
+            return_date = datetime.now().strftime('%Y-%m-%d')
+            duration = days_between(borrow_date, return_date)
+
+            self.conn.execute(
+                "UPDATE borrow_history SET return_date = ?, duration = ? WHERE id = ?",
+                (return_date, duration, record_id))
+            held = self._shelve(book_id, self._copy_of(book_id, srn, ON_LOAN), return_date)
+            self.conn.execute(
+                "UPDATE borrow_stats SET duration_sum = duration_sum + ?, "
+                "duration_count = duration_count + 1 "
+                "WHERE dimension = 'book' AND key = ?", (duration, title))
+
+        if held:
+            return f"Successfully returned '{title}' - it is now held for the next reader"
+        return f"Successfully returned '{title}'"
+
+    # ---------------- holds ---------------- #
+
+    def _shelve(self, book_id, copy, day):
+        """Keep a copy coming back for the next holder, or put it back on the shelves"""
+        hold = self.conn.execute(
+            "SELECT id, srn FROM holds WHERE book_id = ? AND ready_until IS NULL "
+            "ORDER BY id LIMIT 1", (book_id,)).fetchone()
+        if hold is None:
+            self.conn.execute(
+                "UPDATE book_copies SET status = ?, srn = NULL WHERE book_id = ? AND copy = ?",
+                (AVAILABLE, book_id, copy))
+            self.conn.execute(
+                "UPDATE books SET available = available + 1 WHERE book_id = ?", (book_id,))
+            return False
+        until = date.fromisoformat(day) + timedelta(days=HOLD_PICKUP_DAYS)
+        self.conn.execute("UPDATE holds SET ready_until = ? WHERE id = ?",
+                          (until.isoformat(), hold[0]))
+        self.conn.execute(
+            "UPDATE book_copies SET status = ?, srn = ? WHERE book_id = ? AND copy = ?",
+            (ON_HOLD, hold[1], book_id, copy))
+        return True
+
+    def _expire_holds(self):
+        """Pass on copies left on the hold shelf past their pickup deadline"""
+        today = date.today().isoformat()
+        expired = self.conn.execute(
+            "SELECT id, book_id, srn FROM holds WHERE ready_until < ?", (today,)).fetchall()
+        for hold_id, book_id, srn in expired:
+            copy = self._copy_of(book_id, srn, ON_HOLD)
+            self.conn.execute("DELETE FROM holds WHERE id = ?", (hold_id,))
+            self._shelve(book_id, copy, today)
+
+    def place_hold(self, srn, book_id):
+        """Join the queue for a borrowed book"""
+        with self._transaction():
+            self._expire_holds()
+            book = self.conn.execute(
+                "SELECT title, available FROM books WHERE book_id = ?", (book_id,)).fetchone()
+            if book is None:
+                return "Book not found!"
+            title, available = book
+            if available:
+                return "Book is available - borrow it instead!"
+            if self._copy_of(book_id, srn, ON_LOAN) is not None:
+                return "You already have this book!"
+            if self.conn.execute("SELECT 1 FROM holds WHERE book_id = ? AND srn = ?",
+                                 (book_id, srn)).fetchone():
+                return "You already have a hold on this book!"
+
+            cursor = self.conn.execute("INSERT INTO holds (book_id, srn) VALUES (?, ?)",
+                                       (book_id, srn))
+            place = self._place_in_line(book_id, cursor.lastrowid)
+        return f"Hold placed on '{title}' - you are number {place} in line"
+
+    def cancel_hold(self, srn, book_id):
+        """Give up a place in line, or a book waiting on the hold shelf"""
+        with self._transaction():
+            hold = self.conn.execute(
+                "SELECT id, ready_until FROM holds WHERE book_id = ? AND srn = ?",
+                (book_id, srn)).fetchone()
+            if hold is None:
+                return "No hold found for this book!"
+            self.conn.execute("DELETE FROM holds WHERE id = ?", (hold[0],))
+            if hold[1] is not None:
+                self._shelve(book_id, self._copy_of(book_id, srn, ON_HOLD),
+                             date.today().isoformat())
+            title = self.conn.execute(
+                "SELECT title FROM books WHERE book_id = ?", (book_id,)).fetchone()[0]
+        return f"Hold on '{title}' cancelled"
+
+    def student_holds(self, srn):
+        """[(book_id, title, place in line or None once ready, pickup deadline)]"""
+        with self._transaction():
+            self._expire_holds()
+            rows = self.conn.execute(
+                "SELECT holds.id, holds.book_id, books.title, holds.ready_until "
+                "FROM holds JOIN books USING (book_id) WHERE srn = ? "
+                "ORDER BY holds.ready_until IS NULL, holds.id", (srn,)).fetchall()
+            return [(book_id, title,
+                     None if until is not None else self._place_in_line(book_id, hold_id),
+                     until)
+                    for hold_id, book_id, title, until in rows]
+
+    def _place_in_line(self, book_id, hold_id):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM holds WHERE book_id = ? AND ready_until IS NULL AND id <= ?",
+            (book_id, hold_id)).fetchone()[0]
+
+    # ---------------- copies ---------------- #
+
+    def _copy_of(self, book_id, srn, status):
+        """The copy of book_id srn has with this status, or None"""
+        row = self.conn.execute(
+            "SELECT copy FROM book_copies WHERE book_id = ? AND srn = ? AND status = ?",
+            (book_id, srn, status)).fetchone()
+        return None if row is None else row[0]
+
+    def _lend_copy(self, book_id, srn):
+        """Mark a copy of book_id on loan to srn and return it; None if none can go.
+
+        That is the copy kept on the hold shelf for srn if there is one,
+        else the lowest-numbered free copy.
+        """
+        copy = self._copy_of(book_id, srn, ON_HOLD)
+        if copy is not None:
+            self.conn.execute("DELETE FROM holds WHERE book_id = ? AND srn = ?", (book_id, srn))
+        else:
+            copy = self._free_copy(book_id)
+            if copy is None:
+                return None
+            self.conn.execute(
+                "UPDATE books SET available = available - 1 WHERE book_id = ?", (book_id,))
+        self.conn.execute(
+            "UPDATE book_copies SET status = ?, srn = ? WHERE book_id = ? AND copy = ?",
+            (ON_LOAN, srn, book_id, copy))
+        return copy
+
+    def _on_hold_shelf(self, book_id):
+        """Whether a copy of book_id is kept on the hold shelf for anyone"""
+        return self.conn.execute(
+            "SELECT 1 FROM holds WHERE book_id = ? AND ready_until IS NOT NULL",
+            (book_id,)).fetchone() is not None
+
+    def _free_copy(self, book_id):
+        """The lowest-numbered copy of book_id on the shelf, or None"""
+        row = self.conn.execute(
+            "SELECT copy FROM book_copies WHERE book_id = ? AND status = ? ORDER BY copy LIMIT 1",
+            (book_id, AVAILABLE)).fetchone()
+        return None if row is None else row[0]
+
+    def book_copies(self, book_id):
+        """[(copy, status, srn or None)] for every copy of a book"""
+        return self.conn.execute(
+            "SELECT copy, status, srn FROM book_copies WHERE book_id = ? ORDER BY copy",
+            (book_id,)).fetchall()
+
+    def add_copies(self, book_id, count):
+        """Put more copies of a title into circulation, serving its hold queue first"""
+        if count < 1:
+            return "Number of copies must be at least 1!"
+        with self._transaction():
+            book = self.conn.execute(
+                "SELECT title, copies FROM books WHERE book_id = ?", (book_id,)).fetchone()
+            if book is None:
+                return "Book not found!"
+            title, copies = book
+            self.conn.executemany(
+                "INSERT INTO book_copies (book_id, copy) VALUES (?, ?)",
+                ((book_id, copy) for copy in range(copies + 1, copies + count + 1)))
+            self.conn.execute(
+                "UPDATE books SET copies = copies + ?, available = available + ? "
+                "WHERE book_id = ?", (count, count, book_id))
+            self._serve_holds(book_id, date.today().isoformat())
+        return f"'{title}' now has {copies + count} copies"
+
+    def _serve_holds(self, book_id, day):
+        """Move copies from the shelf to the hold shelf while students are queued for them"""
+        while self.conn.execute("SELECT 1 FROM holds WHERE book_id = ? AND ready_until IS NULL",
+                                (book_id,)).fetchone():
+            copy = self._free_copy(book_id)
+            if copy is None:
+                break
+            self._shelve(book_id, copy, day)
+            self.conn.execute(
+                "UPDATE books SET available = available - 1 WHERE book_id = ?", (book_id,))
+
+    def merge_duplicate_titles(self):
+        """Fold books entered once per copy into multi-copy titles.
+
+        Books sharing a title and genre become copies of the lowest
+        book_id among them, taking their loans, holds and history along.
+        A title is skipped while one student has two of its books out or
+        on hold. Returns (book ids merged away, titles skipped).
+        """
+        merged = skipped = 0
+        with self._transaction():
+            groups = self.conn.execute(
+                "SELECT title, genre FROM books GROUP BY title, genre "
+                "HAVING COUNT(*) > 1").fetchall()
+
+            for title, genre in groups:
+                book_ids = [book_id for book_id, in self.conn.execute(
+                    "SELECT book_id FROM books WHERE title = ? AND genre = ? ORDER BY book_id",
+                    (title, genre))]
+                marks = ', '.join('?' * len(book_ids))
+                if self.conn.execute(
+                        f"SELECT srn FROM (SELECT srn FROM book_copies WHERE srn IS NOT NULL "
+                        f"AND book_id IN ({marks}) UNION ALL SELECT srn FROM holds "
+                        f"WHERE ready_until IS NULL AND book_id IN ({marks})) "
+                        f"GROUP BY srn HAVING COUNT(*) > 1", book_ids * 2).fetchone():
+                    skipped += 1
+                    continue
+
+                keep, others = book_ids[0], book_ids[1:]
+                copies = self.conn.execute(
+                    "SELECT copies FROM books WHERE book_id = ?", (keep,)).fetchone()[0]
+                for book_id in others:
+                    # Renumber the other book's copies after those already in the title
+                    self.conn.execute(
+                        "UPDATE book_copies SET book_id = ?, copy = copy + ? WHERE book_id = ?",
+                        (keep, copies, book_id))
+                    copies += self.conn.execute(
+                        "SELECT copies FROM books WHERE book_id = ?", (book_id,)).fetchone()[0]
+                marks = ', '.join('?' * len(others))
+                # Hold ids keep their order, so merged queues stay first-come
+                for table in ('borrow_history', 'holds'):
+                    self.conn.execute(
+                        f"UPDATE {table} SET book_id = ? WHERE book_id IN ({marks})",
+                        [keep, *others])
+                self.conn.execute(
+                    "UPDATE books SET copies = ?, available = (SELECT COUNT(*) FROM book_copies "
+                    "WHERE book_id = ? AND status = ?) WHERE book_id = ?",
+                    (copies, keep, AVAILABLE, keep))
+                self.conn.execute(f"DELETE FROM books WHERE book_id IN ({marks})", others)
+                self._bump_catalog()
+                self._serve_holds(keep, date.today().isoformat())
+                merged += len(others)
+
+        if merged:
+            self._title_index = None
+            if os.path.exists(self.search_file):
+                os.remove(self.search_file)
+        return merged, skipped
+
+    def _history_query(self, where, params, start=None, end=None):
+        import pandas as pd
+        where, params = _with_period(where, params, start, end)
+        columns = ', '.join(HISTORY_COLUMNS)
+        return pd.read_sql_query(
+            f"SELECT {columns} FROM borrow_history {where} ORDER BY id",
+            self.conn, params=params)
+
+    def student_records(self, srn, start=None, end=None):
+        """Get borrowing history for a student as a list of records"""
+        where, params = _with_period("WHERE srn = ?", (srn,), start, end)
+        columns = ', '.join(HISTORY_COLUMNS)
+        rows = self.conn.execute(
+            f"SELECT {columns} FROM borrow_history {where} ORDER BY id", params)
+        return [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+    def borrowed_books(self, srn):
+        """[(book_id, genre, times borrowed)] over a student's whole history"""
+        return self.conn.execute(
+            "SELECT book_id, MAX(genre), COUNT(*) FROM borrow_history "
+            "WHERE srn = ? GROUP BY book_id", (srn,)).fetchall()
+
+    def iter_catalog(self):
+        """Yield (book_id, title, genre) for every book"""
+        yield from self.conn.execute("SELECT book_id, title, genre FROM books")
+
+    def iter_borrow_history(self):
+        """Yield every borrow record in the order it was made"""
+        columns = ', '.join(HISTORY_COLUMNS)
+        for row in self.conn.execute(f"SELECT {columns} FROM borrow_history ORDER BY id"):
+            yield dict(zip(HISTORY_COLUMNS, row))
+
+    def catalog_version(self):
+        """Changes whenever books are added to or removed from the catalog"""
+        row = self.conn.execute(
+            "SELECT value FROM settings WHERE key = 'catalog_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _bump_catalog(self):
+        """Note a catalog change, inside the transaction making it"""
+        self.conn.execute(
+            "INSERT INTO settings VALUES ('catalog_version', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def student_history(self, srn, start=None, end=None):
+        """Get borrowing history for a student, optionally only start..end"""
+        import pandas as pd
+        history = self._history_query("WHERE srn = ?", (srn,), start, end)
+        if history.empty:
+            return pd.DataFrame()
+        return history
+
+    def book_history(self, book_id, start=None, end=None):
+        """Get borrowing history for a book, optionally only start..end"""
+        import pandas as pd
+        history = self._history_query("WHERE book_id = ?", (book_id,), start, end)
+        if history.empty:
+            return pd.DataFrame()
+        return history
+
+    def record_counts(self):
+        """Row counts of the database tables"""
+        counts = {}
+        for kind, query in (
+                ('books', "SELECT COUNT(*) FROM books"),
+                ('students', "SELECT COUNT(*) FROM students"),
+                ('borrow_records', "SELECT COUNT(*) FROM borrow_history"),
+                ('open_loans', "SELECT COUNT(*) FROM borrow_history WHERE return_date IS NULL")):
+            counts[kind] = self.conn.execute(query).fetchone()[0]
+        return counts
+
+    def get_borrow_stats(self):
+        """Get the running borrow aggregates"""
+        stats = BorrowStats()
+        counters = {'genre': stats.by_genre, 'book': stats.by_book,
+                    'student': stats.by_student, 'day': stats.by_day,
+                    'month': stats.by_month}
+        rows = self.conn.execute(
+            "SELECT dimension, key, borrows, duration_sum, duration_count FROM borrow_stats")
+        for dimension, key, borrows, duration_sum, duration_count in rows:
+            counters[dimension][key] = borrows
+            if dimension == 'book' and duration_count:
+                stats.duration_sum[key] = duration_sum
+                stats.duration_count[key] = duration_count
+        stats.total = sum(stats.by_genre.values())
+        return stats
+
+    def borrow_count(self):
+        """Loans recorded so far, read off the borrow_history key rather than counted"""
+        # AUTOINCREMENT ids are never reused, so the highest grows with every loan
+        return self.conn.execute("SELECT MAX(id) FROM borrow_history").fetchone()[0] or 0
+
+    def get_co_borrow_matrix(self):
+        """Get the sparse student x book loan matrix"""
+        matrix = CoBorrowMatrix()
+        rows = self.conn.execute(
+            "SELECT srn, book_id, MAX(student_name), MAX(book_title), MAX(genre), COUNT(*) "
+            "FROM borrow_history GROUP BY srn, book_id")
+        for srn, book_id, student_name, book_title, genre, count in rows:
+            matrix.add(srn, book_id, student_name, book_title, genre, count)
+        return matrix
+
+    def get_borrow_df(self, start=None, end=None):
+        """Get borrow history as DataFrame, optionally only loans borrowed start..end"""
+        import pandas as pd
+        df = self._history_query("", (), start, end)
+        if df.empty:
+            return pd.DataFrame()
+        df['borrow_date'] = pd.to_datetime(df['borrow_date'])
+        df['month'] = df['borrow_date'].dt.to_period('M').astype(str)
+        return df
+
+    # ---------------- due dates and fines ---------------- #
+
+    def loan_policy(self):
+        """The LoanPolicy deciding due dates and fines"""
+        from fines import LoanPolicy
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'loan_policy'").fetchone()
+        return LoanPolicy.from_dict(json.loads(row[0]) if row else None)
+
+    def set_loan_policy(self, policy):
+        """Replace the LoanPolicy"""
+        self.conn.execute("INSERT OR REPLACE INTO settings VALUES ('loan_policy', ?)",
+                          (json.dumps(policy.to_dict()),))
+
+    def student_classes(self):
+        """{srn: class} for students that belong to one"""
+        return dict(self.conn.execute(
+            "SELECT srn, class FROM students WHERE class IS NOT NULL"))
+
+    def open_loans_frame(self):
+        """DataFrame of every loan not yet returned"""
+        import pandas as pd
+        loans = self._history_query("WHERE return_date IS NULL", ())
+        for field in CATEGORY_FIELDS:
+            loans[field] = loans[field].astype('category')
+        loans['borrow_date'] = pd.to_datetime(loans['borrow_date'])
+        return loans
+
+    def run_fine_batch(self, today=None):
+        """Assess every open loan in one pass (see fines.assess)"""
+        from fines import assess
+        return assess(self.open_loans_frame(), self.loan_policy(), self.student_classes(),
+                      today or date.today())
+
+    def amount_owed(self, srn):
+        """(fines accrued on srn's open loans, number of them overdue) as of today"""
+        from fines import assess_loan
+        policy = self.loan_policy()
+        today = date.today().toordinal()
+        student = self.conn.execute(
+            "SELECT class FROM students WHERE srn = ?", (srn,)).fetchone()
+        student_class = student[0] if student else None
+        total, overdue = 0.0, 0
+        for genre, borrow_date in self.conn.execute(
+                "SELECT genre, borrow_date FROM borrow_history "
+                "WHERE srn = ? AND return_date IS NULL", (srn,)):
+            days, fine = assess_loan(policy, genre, student_class,
+                                     date.fromisoformat(borrow_date).toordinal(), today)
+            if days:
+                total += fine
+                overdue += 1
+        return total, overdue
+
+    # ---------------- bulk import/export ---------------- #
+
+    def _bulk_insert(self, source, rows, query, key, then=None):
+        """executemany rows in CHUNK_SIZE batches inside one transaction.
+
+        rows are (line number, values) with the key column first. A batch
+        that hits a duplicate is rolled back and retried a row at a time
+        to name the line and key, as the JSON backend does.
+        then(values), if given, runs on each inserted batch in the same transaction.
+        """
+        count = 0
+        with self._transaction():
+            while True:
+                chunk = list(islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                values = [values for _, values in chunk]
+                self.conn.execute("SAVEPOINT chunk")
+                try:
+                    self.conn.executemany(query, values)
+                except sqlite3.IntegrityError:
+                    self.conn.execute("ROLLBACK TO chunk")
+                    for line_no, row in chunk:
+                        try:
+                            self.conn.execute(query, row)
+                        except sqlite3.IntegrityError:
+                            raise ValueError(f"{source}: line {line_no}: "
+                                             f"duplicate {key} {row[0]}") from None
+                    raise
+                self.conn.execute("RELEASE chunk")
+                if then is not None:
+                    then(values)
+                count += len(chunk)
+        return count
+
+    def import_books(self, source, fmt=None):
+        """Add books from a CSV/JSON-lines file (book_id, title, genre[, copies]).
+
+        Rows are streamed in CHUNK_SIZE batches into a single transaction
+        that is rolled back if any row is invalid. Returns the number added.
+        """
+        # Kept only to update a loaded title index once the import commits
+        added = {}
+
+        def rows():
+            for line_no, row in read_rows(source, fmt):
+                book_id, book = parse_book_row(row, f"{source}: line {line_no}")
+                if self._title_index is not None:
+                    added[book_id] = book
+                yield line_no, (book_id, book['title'], book['genre'],
+                                book['copies'], book['available'])
+
+        def shelve_copies(books):
+            self.conn.executemany(
+                "INSERT INTO book_copies (book_id, copy) VALUES (?, ?)",
+                ((book_id, copy) for book_id, _, _, copies, _ in books
+                 for copy in range(1, copies + 1)))
+            self._bump_catalog()
+
+        count = self._bulk_insert(
+            source, rows(),
+            "INSERT INTO books (book_id, title, genre, copies, available) VALUES (?, ?, ?, ?, ?)",
+            'book_id', shelve_copies)
+        self._index_titles(added)
+        return count
+
+    def import_students(self, source, fmt=None):
+        """Add students from a CSV/JSON-lines file (srn, name, password).
+
+        Streamed in CHUNK_SIZE batches into one transaction, each batch's
+        passwords hashed together on a thread pool. Returns the number of
+        students added.
+        """
+        def rows():
+            rows = read_rows(source, fmt)
+            while chunk := list(islice(rows, CHUNK_SIZE)):
+                students = [(line_no, *parse_student_row(row, f"{source}: line {line_no}"))
+                            for line_no, row in chunk]
+                passwords = hash_passwords(student['password'] for _, _, student in students)
+                for (line_no, srn, student), password in zip(students, passwords):
+                    yield line_no, (srn, student['name'], password)
+
+        return self._bulk_insert(
+            source, rows(),
+            "INSERT INTO students (srn, name, password) VALUES (?, ?, ?)", 'srn')
+
+    def import_borrow_events(self, source, fmt=None):
+        """Replay historical loans from a CSV/JSON-lines file (event, srn, book_id, date).
+
+        Applied in file order with the same rules as borrow_book/return_book,
+        all in one transaction. Returns the number of events imported.
+        """
+        count = 0
+        with self._transaction():
+            for line_no, row in read_rows(source, fmt):
+                where = f"{source}: line {line_no}"
+                event, srn, book_id, day = parse_event_row(row, where)
+                student = self.conn.execute(
+                    "SELECT name FROM students WHERE srn = ?", (srn,)).fetchone()
+                if student is None:
+                    raise ValueError(f"{where}: unknown srn {srn}")
+                book = self.conn.execute(
+                    "SELECT title, genre FROM books WHERE book_id = ?", (book_id,)).fetchone()
+                if book is None:
+                    raise ValueError(f"{where}: unknown book_id {book_id}")
+
+                if event == 'borrow':
+                    if self._copy_of(book_id, srn, ON_LOAN) is not None:
+                        raise ValueError(f"{where}: {srn} already has {book_id}")
+                    if self._lend_copy(book_id, srn) is None:
+                        if self._on_hold_shelf(book_id):
+                            raise ValueError(f"{where}: {book_id} is on hold for another student")
+                        raise ValueError(f"{where}: no copy of {book_id} is available")
+                    self.conn.execute(
+                        "INSERT INTO borrow_history (srn, student_name, book_id, book_title, "
+                        "genre, borrow_date) VALUES (?, ?, ?, ?, ?, ?)",
+                        (srn, student[0], book_id, book[0], book[1], day))
+                else:
+                    loan = self.conn.execute(
+                        "SELECT id, borrow_date FROM borrow_history "
+                        "WHERE book_id = ? AND return_date IS NULL AND srn = ?",
+                        (book_id, srn)).fetchone()
+                    if loan is None:
+                        raise ValueError(f"{where}: {srn} has no open loan of {book_id}")
+                    if day < loan[1]:
+                        raise ValueError(f"{where}: returned before it was borrowed")
+                    self.conn.execute(
+                        "UPDATE borrow_history SET return_date = ?, duration = ? WHERE id = ?",
+                        (day, days_between(loan[1], day), loan[0]))
+                    self._shelve(book_id, self._copy_of(book_id, srn, ON_LOAN), day)
+                count += 1
+            _rebuild_stats(self.conn)
+        return count
+
+    def export_borrow_history(self, dest, fmt=None):
+        """Stream borrow_history to a CSV/JSON-lines file; returns the row count"""
+        return write_rows(dest, self.iter_borrow_history(), HISTORY_COLUMNS, fmt)
+
+    def archive_history(self, max_age_days=None):
+        """Nothing to move: date-range queries already use the borrow_date index"""
+        return 0
+
+
+def _with_period(where, params, start, end):
+    """Add borrow_date bounds ('YYYY-MM-DD', inclusive) to a WHERE clause"""
+    clauses = [where.removeprefix("WHERE ")] if where else []
+    params = list(params)
+    if start is not None:
+        clauses.append("borrow_date >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("borrow_date <= ?")
+        params.append(end)
+    return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _insert_database(conn, db):
+    """Insert a whole JSON-layout database dict"""
+    conn.executemany(
+        "INSERT INTO students (srn, name, password, class) VALUES (?, ?, ?, ?)",
+        ((srn, s['name'], s['password'], s.get('class')) for srn, s in db['students'].items()))
+    conn.execute(
+        "INSERT INTO admin (username, password) VALUES (?, ?)",
+        (db['admin']['username'], db['admin']['password']))
+    conn.executemany(
+        "INSERT INTO books (book_id, title, genre, copies, available) VALUES (?, ?, ?, ?, ?)",
+        ((book_id, b['title'], b['genre'], b.get('copies', 1), int(b['available']))
+         for book_id, b in db['books'].items()))
+    conn.executemany(
+        "INSERT INTO book_copies (book_id, copy) VALUES (?, ?)",
+        ((book_id, copy) for book_id, b in db['books'].items()
+         for copy in range(1, b.get('copies', 1) + 1)))
+    conn.executemany(
+        f"INSERT INTO borrow_history ({', '.join(HISTORY_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})",
+        (tuple(record.get(col) for col in HISTORY_COLUMNS)
+         for record in db['borrow_history']))
+    holds = HoldQueues.from_dict(db.get('holds')).to_dict()
+    conn.executemany(
+        "INSERT INTO holds (book_id, srn, ready_until) VALUES (?, ?, ?)",
+        [(book_id, srn, until) for book_id, shelf in holds['ready'].items()
+         for srn, until in shelf.items()] +
+        [(book_id, srn, None) for book_id, srns in holds['queues'].items() for srn in srns])
+    if 'copies_out' in db:
+        conn.executemany(
+            "UPDATE book_copies SET status = ?, srn = ? WHERE book_id = ? AND copy = ?",
+            ((status, srn, book_id, int(copy)) for book_id, out in db['copies_out'].items()
+             for copy, (status, srn) in out.items()))
+    else:
+        _assign_copies(conn)
+    if 'loan_policy' in db:
+        conn.execute("INSERT OR REPLACE INTO settings VALUES ('loan_policy', ?)",
+                     (json.dumps(db['loan_policy']),))
+    _rebuild_stats(conn)
+
+
+def _assign_copies(conn):
+    """Mark a copy out for each open loan and shelved hold, for data from before
+    copies were tracked"""
+    for status, query in (
+            (ON_LOAN, "SELECT book_id, srn FROM borrow_history WHERE return_date IS NULL"),
+            (ON_HOLD, "SELECT book_id, srn FROM holds WHERE ready_until IS NOT NULL")):
+        conn.executemany(
+            "UPDATE book_copies SET status = ?, srn = ? WHERE book_id = ? AND copy = "
+            "(SELECT MIN(copy) FROM book_copies WHERE book_id = ? AND status = ?)",
+            ((status, srn, book_id, book_id, AVAILABLE)
+             for book_id, srn in conn.execute(query).fetchall()))
+
+
+def _rebuild_stats(conn):
+    """Recompute borrow_stats from borrow_history"""
+    conn.execute("DELETE FROM borrow_stats")
+    for dimension, expression in STATS_DIMENSIONS.items():
+        conn.execute(
+            f"INSERT INTO borrow_stats (dimension, key, borrows, duration_sum, duration_count) "
+            f"SELECT ?, COALESCE({expression}, ''), COUNT(*), "
+            f"COALESCE(SUM(duration), 0), COUNT(duration) "
+            f"FROM borrow_history GROUP BY 2", (dimension,))
+
+
+def migrate_json_to_sqlite(json_file, sqlite_file):
+    """One-shot copy of a JSON database into a new SQLite database.
+
+    Archived months are streamed in a segment at a time ahead of the hot
+    history. The copy is checked against the library's borrow total and
+    sqlite_file is removed if the two differ.
+    """
+    # LibrarySystem would seed sample data in place of a missing database
+    if not os.path.exists(json_file):
+        raise FileNotFoundError(f"{json_file} does not exist")
+    if os.path.exists(sqlite_file):
+        raise FileExistsError(f"{sqlite_file} already exists")
+
+    # Loading upgrades older layouts (new_code.py's too) and replays the journal
+    lib = LibrarySystem(json_file)
+    expected = lib.get_borrow_stats().total
+    db = {**lib.snapshot_db(), 'borrow_history': lib.iter_borrow_history()}
+
+    conn = sqlite3.connect(sqlite_file, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        with _Transaction(conn):
+            _insert_database(conn, db)
+            count = conn.execute("SELECT COUNT(*) FROM borrow_history").fetchone()[0]
+            if count != expected:
+                raise ValueError(f"Copied {count} borrow records but {json_file} "
+                                 f"has {expected}; migration abandoned")
+    except BaseException:
+        conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(sqlite_file + suffix):
+                os.remove(sqlite_file + suffix)
+        raise
+    conn.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate a JSON library database to SQLite")
+    parser.add_argument('json_file')
+    parser.add_argument('sqlite_file')
+    args = parser.parse_args()
+    count = migrate_json_to_sqlite(args.json_file, args.sqlite_file)
+    print(f"Migrated {count} borrow records to {args.sqlite_file}")
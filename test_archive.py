@@ -0,0 +1,42 @@
+import pytest
+
+import history_archive
+from benchmark import generate_library
+from binary_snapshot import read_binary_meta
+from lib_management import LibrarySystem
+
+
+@pytest.fixture
+def lib(tmp_path):
+    """A two-year library whose loans older than a month are archived"""
+    db_file = str(tmp_path / 'library.json')
+    generate_library(db_file, 40, 30, 600)
+    return LibrarySystem(db_file)
+
+
+def lookups(lib):
+    """Every student's and book's loans as plain rows, in any order"""
+    frames = ([lib.student_history(srn) for srn in lib.db['students']] +
+              [lib.book_history(book_id) for book_id in lib.db['books']])
+    return [sorted(map(str, frame.astype(object).to_dict('records'))) for frame in frames]
+
+
+def without_keys(path):
+    """Segment meta as written before it listed srns and book_ids"""
+    meta = read_binary_meta(path)
+    meta.pop('keys')
+    return meta
+
+
+@pytest.mark.parametrize('old_meta', [False, True], ids=['keys', 'co_borrow'])
+def test_lookups_skip_segments_without_value(lib, monkeypatch, old_meta):
+    before = lookups(lib)
+    assert lib.archive_history(30) > 0
+    if old_meta:
+        monkeypatch.setattr(history_archive, 'read_binary_meta', without_keys)
+    lib = LibrarySystem(lib.db_file)
+    assert lookups(lib) == before
+    assert list(lib.archive.histories(field='srn', value='NOBODY')) == []
+    srn = next(iter(lib.db['students']))
+    for history in lib.archive.histories(field='srn', value=srn):
+        assert history.rows_with('srn', srn)
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from lib_management import LibrarySystem
+from sqlite_backend import SQLiteLibrarySystem
+
+TODAY = date.today().isoformat()
+
+
+@pytest.fixture(params=[LibrarySystem, SQLiteLibrarySystem], ids=['json', 'sqlite'])
+def lib(request, tmp_path):
+    """A sample library with one single-copy title, H1"""
+    lib = request.param(str(tmp_path / ('library.json' if request.param is LibrarySystem
+                                        else 'library.db')))
+    books = tmp_path / 'books.csv'
+    books.write_text("book_id,title,genre\nH1,Held Title,Fiction\n")
+    lib.import_books(str(books))
+    return lib
+
+
+def import_events(lib, tmp_path, *events):
+    source = tmp_path / 'events.csv'
+    source.write_text("event,srn,book_id,date\n" +
+                      ''.join(f"{event},{srn},H1,{TODAY}\n" for event, srn in events))
+    return lib.import_borrow_events(str(source))
+
+
+def shelve_for(lib, holder):
+    """Lend H1, queue holder for it and return it, leaving it on the hold shelf"""
+    assert lib.borrow_book('R25EH017', 'H1').startswith("Successfully")
+    assert lib.place_hold(holder, 'H1').startswith("Hold placed")
+    assert lib.return_book('R25EH017', 'H1').startswith("Successfully")
+
+
+def test_import_refuses_copy_held_for_another(lib, tmp_path):
+    shelve_for(lib, 'R25EH018')
+    with pytest.raises(ValueError, match="line 2: H1 is on hold for another student"):
+        import_events(lib, tmp_path, ('borrow', 'R25EH032'))
+    assert lib.borrow_book('R25EH032', 'H1') == "Book is on hold for another student!"
+
+
+def test_import_lends_held_copy_to_holder(lib, tmp_path):
+    shelve_for(lib, 'R25EH018')
+    assert import_events(lib, tmp_path, ('borrow', 'R25EH018')) == 1
+    assert lib.get_book('H1')['available'] == 0
+    assert lib.student_holds('R25EH018') == []
+    assert lib.return_book('R25EH018', 'H1').startswith("Successfully")
+    assert lib.get_book('H1')['available'] == 1
+
+
+def test_import_return_shelves_copy_for_holder(lib, tmp_path):
+    assert lib.borrow_book('R25EH017', 'H1').startswith("Successfully")
+    assert lib.place_hold('R25EH018', 'H1').startswith("Hold placed")
+    with pytest.raises(ValueError, match="line 3: H1 is on hold for another student"):
+        import_events(lib, tmp_path, ('return', 'R25EH017'), ('borrow', 'R25EH032'))
+    assert import_events(lib, tmp_path, ('return', 'R25EH017'), ('borrow', 'R25EH018')) == 2
+    assert lib.get_book('H1')['available'] == 0
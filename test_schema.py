@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+import schema
+from schema import SCHEMA_VERSION, VERSION_KEY, _Reader, migrate_json
+
+# A new_code.py (version 0) database: floats in loan_policy, single-copy books
+LEGACY_DB = {
+    'students': {'R1': {'name': 'Asha', 'password': 'x'}},
+    'admin': {'username': 'admin', 'password': 'admin123'},
+    'books': {'B1': {'title': 'Dune', 'genre': 'Fiction', 'available': False},
+              'B2': {'title': 'Emma', 'genre': 'Classic', 'available': True}},
+    'loan_policy': {'default_days': 14, 'fine_per_day': 12.5, 'max_fine': 3e7},
+    'history': [{'srn': 'R1', 'student': 'Asha', 'book': 'Emma', 'genre': 'Classic',
+                 'date': '2024-01-02'},
+                {'srn': 'R1', 'student': 'Asha', 'book': 'Dune', 'genre': 'Fiction',
+                 'date': '2024-02-03'}],
+}
+
+
+def test_reader_numbers_at_every_read_size(monkeypatch):
+    numbers = [12.5, 3e7, -0.25e-3, 1e+20, 7, -40]
+    text = json.dumps(numbers)
+    for size in range(1, len(text) + 1):
+        monkeypatch.setattr(schema, 'READ_SIZE', size)
+        assert list(_Reader(io.StringIO(text)).items()) == numbers, size
+
+
+@pytest.fixture
+def legacy_file(tmp_path):
+    source = tmp_path / 'library_db.json'
+    source.write_text(json.dumps(LEGACY_DB, separators=(',', ':')))
+    return source
+
+
+def test_migrate_json_at_every_read_size(legacy_file, monkeypatch):
+    text = legacy_file.read_text()
+    expected = json.loads(json.dumps(schema.upgrade(json.loads(text))))
+    for size in range(1, len(text) + 1):
+        monkeypatch.setattr(schema, 'READ_SIZE', size)
+        dest = legacy_file.with_name(f'migrated{size}.json')
+        assert migrate_json(str(legacy_file), str(dest)) == 2
+        migrated = json.loads(dest.read_text())
+        assert migrated.pop(VERSION_KEY) == SCHEMA_VERSION
+        assert migrated['loan_policy'] == LEGACY_DB['loan_policy'], size
+        assert migrated['borrow_history'] == expected['borrow_history'], size
+
+
+def test_migrate_json_counts_copies(legacy_file):
+    migrate_json(str(legacy_file))
+    books = json.loads(legacy_file.read_text())['books']
+    assert books['B1'] == {'title': 'Dune', 'genre': 'Fiction', 'copies': 1, 'available': 0}
+    assert books['B2'] == {'title': 'Emma', 'genre': 'Classic', 'copies': 1, 'available': 1}
@@ -0,0 +1,24 @@
+import pytest
+
+from benchmark import generate_library
+from lib_management import LibrarySystem
+from sqlite_backend import SQLiteLibrarySystem, migrate_json_to_sqlite
+
+
+def test_migrate_refuses_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        migrate_json_to_sqlite(str(tmp_path / 'missing.json'), str(tmp_path / 'library.db'))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_migrate_copies_archived_and_live_history(tmp_path):
+    json_file, sqlite_file = str(tmp_path / 'library.json'), str(tmp_path / 'library.db')
+    generate_library(json_file, 40, 30, 600)
+    lib = LibrarySystem(json_file)
+    assert lib.archive_history(30) > 0
+    records = sorted(str(dict(record)) for record in lib.iter_borrow_history())
+    assert len(records) == 600
+
+    assert migrate_json_to_sqlite(json_file, sqlite_file) == 600
+    copied = SQLiteLibrarySystem(sqlite_file).iter_borrow_history()
+    assert sorted(map(str, copied)) == records